@@ -0,0 +1,20 @@
+"""
+性能測定用のパッケージ
+
+router/inventory.py や models/db.py などを変更したときに、速くなったか・遅くなったかを
+同じ条件で比較するためのデータ投入とシナリオ実行をまとめる。
+
+    # DATABASE_URL のDB（PostgreSQL または SQLite）に合成データを投入
+    python -m benchmarks.seed --teams 5 --items 2000 --suppliers 50 --transactions 1000000
+
+    # アプリをプロセス内で動かして計測（TestClient）
+    python -m benchmarks.run inprocess --users 8 --duration 30 --output before.json
+
+    # 起動中のサーバーに対して計測
+    python -m benchmarks.run external --base-url http://localhost:8000 --users 32 --duration 60
+
+    # 前回の結果と比較（p95 が 20% 以上悪化したエンドポイントがあれば終了コード 1）
+    python -m benchmarks.run inprocess --output after.json --baseline before.json --max-regression 0.2
+
+locust がインストールされていれば、同じシナリオを benchmarks/locustfile.py から実行できる。
+"""
@@ -0,0 +1,44 @@
+"""
+locust から benchmarks のシナリオを実行する（locust は依存関係に含めていないため別途インストールする）
+
+    locust -f benchmarks/locustfile.py --host http://localhost:8000 --users 100 --spawn-rate 10
+
+チーム数は環境変数 BENCH_TEAMS（既定 1）で指定する。集計は locust に任せる。
+"""
+import itertools
+import os
+import random
+
+from locust import HttpUser, between, task
+
+from benchmarks.scenarios import VirtualUser
+from benchmarks.stats import Recorder
+
+BENCH_TEAMS = int(os.getenv("BENCH_TEAMS", "1"))
+_team_indexes = itertools.count()
+
+
+class LocustVirtualUser(VirtualUser):
+    def send(self, name: str, method: str, url: str, **kwargs):
+        # locust の統計が /scan/{code} などルートの形ごとにまとまるよう name を付ける
+        return self.client.request(method, url, name=name, **kwargs)
+
+
+class InventoriaUser(HttpUser):
+    wait_time = between(0.0, 0.5)
+
+    def on_start(self):
+        self.scenario = LocustVirtualUser(self.client, Recorder(), next(_team_indexes) % BENCH_TEAMS, random.Random())
+        self.scenario.start()
+
+    @task(6)
+    def scan(self):
+        self.scenario.scan()
+
+    @task(3)
+    def list_inventory(self):
+        self.scenario.list_inventory()
+
+    @task(1)
+    def edit_item(self):
+        self.scenario.edit_item()
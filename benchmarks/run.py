@@ -0,0 +1,102 @@
+"""
+シナリオを並列に実行して、エンドポイントごとのスループットと p50/p95/p99 を出力する
+
+inprocess はアプリを TestClient でプロセス内から呼び出す（ネットワークやワーカー数の影響を除いて
+ルーターとDBアクセスの変化を見る）。external は起動中のサーバーに httpx で接続する。
+仮想ユーザーはそれぞれ1スレッドで動き、チームを順番に割り当てる。
+
+    python -m benchmarks.run inprocess --users 8 --duration 30 --output result.json
+    python -m benchmarks.run external --base-url http://localhost:8000 --users 32 --baseline result.json
+"""
+from datetime import datetime
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import httpx
+
+from benchmarks.scenarios import VirtualUser
+from benchmarks.stats import Recorder, compare
+
+
+def _client_factory(args):
+    if args.mode == "inprocess":
+        from fastapi.testclient import TestClient
+        from main import app
+        return lambda: TestClient(app)
+    return lambda: httpx.Client(base_url=args.base_url, timeout=60)
+
+
+def run(args) -> dict:
+    recorder = Recorder()
+    make_client = _client_factory(args)
+    users = []
+    for i in range(args.users):
+        user = VirtualUser(make_client(), recorder, i % args.teams, random.Random(args.seed + i))
+        user.start()
+        users.append(user)
+
+    # ログインと商品一覧の取得は計測対象から外す
+    measured = Recorder()
+    for user in users:
+        user.recorder = measured
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=user.run, args=(deadline, args.think_time)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for user in users:
+        user.client.close()
+
+    return {
+        "mode": args.mode,
+        "started_at": datetime.now().isoformat(),
+        "users": args.users,
+        "teams": args.teams,
+        "duration_s": round(elapsed, 2),
+        "think_time_s": args.think_time,
+        "endpoints": measured.summary(elapsed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="APIの性能測定")
+    parser.add_argument("mode", choices=["inprocess", "external"])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=8, help="並列に動かす仮想ユーザー数")
+    parser.add_argument("--teams", type=int, default=1, help="仮想ユーザーに割り当てるチーム数（seed の --teams 以下）")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--think-time", type=float, default=0.0, help="操作間の平均待ち時間（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較する前回の結果のJSONファイル")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="p95 の悪化をこの割合まで許容する")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["comparison"] = compare(report["endpoints"], baseline["endpoints"])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    regressions = [
+        name for name, change in report.get("comparison", {}).items()
+        if change["change"] > args.max_regression
+    ]
+    if regressions:
+        print(f"NG: p95 が {args.max_regression:.0%} を超えて悪化しました: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+計測シナリオ（スキャン・在庫一覧・商品編集）
+
+1人の仮想ユーザーがログインしてチームの商品一覧を取得し、重みに応じて操作を選んで
+繰り返す。クライアントは httpx.Client と TestClient のどちらでもよい。
+"""
+from typing import Callable, List, Tuple
+import random
+import time
+
+from benchmarks.seed import BENCH_PASSWORD, bench_email
+from benchmarks.stats import Recorder
+
+
+class VirtualUser:
+    def __init__(self, client, recorder: Recorder, team_index: int, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.team_index = team_index
+        self.rng = rng
+        self.headers = {}
+        self.item_codes: List[str] = []
+
+    def request(self, name: str, method: str, url: str, ok_statuses: Tuple[int, ...] = (), **kwargs):
+        """リクエストを送り、name（ルートの形）ごとにレイテンシを記録する"""
+        kwargs.setdefault("headers", self.headers)
+        started = time.perf_counter()
+        response = self.send(name, method, url, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.recorder.record(name, elapsed_ms, response.status_code < 400 or response.status_code in ok_statuses)
+        return response
+
+    def send(self, name: str, method: str, url: str, **kwargs):
+        return self.client.request(method, url, **kwargs)
+
+    def start(self) -> None:
+        response = self.request(
+            "POST /api/auth/login", "POST", "/api/auth/login",
+            json={"email": bench_email(self.team_index), "password": BENCH_PASSWORD}, headers={},
+        )
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+        response = self.request("GET /item/", "GET", "/item/")
+        response.raise_for_status()
+        self.item_codes = [item["item_code"] for item in response.json()]
+        if not self.item_codes:
+            raise RuntimeError("商品がありません。先に python -m benchmarks.seed を実行してください")
+
+    def scan(self) -> None:
+        """QRコードを読み取り、入庫または出庫を1件登録する"""
+        code = self.rng.choice(self.item_codes)
+        self.request("GET /scan/{code}", "GET", f"/scan/{code}")
+        quantity = self.rng.choice([1, 1, 2, -1])
+        self.request("POST /transaction/", "POST", "/transaction/", json={
+            "item_code": code,
+            "action": "IN" if quantity > 0 else "OUT",
+            "quantity": quantity,
+            "updated_by": "benchmark",
+        })
+
+    def list_inventory(self) -> None:
+        self.request("GET /inventory/", "GET", "/inventory/")
+
+    def edit_item(self) -> None:
+        """商品を読み込んで価格を変更する（他の仮想ユーザーと競合した場合の409は正常として扱う）"""
+        code = self.rng.choice(self.item_codes)
+        response = self.request("GET /item/{item_code}", "GET", f"/item/{code}")
+        if response.status_code != 200:
+            return
+        self.request("PUT /item/{item_code}", "PUT", f"/item/{code}", ok_statuses=(409,), json={
+            "item_price": round(self.rng.uniform(100, 5000), 0),
+            "version": response.json().get("version"),
+        })
+
+    def tasks(self) -> List[Tuple[Callable[[], None], int]]:
+        """(操作, 重み) の一覧"""
+        return [(self.scan, 6), (self.list_inventory, 3), (self.edit_item, 1)]
+
+    def run(self, deadline: float, think_time: float = 0.0) -> None:
+        tasks, weights = zip(*self.tasks())
+        while time.perf_counter() < deadline:
+            self.rng.choices(tasks, weights)[0]()
+            if think_time:
+                time.sleep(self.rng.uniform(0, 2 * think_time))
@@ -0,0 +1,238 @@
+"""
+性能測定用の合成データの投入
+
+チームごとにユーザー（bench-{チームの連番}@example.com / パスワード共通）・商品・仕入先・
+価格表・取引を作成し、在庫スナップショット・登録時のチェックポイント・推移の集計も
+アプリと同じ状態にそろえる。取引は数百万件でもメモリに載せないよう、一定件数ずつ生成して
+挿入する。乱数のシードを固定しているため、同じ引数なら同じデータになる。
+ユーザーのメールアドレスが重複するため、空のDBに投入すること。
+
+    python -m benchmarks.seed --teams 5 --items 2000 --suppliers 50 --transactions 1000000
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Set
+import argparse
+import random
+import time
+import uuid
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session
+
+from models.importer import item_code_for, supplier_code_for
+from models.schemas import (
+    ActionType, Base, Item, ItemStock, RoleEnum, StockCheckpoint, Supplier, SupplierItem, Team, TeamMember,
+    Transactions, User,
+)
+
+BENCH_PASSWORD = "benchmark-password"
+BATCH_SIZE = 10000
+
+
+def bench_email(team_index: int) -> str:
+    return f"bench-{team_index}@example.com"
+
+
+def _insert_batches(db: Session, table, rows) -> int:
+    """rows を BATCH_SIZE 件ずつ挿入する（rows はジェネレーターでもよい）"""
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.execute(insert(table), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(table), batch)
+        count += len(batch)
+    return count
+
+
+def seed_team(
+    db: Session,
+    team_index: int,
+    items: int,
+    suppliers: int,
+    suppliers_per_item: int,
+    transactions: int,
+    days: int,
+    password_hash: str,
+    rng: random.Random,
+) -> dict:
+    """1チーム分のデータを投入する（コミットは呼び出し側で行う）"""
+    team = Team(name=f"bench-team-{team_index}", description="benchmark")
+    user = User(name=f"bench-{team_index}", email=bench_email(team_index), password_hash=password_hash)
+    db.add_all([team, user])
+    db.flush()
+    db.add(TeamMember(user_id=user.id, team_id=team.id, role=RoleEnum.owner))
+    team_id = team.id
+
+    started_at = datetime.now() - timedelta(days=days)
+    item_codes = [item_code_for(f"bench-item-{team_id}-{i}", team_id) for i in range(items)]
+    stock: Dict[uuid.UUID, int] = {code: rng.randint(0, 100) for code in item_codes}
+    last_moved: Dict[uuid.UUID, datetime] = dict.fromkeys(item_codes, started_at)
+    initial = dict(stock)
+    moved: Set[uuid.UUID] = set()
+
+    supplier_rows = []
+    for j in range(suppliers):
+        name = f"bench-supplier-{team_id}-{j}"
+        supplier_rows.append({
+            "supplier_code": supplier_code_for(name),
+            "team_id": team_id,
+            "supplier_type": ActionType.IN if j % 4 else ActionType.OUT,
+            "supplier_name": name,
+            "updated_at": started_at,
+            "updated_by": "benchmark",
+        })
+    _insert_batches(db, Supplier.__table__, supplier_rows)
+
+    # 商品ごとに仕入先を suppliers_per_item 件ずつ割り当てる
+    assigned: Dict[uuid.UUID, List[dict]] = {}
+    supplier_item_rows = []
+    for i, code in enumerate(item_codes):
+        chosen = rng.sample(supplier_rows, min(suppliers_per_item, len(supplier_rows)))
+        assigned[code] = chosen
+        for supplier in chosen:
+            lot_size = rng.choice([1, 6, 10, 12, 24])
+            supplier_item_rows.append({
+                "team_id": team_id,
+                "item_code": code,
+                "item_name": f"bench-item-{team_id}-{i}",
+                "supplier_code": supplier["supplier_code"],
+                "supplier_type": supplier["supplier_type"],
+                "supplier_name": supplier["supplier_name"],
+                "lot_price": round(lot_size * rng.uniform(50, 2000), 2),
+                "lot_size": lot_size,
+                "updated_at": started_at,
+                "updated_by": "benchmark",
+            })
+    _insert_batches(db, SupplierItem.__table__, supplier_item_rows)
+
+    def transaction_rows():
+        # 古い順に生成して、在庫と最終入出庫日時を追跡する（間隔は指数分布で、期間全体にほぼ均等に散らばる）
+        span = days * 86400
+        offset = 0.0
+        for _ in range(transactions):
+            offset = min(offset + rng.expovariate(transactions / span), span)
+            code = rng.choice(item_codes)
+            quantity = rng.randint(1, 20) if rng.random() < 0.55 else -rng.randint(1, 10)
+            moved_at = started_at + timedelta(seconds=offset)
+            supplier = rng.choice(assigned[code]) if assigned[code] else None
+            stock[code] += quantity
+            last_moved[code] = moved_at
+            moved.add(code)
+            yield {
+                "team_id": team_id,
+                "item_code": code,
+                "supplier_code": supplier["supplier_code"] if supplier else None,
+                "supplier_type": supplier["supplier_type"] if supplier else None,
+                "supplier_name": supplier["supplier_name"] if supplier else None,
+                "action": ActionType.IN if quantity > 0 else ActionType.OUT,
+                "quantity": quantity,
+                "updated_at": moved_at,
+                "updated_by": "benchmark",
+            }
+
+    # 商品は取引より先に登録し、在庫数は取引を生成し終えてから合わせる。アプリと同じく商品の更新日時は
+    # 最後の取引より後にして、台帳からの再計算（python -m models.stock rebuild）で取引を二重に数えないようにする
+    _insert_batches(db, Item.__table__, [
+        {
+            "item_code": code,
+            "team_id": team_id,
+            "item_name": f"bench-item-{team_id}-{i}",
+            "item_price": round(rng.uniform(100, 5000), 0),
+            "item_quantity": initial[code],
+            "created_at": started_at,
+            "updated_at": started_at,
+            "updated_by": "benchmark",
+        }
+        for i, code in enumerate(item_codes)
+    ])
+    _insert_batches(db, StockCheckpoint.__table__, [
+        {"item_code": code, "team_id": team_id, "taken_at": started_at, "stock": initial[code], "reason": "created"}
+        for code in item_codes
+    ])
+    inserted = _insert_batches(db, Transactions.__table__, transaction_rows())
+
+    item_table = Item.__table__
+    db.connection().execute(
+        update(item_table)
+        .where(item_table.c.item_code == bindparam("b_item_code"))
+        .values(item_quantity=bindparam("b_quantity"), updated_at=bindparam("b_updated_at")),
+        [
+            {
+                "b_item_code": code,
+                "b_quantity": stock[code],
+                "b_updated_at": last_moved[code] + timedelta(microseconds=1) if code in moved else started_at,
+            }
+            for code in item_codes
+        ],
+    )
+    _insert_batches(db, ItemStock.__table__, [
+        {"item_code": code, "team_id": team_id, "current_stock": stock[code], "last_moved_at": last_moved[code]}
+        for code in item_codes
+    ])
+    return {"team_id": team_id, "items": items, "suppliers": suppliers, "transactions": inserted}
+
+
+def seed(
+    db: Session,
+    teams: int,
+    items: int,
+    suppliers: int,
+    suppliers_per_item: int,
+    transactions: int,
+    days: int,
+    seed: int = 0,
+) -> List[dict]:
+    """teams チーム分のデータを投入してチームごとにコミットする（取引はチーム間で均等に分ける）"""
+    from models.history import rebuild_rollups
+    from router.auth import get_password_hash
+
+    rng = random.Random(seed)
+    password_hash = get_password_hash(BENCH_PASSWORD)
+    per_team = [transactions // teams + (1 if i < transactions % teams else 0) for i in range(teams)]
+    summaries = []
+    for team_index in range(teams):
+        started = time.perf_counter()
+        summary = seed_team(
+            db, team_index, items, suppliers, suppliers_per_item, per_team[team_index], days, password_hash, rng
+        )
+        summary["rollups"] = rebuild_rollups(db, team_id=summary["team_id"])
+        db.commit()
+        summary["seconds"] = round(time.perf_counter() - started, 1)
+        print(summary)
+        summaries.append(summary)
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="性能測定用の合成データの投入")
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--suppliers", type=int, default=20)
+    parser.add_argument("--suppliers-per-item", type=int, default=2)
+    parser.add_argument("--transactions", type=int, default=100000, help="全チーム合計の取引件数")
+    parser.add_argument("--days", type=int, default=365, help="取引を分布させる日数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--create-tables", action="store_true", help="テーブルがなければ作成する（SQLiteでの計測用）")
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal, engine
+
+    if args.create_tables:
+        Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        seed(
+            db, args.teams, args.items, args.suppliers, args.suppliers_per_item,
+            args.transactions, args.days, args.seed,
+        )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
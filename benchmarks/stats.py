@@ -0,0 +1,62 @@
+"""
+エンドポイントごとのレイテンシの集計と、前回の結果との比較
+"""
+from typing import Dict, List, Optional
+import statistics
+import threading
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Recorder:
+    """リクエストごとのレイテンシ（ミリ秒）をエンドポイント名ごとに記録する（スレッドセーフ）"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, elapsed_ms: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed_ms)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, dict]:
+        report = {}
+        for name, latencies in sorted(self.latencies.items()):
+            report[name] = {
+                "count": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(latencies) / duration, 2) if duration else None,
+                "p50_ms": _round(percentile(latencies, 50)),
+                "p95_ms": _round(percentile(latencies, 95)),
+                "p99_ms": _round(percentile(latencies, 99)),
+                "mean_ms": _round(statistics.fmean(latencies)),
+            }
+        return report
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict], metric: str = "p95_ms") -> Dict[str, dict]:
+    """
+    両方の結果にあるエンドポイントについて metric の変化率を求める
+    change が正なら遅くなっている（0.2 = 20% 悪化）
+    """
+    changes = {}
+    for name, stats in current.items():
+        before = baseline.get(name, {}).get(metric)
+        after = stats.get(metric)
+        if not before or after is None:
+            continue
+        changes[name] = {"baseline": before, "current": after, "change": round(after / before - 1, 4)}
+    return changes
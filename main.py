@@ -4,7 +4,12 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from router import item_router, supplier_router, supplier_item_router, transaction_router, inventory_router, auth_router
+from router import item_router, supplier_router, supplier_item_router, transaction_router, inventory_router, auth_router, metrics_router, scan_router, planning_router
+from models.instrumentation import start_request, finish_request, server_timing, repeated_statements
+from models.config import DEBUG, N_PLUS_ONE_THRESHOLD
+from models.namesync import resume_pending
+from models.jobs import job_queue
+from models.pubsub import broker
 from router.team import router as team_router
 import os
 
@@ -17,8 +22,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag", "Content-Disposition"],
 )
 
+# リクエストごとのDBクエリ数・DB時間・レイテンシを計測し、Server-Timingヘッダーで返す
+# デバッグモードでは同じSQLの繰り返し（N+1）を検出してログに出す
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    stats = start_request(track_statements=DEBUG)
+    response = await call_next(request)
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    elapsed = finish_request(stats, request.method, route_path, response.status_code)
+    response.headers["Server-Timing"] = server_timing(stats, elapsed)
+    for statement, count in repeated_statements(stats, N_PLUS_ONE_THRESHOLD):
+        print(f"N+1 suspected: {request.method} {route_path} ran {count} times: {' '.join(statement.split())[:300]}")
+    return response
+
+# 前回の起動で反映しきれなかった商品名・仕入先名の変更と、JOB_BACKEND=postgres の未実行のジョブを引き継ぐ
+# PUBSUB_BACKEND=postgres の場合は、他のプロセスでの書き込み（データ版数・在庫の変動）をキャッシュに反映するため受信を始める
+@app.on_event("startup")
+def start_background_workers():
+    resume_pending()
+    job_queue.start()
+    broker.listen()
+
 # Jinja2 templates
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
@@ -31,6 +59,9 @@ app.include_router(transaction_router)
 app.include_router(inventory_router)
 app.include_router(auth_router)
 app.include_router(team_router)
+app.include_router(metrics_router)
+app.include_router(scan_router)
+app.include_router(planning_router)
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
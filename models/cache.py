@@ -0,0 +1,66 @@
+"""
+プロセス内で使う小さなTTL付きLRUキャッシュ
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import threading
+import time
+
+
+class TTLCache:
+    """
+    件数上限（LRU）と有効期限（TTL）を持つスレッドセーフなキャッシュ
+    同期ハンドラはスレッドプールで実行されるため、操作はロックで保護する
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, self._MISSING)
+        return default if entry is self._MISSING else entry[0]
+
+    def pop_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """predicate(key, value) を満たすエントリをまとめて削除し、削除件数を返す"""
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,201 @@
+"""
+在庫チェックポイント (stock_checkpoint) による過去時点の在庫計算
+
+ある時点 T の在庫は、T 以前の直近のチェックポイントに、その後 T までの取引だけを足して求める。
+台帳全体ではなく「チェックポイント以降の取引」だけを読むため、月末時点の在庫なども
+履歴の長さに関係なく計算できる。
+
+チェックポイントは商品登録時・在庫数の直接設定時に自動で作成されるほか、
+`python -m models.checkpoint create [--team-id N] [--at 日時]` で定期的に作成する。
+"""
+from datetime import datetime
+from typing import Optional, List
+import argparse
+
+from sqlalchemy import func, case, select, update, insert, literal, or_, DateTime, String
+from sqlalchemy.orm import Session
+
+from models.schemas import Item, ItemStock, StockCheckpoint, Transactions
+from models.history import Movement
+
+
+def record_checkpoint(db: Session, item: Item, reason: str) -> None:
+    """商品の在庫数を直接設定したとき（登録・棚卸し）に、その時点の在庫を記録する"""
+    db.add(StockCheckpoint(
+        item_code=item.item_code,
+        team_id=item.team_id,
+        taken_at=item.updated_at or datetime.now(),
+        stock=item.item_quantity or 0,
+        reason=reason,
+    ))
+
+
+def adjust_checkpoints(db: Session, team_id: int, movements: List[Movement]) -> None:
+    """
+    過去の取引を更新・削除したとき、その取引より後のチェックポイントを補正する
+    （現在の在庫も同じ数量だけ増減しているため、過去の在庫計算と食い違わないようにする）
+    """
+    for item_code, moved_at, quantity, sign in movements:
+        if item_code is None or moved_at is None or not quantity:
+            continue
+        db.execute(
+            update(StockCheckpoint)
+            .where(
+                StockCheckpoint.team_id == team_id,
+                StockCheckpoint.item_code == item_code,
+                StockCheckpoint.taken_at >= moved_at,
+            )
+            .values(stock=StockCheckpoint.stock + sign * quantity)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _nearest_checkpoint(as_of: datetime, team_id: Optional[int], preceding: bool, name: str):
+    """商品ごとに as_of 直前（preceding=False の場合は直後）のチェックポイントを1件ずつ選ぶ"""
+    if preceding:
+        condition = StockCheckpoint.taken_at <= as_of
+        order = (StockCheckpoint.taken_at.desc(), StockCheckpoint.id.desc())
+    else:
+        condition = StockCheckpoint.taken_at > as_of
+        order = (StockCheckpoint.taken_at.asc(), StockCheckpoint.id.asc())
+    ranked = select(
+        StockCheckpoint.item_code,
+        StockCheckpoint.taken_at,
+        StockCheckpoint.stock,
+        StockCheckpoint.reason,
+        func.row_number().over(partition_by=StockCheckpoint.item_code, order_by=order).label("rank"),
+    ).where(condition)
+    if team_id is not None:
+        ranked = ranked.where(StockCheckpoint.team_id == team_id)
+    ranked = ranked.subquery()
+    return select(ranked).where(ranked.c.rank == 1).subquery(name)
+
+
+def stock_as_of_select(as_of: datetime, team_id: Optional[int] = None):
+    """
+    as_of 時点の商品ごとの在庫を求めるSELECT（列は /inventory と同じ）
+    直前のチェックポイントがない商品は、直後のチェックポイント（なければ現在の在庫）から
+    as_of 以降の取引を差し引いて求める。as_of より後に登録された商品（created_at または
+    登録時のチェックポイントで判定）は含めない
+    """
+    previous = _nearest_checkpoint(as_of, team_id, preceding=True, name="previous_checkpoint")
+    following = _nearest_checkpoint(as_of, team_id, preceding=False, name="following_checkpoint")
+
+    forward = (
+        select(
+            Transactions.item_code,
+            func.sum(Transactions.quantity).label("quantity"),
+            func.max(Transactions.updated_at).label("last_moved_at"),
+        )
+        .join(previous, Transactions.item_code == previous.c.item_code)
+        .where(Transactions.updated_at > previous.c.taken_at, Transactions.updated_at <= as_of)
+        .group_by(Transactions.item_code)
+        .subquery("forward")
+    )
+    backward = (
+        select(Transactions.item_code, func.sum(Transactions.quantity).label("quantity"))
+        .outerjoin(following, Transactions.item_code == following.c.item_code)
+        .where(
+            Transactions.updated_at > as_of,
+            or_(following.c.taken_at.is_(None), Transactions.updated_at <= following.c.taken_at),
+            Transactions.item_code.notin_(select(previous.c.item_code)),
+        )
+        .group_by(Transactions.item_code)
+    )
+    if team_id is not None:
+        backward = backward.where(Transactions.team_id == team_id)
+    backward = backward.subquery("backward")
+
+    stock = case(
+        (previous.c.stock.isnot(None), previous.c.stock + func.coalesce(forward.c.quantity, 0)),
+        else_=func.coalesce(following.c.stock, ItemStock.current_stock, Item.item_quantity, 0)
+        - func.coalesce(backward.c.quantity, 0),
+    )
+    query = (
+        select(
+            Item.item_code,
+            Item.team_id,
+            Item.item_name,
+            stock.label("current_stock"),
+            stock.label("item_quantity"),
+            func.coalesce(forward.c.last_moved_at, previous.c.taken_at, literal(as_of, DateTime)).label("updated_at"),
+        )
+        .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+        .outerjoin(previous, Item.item_code == previous.c.item_code)
+        .outerjoin(following, Item.item_code == following.c.item_code)
+        .outerjoin(forward, Item.item_code == forward.c.item_code)
+        .outerjoin(backward, Item.item_code == backward.c.item_code)
+        .where(
+            or_(Item.created_at.is_(None), Item.created_at <= as_of),
+            or_(
+                previous.c.item_code.isnot(None),
+                following.c.reason.is_(None),
+                following.c.reason != "created",
+            )
+        )
+    )
+    if team_id is not None:
+        query = query.where(Item.team_id == team_id)
+    return query
+
+
+def create_checkpoints(
+    db: Session,
+    team_id: Optional[int] = None,
+    taken_at: Optional[datetime] = None,
+    reason: str = "periodic",
+) -> int:
+    """
+    全商品のチェックポイントを作成する（コミットは呼び出し側で行う）
+    taken_at を省略した場合は現在の在庫スナップショットを、指定した場合はその時点の在庫を記録する
+    """
+    if taken_at is None:
+        source = (
+            select(
+                Item.item_code,
+                Item.team_id,
+                literal(datetime.now(), DateTime),
+                func.coalesce(ItemStock.current_stock, Item.item_quantity, 0),
+                literal(reason, String),
+            )
+            .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+        )
+        if team_id is not None:
+            source = source.where(Item.team_id == team_id)
+    else:
+        as_of = stock_as_of_select(taken_at, team_id).subquery()
+        source = select(
+            as_of.c.item_code,
+            as_of.c.team_id,
+            literal(taken_at, DateTime),
+            as_of.c.current_stock,
+            literal(reason, String),
+        )
+    result = db.execute(
+        insert(StockCheckpoint).from_select(["item_code", "team_id", "taken_at", "stock", "reason"], source)
+    )
+    return result.rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在庫チェックポイントの管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    create = subparsers.add_parser("create", help="全商品の在庫チェックポイントを作成")
+    create.add_argument("--team-id", type=int, default=None)
+    create.add_argument("--at", type=datetime.fromisoformat, default=None, help="この時点の在庫を記録する（例: 2025-03-31T23:59:59）")
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "create":
+            count = create_checkpoints(db, team_id=args.team_id, taken_at=args.at)
+            db.commit()
+            print(f"Created {count} stock checkpoints")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
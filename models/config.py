@@ -9,6 +9,14 @@ DB_PATH = os.getenv("DB_PATH")
 DIR_SQL = os.getenv("DIR_SQL")
 # DATABASE_URL = f"sqlite:///./{DB_PATH}"
 DATABASE_URL = os.getenv("DATABASE_URL")
+# 非同期エンジン用のURL（未設定の場合はDATABASE_URLのドライバをasyncpgに置き換える）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+# コネクションプールの設定
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 DOMAIN = os.getenv("DOMAIN")
 # デフォルトのTEAM_IDを設定
 default_team_id = "550e8400-e29b-41d4-a716-446655440000"
@@ -21,4 +29,69 @@ except ValueError:
 TEAM_NAME = os.getenv("TEAM_NAME")
 DEBUG = bool(os.getenv("DEBUG"))
 TZ = pytz.timezone("Asia/Tokyo")
+# 取引履歴APIの1ページあたりの件数
+TRANSACTION_PAGE_SIZE = int(os.getenv("TRANSACTION_PAGE_SIZE", "100"))
+TRANSACTION_PAGE_SIZE_MAX = int(os.getenv("TRANSACTION_PAGE_SIZE_MAX", "1000"))
+# チーム所属情報のキャッシュ（秒・件数）
+TEAM_MEMBERSHIP_CACHE_TTL = float(os.getenv("TEAM_MEMBERSHIP_CACHE_TTL", "60"))
+TEAM_MEMBERSHIP_CACHE_SIZE = int(os.getenv("TEAM_MEMBERSHIP_CACHE_SIZE", "10000"))
+# 認証済みトークンのキャッシュ件数
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# パスワードハッシュ計算の同時実行数
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+# デバッグ時、1リクエストで同じSQLがこの回数以上実行されたらN+1として警告する
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "3"))
+# 在庫変動の配信方式（memory: プロセス内 / postgres: LISTEN/NOTIFY）
+PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "memory")
+# PUBSUB_BACKEND=postgres で受信用の接続が切れた場合に再接続するまでの待ち時間の基準と上限（秒、失敗するごとに倍）
+PUBSUB_RETRY_BASE_SECONDS = float(os.getenv("PUBSUB_RETRY_BASE_SECONDS", "1"))
+PUBSUB_RETRY_MAX_SECONDS = float(os.getenv("PUBSUB_RETRY_MAX_SECONDS", "60"))
+# /inventory/stream で接続維持のために送るハートビートの間隔（秒）
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+# 在庫推移APIで1回に返す最大の点数
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "2000"))
+# エクスポート時に1回でDBから取り出す件数
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+# 商品・価格表の一括取り込みで受け付ける最大行数
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "10000"))
+# 商品検索インデックスの保持時間（秒）とチーム数の上限
+ITEM_SEARCH_CACHE_TTL = float(os.getenv("ITEM_SEARCH_CACHE_TTL", "300"))
+ITEM_SEARCH_CACHE_SIZE = int(os.getenv("ITEM_SEARCH_CACHE_SIZE", "1000"))
+# スキャン用キャッシュの保持時間（秒）と件数の上限
+SCAN_CACHE_TTL = float(os.getenv("SCAN_CACHE_TTL", "300"))
+SCAN_CACHE_SIZE = int(os.getenv("SCAN_CACHE_SIZE", "50000"))
+# Idempotency-Key で受け付けたレスポンスを保存しておく秒数と、メモリ上に持つ件数
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# 期限切れのレスポンスを削除するジョブを積む間隔（秒）
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+
+# 発注計画: 出庫数を平均する日数・リードタイム（日）・欠品させない確率の既定値
+PLANNING_WINDOW_DAYS = int(os.getenv("PLANNING_WINDOW_DAYS", "28"))
+PLANNING_LEAD_TIME_DAYS = float(os.getenv("PLANNING_LEAD_TIME_DAYS", "7"))
+PLANNING_SERVICE_LEVEL = float(os.getenv("PLANNING_SERVICE_LEVEL", "0.95"))
+# 発注計画: 1回の発注にかかる費用（円）と、単価に対する年間の保管費の割合
+PLANNING_ORDER_COST = float(os.getenv("PLANNING_ORDER_COST", "1000"))
+PLANNING_HOLDING_RATE = float(os.getenv("PLANNING_HOLDING_RATE", "0.2"))
+# 発注計画の計算結果を保持する秒数と件数
+PLANNING_CACHE_TTL = float(os.getenv("PLANNING_CACHE_TTL", "600"))
+PLANNING_CACHE_SIZE = int(os.getenv("PLANNING_CACHE_SIZE", "1000"))
+
+# 商品名・仕入先名の変更を取引・価格表の写しに反映するジョブ
+# 1回のUPDATEで書き換える行数・1回の実行（tick）で書き換える行数の上限（残りは積み直したジョブで書き換える）
+NAME_SYNC_CHUNK_SIZE = int(os.getenv("NAME_SYNC_CHUNK_SIZE", "1000"))
+NAME_SYNC_TICK_ROWS = int(os.getenv("NAME_SYNC_TICK_ROWS", "10000"))
+
+# コミット後の後処理（在庫変動の配信など）を行うジョブキュー（memory: プロセス内 / postgres: background_job テーブル）
+# postgres にする場合は PUBSUB_BACKEND も postgres にする
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")
+# ワーカーのスレッド数・失敗したジョブの最大試行回数・再実行までの待ち時間の基準（秒、失敗するごとに倍）
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "1"))
+# JOB_BACKEND=postgres の場合に他のプロセスが積んだジョブを確認する間隔（秒）
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# 一括登録APIで受け付ける最大件数
+TRANSACTION_BULK_MAX = int(os.getenv("TRANSACTION_BULK_MAX", "1000"))
 # conn = sqlite3.connect(DB_PATH)
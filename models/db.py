@@ -1,19 +1,120 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import Session
-from models.config import DATABASE_URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from starlette.concurrency import run_in_threadpool
+from models.config import (
+    DATABASE_URL, ASYNC_DATABASE_URL,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+)
 from models.schemas import Base
+from models.instrumentation import instrument_engine, InstrumentedQueuePool, InstrumentedAsyncQueuePool
 
 # 
 
+def _engine_options(url, is_async: bool = False) -> dict:
+    """コネクションプールの設定（SQLiteはプールの種類が異なるため件数系の設定を渡さない）"""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+def _async_url(url):
+    """同期用のURLから非同期ドライバのURLを作る"""
+    if ASYNC_DATABASE_URL:
+        return ASYNC_DATABASE_URL
+    url = make_url(url)
+    drivers = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+    return url.set(drivername=drivers.get(url.get_backend_name(), url.drivername))
+
 # engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-engine =create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+instrument_engine(engine, "sync")
 SessionLocal = sessionmaker(bind=engine)
 # Base.metadata.create_all(bind=engine)  # 手動マイグレーションのため無効化
 
+# 非同期エンジンはドライバ（asyncpg / aiosqlite）が必要になるため、最初に使われたときに作成する
+async_engine = None
+AsyncSessionLocal = None
+_async_available = None
+
+def async_driver_available() -> bool:
+    """非同期ドライバと greenlet がインストールされているか"""
+    global _async_available
+    if _async_available is None:
+        try:
+            import greenlet  # noqa: F401
+            make_url(_async_url(DATABASE_URL)).get_dialect().import_dbapi()
+            _async_available = True
+        except ImportError as e:
+            print(f"Async database driver is not available ({e}); async endpoints use the sync engine")
+            _async_available = False
+    return _async_available
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        url = _async_url(DATABASE_URL)
+        async_engine = create_async_engine(url, **_engine_options(url, is_async=True))
+        instrument_engine(async_engine.sync_engine, "async")
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    return async_engine
+
+class ThreadedSession:
+    """
+    非同期ドライバがない環境で AsyncSession の代わりに使うセッション
+    同期のセッションの操作をスレッドプールで実行し、イベントループを止めない
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self.session.execute, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await run_in_threadpool(self.session.get, *args, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.session.delete, instance)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.session.refresh, instance)
+
+    async def commit(self):
+        await run_in_threadpool(self.session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.session.close)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    if not async_driver_available():
+        db = ThreadedSession(SessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
+        return
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,144 @@
+"""
+台帳・在庫のエクスポート
+
+クエリ結果を yield_per で一定件数ずつ取り出し（PostgreSQL ではサーバーサイドカーソル）、
+CSV / NDJSON / Parquet に変換しながら送り出す。全件をメモリに載せないため、
+件数が増えてもメモリ使用量は一定になる。
+
+レスポンスを返し終わるまでDBを読み続けるため、セッションはリクエストの依存関係ではなく
+ジェネレーターの中で作成・破棄する。
+"""
+from datetime import datetime
+from typing import Iterator, List, Tuple
+import csv
+import enum
+import io
+import json
+import uuid
+
+from models.config import EXPORT_CHUNK_SIZE
+from models.db import SessionLocal
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# (列名, 型)  型は str / int / float / datetime
+Columns = List[Tuple[str, str]]
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _iter_batches(statement) -> Iterator[list]:
+    db = SessionLocal()
+    try:
+        result = db.execute(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield rows
+    finally:
+        db.close()
+
+
+def _csv(batches: Iterator[list], columns: Columns) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Excelで開いたときに文字化けしないようBOMを付ける
+    buffer.write("\ufeff")
+    writer.writerow([name for name, _ in columns])
+    for rows in batches:
+        for row in rows:
+            writer.writerow([
+                value.isoformat() if isinstance(value, datetime) else _plain(value)
+                for value in row
+            ])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson(batches: Iterator[list], columns: Columns) -> Iterator[bytes]:
+    names = [name for name, _ in columns]
+    for rows in batches:
+        lines = [
+            json.dumps({name: _plain(value) for name, value in zip(names, row)}, ensure_ascii=False, default=_json_default)
+            for row in rows
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """ParquetWriter の出力を溜めておき、行グループごとに取り出すための書き込み先"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet(batches: Iterator[list], columns: Columns) -> Iterator[bytes]:
+    types = {"str": pyarrow.string(), "int": pyarrow.int64(), "float": pyarrow.float64(), "datetime": pyarrow.timestamp("us")}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            # 1バッチを1つの行グループとして書き出す
+            arrays = [
+                pyarrow.array([_plain(row[i]) for row in rows], type=schema.field(i).type)
+                for i in range(len(columns))
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    return pyarrow is not None
+
+
+def stream_export(statement, columns: Columns, format: str) -> Iterator[bytes]:
+    """
+    SELECTの結果を指定の形式で少しずつ書き出すジェネレーター
+    SELECTの列の並びは columns と一致させる
+    """
+    writers = {"csv": _csv, "ndjson": _ndjson, "parquet": _parquet}
+    return writers[format](_iter_batches(statement), columns)
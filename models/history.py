@@ -0,0 +1,148 @@
+"""
+在庫推移の集計 (stock_rollup) の更新と再構築
+
+取引を登録・更新・削除したときは同じセッション内で apply_rollup_movements を呼び、
+時間帯ごとの入庫数・出庫数を増減させる。グラフ用のAPIは台帳ではなくこの集計を読むため、
+1年分の日次推移でも数百行で済む。
+台帳から作り直す場合は `python -m models.history rebuild [--team-id N]` を実行する。
+"""
+from datetime import datetime
+from typing import Optional, List, Tuple
+import argparse
+import uuid
+
+from sqlalchemy import func, case, select, delete, insert, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models.schemas import StockRollup, Transactions
+from models.versions import bump_team_version
+
+RESOLUTIONS = ("hour", "day")
+
+# (item_code, 取引日時, 数量, 符号)  符号は取引の追加で1、取り消しで-1
+Movement = Tuple[uuid.UUID, datetime, int, int]
+
+
+def bucket_start(moved_at: datetime, resolution: str) -> datetime:
+    """取引日時が属する集計区間の開始時刻"""
+    if resolution == "hour":
+        return moved_at.replace(minute=0, second=0, microsecond=0)
+    return moved_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def apply_rollup_movements(db: Session, team_id: int, movements: List[Movement]) -> None:
+    """
+    取引の追加・取り消しを集計に反映する（コミットは呼び出し側で行う）
+    同じ区間への変動は1行にまとめてから、区間ごとに1回の UPSERT で加算する
+    """
+    rows = {}
+    for item_code, moved_at, quantity, sign in movements:
+        if item_code is None or moved_at is None:
+            continue
+        for resolution in RESOLUTIONS:
+            key = (item_code, resolution, bucket_start(moved_at, resolution))
+            row = rows.setdefault(key, {
+                "item_code": item_code,
+                "resolution": resolution,
+                "bucket_start": key[2],
+                "team_id": team_id,
+                "quantity_in": 0,
+                "quantity_out": 0,
+                "net": 0,
+                "transaction_count": 0,
+            })
+            row["quantity_in"] += sign * max(quantity, 0)
+            row["quantity_out"] += sign * max(-quantity, 0)
+            row["net"] += sign * quantity
+            row["transaction_count"] += sign
+    if not rows:
+        return
+
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(StockRollup)
+    table = StockRollup.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["item_code", "resolution", "bucket_start"],
+        set_={
+            name: table.c[name] + stmt.excluded[name]
+            for name in ("quantity_in", "quantity_out", "net", "transaction_count")
+        }
+    )
+    db.execute(stmt, list(rows.values()))
+
+
+def _bucket_expression(db: Session, resolution: str):
+    if db.bind.dialect.name == "postgresql":
+        return func.date_trunc(resolution, Transactions.updated_at)
+    # SQLite の DateTime 列と同じ文字列形式で区切る
+    fmt = "%Y-%m-%d %H:00:00.000000" if resolution == "hour" else "%Y-%m-%d 00:00:00.000000"
+    return func.strftime(fmt, Transactions.updated_at)
+
+
+def rebuild_rollups(db: Session, team_id: Optional[int] = None, item_code: Optional[uuid.UUID] = None) -> int:
+    """
+    台帳から集計を作り直す（コミットは呼び出し側で行う）
+    team_id / item_code を指定した場合はその範囲だけを再計算する
+    """
+    stmt = delete(StockRollup)
+    if team_id is not None:
+        stmt = stmt.where(StockRollup.team_id == team_id)
+    if item_code is not None:
+        stmt = stmt.where(StockRollup.item_code == item_code)
+    db.execute(stmt)
+
+    count = 0
+    for resolution in RESOLUTIONS:
+        bucket = _bucket_expression(db, resolution)
+        source = (
+            select(
+                Transactions.item_code,
+                literal(resolution),
+                bucket,
+                Transactions.team_id,
+                func.sum(case((Transactions.quantity > 0, Transactions.quantity), else_=0)),
+                func.sum(case((Transactions.quantity < 0, -Transactions.quantity), else_=0)),
+                func.sum(Transactions.quantity),
+                func.count(),
+            )
+            .where(Transactions.item_code.isnot(None), Transactions.updated_at.isnot(None))
+            .group_by(Transactions.item_code, Transactions.team_id, bucket)
+        )
+        if team_id is not None:
+            source = source.where(Transactions.team_id == team_id)
+        if item_code is not None:
+            source = source.where(Transactions.item_code == item_code)
+        result = db.execute(
+            insert(StockRollup).from_select(
+                ["item_code", "resolution", "bucket_start", "team_id",
+                 "quantity_in", "quantity_out", "net", "transaction_count"],
+                source
+            )
+        )
+        count += result.rowcount
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在庫推移の集計の管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="台帳から在庫推移の集計を再構築")
+    rebuild.add_argument("--team-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            count = rebuild_rollups(db, team_id=args.team_id)
+            db.commit()
+            bump_team_version(args.team_id, "inventory")
+            print(f"Rebuilt {count} stock rollup rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
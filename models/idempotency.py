@@ -0,0 +1,151 @@
+"""
+Idempotency-Key で受け付けたレスポンスの保存
+
+スキャナーが応答を受け取れずに同じリクエストを再送しても、書き込みを繰り返さずに
+最初のレスポンスを返せるよう、(team_id, エンドポイント, キー) ごとにレスポンスを保存する。
+保存は書き込みと同じDBトランザクションで行うため、書き込みだけが確定してキーが残らない
+ということはない。完了したレスポンスは変わらないので、再送が続いてもDBを読まないよう
+メモリ上にも保持する。
+
+期限切れの行は同じキーが再び使われたときに上書きし、残りは IDEMPOTENCY_PURGE_INTERVAL 秒に1回
+ジョブキューで削除する（手動で削除する場合は `python -m models.idempotency purge`）。
+"""
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+import argparse
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models.cache import TTLCache
+from models.config import IDEMPOTENCY_TTL, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_PURGE_INTERVAL
+from models.jobs import job, job_queue
+from models.schemas import IdempotencyRecord
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: str
+
+
+# (team_id, scope, key) -> StoredResponse
+_responses = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+
+
+def fingerprint(payload) -> str:
+    """リクエストボディのハッシュ（同じキーで内容の違うリクエストが来たことを検出する）"""
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def find_response(db: Session, team_id: int, scope: str, key: str) -> Optional[StoredResponse]:
+    cache_key = (team_id, scope, key)
+    stored = _responses.get(cache_key)
+    if stored is not None:
+        return stored
+    row = db.execute(
+        select(IdempotencyRecord.fingerprint, IdempotencyRecord.status_code, IdempotencyRecord.response_body)
+        .where(
+            IdempotencyRecord.team_id == team_id,
+            IdempotencyRecord.scope == scope,
+            IdempotencyRecord.key == key,
+            IdempotencyRecord.expires_at > datetime.now(),
+        )
+    ).first()
+    if row is None:
+        return None
+    stored = StoredResponse(*row)
+    _responses.set(cache_key, stored)
+    return stored
+
+
+def save_response(db: Session, team_id: int, scope: str, key: str, stored: StoredResponse) -> bool:
+    """
+    レスポンスを保存する（コミットは呼び出し側で書き込みと一緒に行う）
+    同じキーの行が期限切れなら上書きし、期限内の行がある場合は保存せずにFalseを返す
+    """
+    now = datetime.now()
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(IdempotencyRecord).values(
+        team_id=team_id,
+        scope=scope,
+        key=key,
+        fingerprint=stored.fingerprint,
+        status_code=stored.status_code,
+        response_body=stored.body,
+        created_at=now,
+        expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["team_id", "scope", "key"],
+        set_={
+            name: stmt.excluded[name]
+            for name in ("fingerprint", "status_code", "response_body", "created_at", "expires_at")
+        },
+        where=IdempotencyRecord.expires_at <= now,
+    )
+    return db.execute(stmt).rowcount > 0
+
+
+def cache_response(team_id: int, scope: str, key: str, stored: StoredResponse) -> None:
+    """コミット後に呼び、次の再送をDBに問い合わせずに返せるようにする"""
+    _responses.set((team_id, scope, key), stored)
+
+
+def purge_expired(db: Session) -> int:
+    result = db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expires_at <= datetime.now()))
+    return result.rowcount
+
+
+@job("purge_idempotency")
+def _purge_job():
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        purge_expired(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+_last_purge = time.monotonic()
+_purge_lock = threading.Lock()
+
+
+def schedule_purge() -> None:
+    """レスポンスの保存後に呼び、前回から IDEMPOTENCY_PURGE_INTERVAL 秒たっていれば期限切れの削除を積む"""
+    global _last_purge
+    with _purge_lock:
+        if time.monotonic() - _last_purge < IDEMPOTENCY_PURGE_INTERVAL:
+            return
+        _last_purge = time.monotonic()
+    job_queue.enqueue("purge_idempotency", key="purge_idempotency")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Idempotency-Key の保存内容の管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("purge", help="期限切れのレスポンスを削除")
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "purge":
+            count = purge_expired(db)
+            db.commit()
+            print(f"Purged {count} idempotency records")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
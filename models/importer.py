@@ -0,0 +1,315 @@
+"""
+商品・仕入先別商品（価格表）の一括取り込み
+
+CSV / XLSX を読み込み、商品コードを create_item と同じ uuid5 でまとめて計算し、
+既存の行とは1回のクエリで突き合わせる。PostgreSQL では COPY で一時テーブルに流し込んでから
+INSERT ... SELECT ... ON CONFLICT で本テーブルへ反映する（それ以外のDBでは executemany）。
+行ごとの結果を返す（商品は created / exists / error、価格表は inserted / updated / unchanged / error）。
+価格表は既存の値と比べ、変わっていない行は書き込まない。
+
+    python -m models.importer items --team-id 1 --updated-by admin items.csv
+    python -m models.importer supplier-items --team-id 1 --updated-by admin prices.xlsx
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+import argparse
+import csv
+import io
+import uuid
+
+from sqlalchemy import select, insert, text, Table
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import Session
+
+from models.config import IMPORT_MAX_ROWS
+from models.schemas import ActionType, Item, ItemStock, StockCheckpoint, Supplier, SupplierItem
+from models.versions import bump_team_version
+
+
+def item_code_for(item_name: str, team_id: int) -> uuid.UUID:
+    """create_item と同じ規則で商品名から商品コードを作る"""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"item-{item_name}-{team_id}")
+
+
+def supplier_code_for(supplier_name: str) -> uuid.UUID:
+    """create_supplier と同じ規則で仕入先名から仕入先コードを作る"""
+    return uuid.uuid5(uuid.NAMESPACE_URL, "supplier-" + supplier_name)
+
+
+def read_rows(data: bytes, filename: str) -> List[Dict[str, str]]:
+    """CSV（UTF-8 / BOM付き可）または XLSX を見出し行付きの辞書のリストとして読み込む"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            import pandas
+            frame = pandas.read_excel(io.BytesIO(data), dtype=str, keep_default_na=False)
+        except ImportError:
+            raise ValueError("XLSX形式を読み込むには openpyxl をインストールしてください")
+        except Exception as e:
+            # 壊れたファイルは zipfile や openpyxl の例外になるため、入力の誤りとしてまとめて扱う
+            raise ValueError(f"XLSXファイルを読み込めません: {e}")
+        rows = frame.to_dict(orient="records")
+    else:
+        rows = list(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))))
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise ValueError(f"一度に取り込める行数は{IMPORT_MAX_ROWS}行までです")
+    return [{str(key).strip(): (value or "").strip() for key, value in row.items() if key is not None} for row in rows]
+
+
+def _optional(row: dict, key: str, cast):
+    value = row.get(key, "")
+    return cast(value) if value != "" else None
+
+
+def _copy_merge(db: Session, table: Table, rows: List[dict], conflict: List[str], update: List[str]) -> None:
+    """
+    PostgreSQL: COPY で一時テーブルに読み込み、INSERT ... SELECT ... ON CONFLICT で反映する
+    update が空の場合は既存の行を変更しない
+    """
+    columns = list(rows[0])
+    staging = f"{table.name}_import"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([r"\N" if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+
+    column_list = ", ".join(columns)
+    db.execute(text(
+        f"CREATE TEMP TABLE {staging} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    ))
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+    finally:
+        cursor.close()
+    if update:
+        action = "DO UPDATE SET " + ", ".join(f"{column} = EXCLUDED.{column}" for column in update)
+    else:
+        action = "DO NOTHING"
+    db.execute(text(
+        f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} "
+        f"ON CONFLICT ({', '.join(conflict)}) {action}"
+    ))
+
+
+def _merge(db: Session, table: Table, rows: List[dict], conflict: List[str], update: List[str]) -> None:
+    if not rows:
+        return
+    if db.bind.dialect.name == "postgresql":
+        _copy_merge(db, table, rows, conflict, update)
+        return
+    stmt = sqlite.insert(table)
+    if update:
+        stmt = stmt.on_conflict_do_update(index_elements=conflict, set_={column: stmt.excluded[column] for column in update})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict)
+    db.execute(stmt, rows)
+
+
+def import_items(db: Session, team_id: int, rows: List[dict], updated_by: str) -> dict:
+    """
+    商品を一括登録する（列: item_name, item_price, item_quantity）
+    同じ商品名の商品が既にある行は exists として読み飛ばす。コミットは呼び出し側で行う
+    """
+    results: List[Optional[dict]] = [None] * len(rows)
+    candidates = {}
+    for index, row in enumerate(rows):
+        name = row.get("item_name", "")
+        if not name:
+            results[index] = {"index": index, "status": "error", "detail": "item_name は必須です"}
+            continue
+        try:
+            price = _optional(row, "item_price", float)
+            quantity = _optional(row, "item_quantity", int)
+        except ValueError as e:
+            results[index] = {"index": index, "status": "error", "detail": f"数値に変換できません: {e}"}
+            continue
+        code = item_code_for(name, team_id)
+        if code in candidates:
+            results[index] = {"index": index, "status": "error", "detail": f"{candidates[code][0] + 2}行目と同じ商品名です"}
+            continue
+        candidates[code] = (index, name, price, quantity)
+
+    existing = set(db.scalars(select(Item.item_code).where(Item.item_code.in_(list(candidates))))) if candidates else set()
+    now = datetime.now()
+    new_items = []
+    for code, (index, name, price, quantity) in candidates.items():
+        if code in existing:
+            results[index] = {"index": index, "status": "exists", "item_code": str(code)}
+            continue
+        results[index] = {"index": index, "status": "created", "item_code": str(code)}
+        new_items.append({
+            "item_code": code,
+            "team_id": team_id,
+            "item_name": name,
+            "item_price": price,
+            "item_quantity": quantity or 0,
+            "created_at": now,
+            "updated_at": now,
+            "updated_by": updated_by,
+        })
+
+    if new_items:
+        _merge(db, Item.__table__, new_items, ["item_code"], [])
+        # create_item と同じく在庫スナップショットと登録時のチェックポイントを作る
+        db.execute(insert(ItemStock), [
+            {"item_code": item["item_code"], "team_id": team_id, "current_stock": item["item_quantity"], "last_moved_at": now}
+            for item in new_items
+        ])
+        db.execute(insert(StockCheckpoint), [
+            {"item_code": item["item_code"], "team_id": team_id, "taken_at": now, "stock": item["item_quantity"], "reason": "created"}
+            for item in new_items
+        ])
+    return _summary(results)
+
+
+def import_supplier_items(db: Session, team_id: int, rows: List[dict], updated_by: str) -> dict:
+    """
+    仕入先別の商品価格を一括登録・更新する（列: supplier_name, supplier_type, item_name, lot_price, lot_size）
+    仕入先と商品は登録済みである必要がある。既にある組み合わせは価格を更新する。コミットは呼び出し側で行う
+    """
+    results: List[Optional[dict]] = [None] * len(rows)
+    parsed = []
+    for index, row in enumerate(rows):
+        supplier_name = row.get("supplier_name", "")
+        item_name = row.get("item_name", "")
+        if not supplier_name or not item_name:
+            results[index] = {"index": index, "status": "error", "detail": "supplier_name と item_name は必須です"}
+            continue
+        try:
+            supplier_type = ActionType(row.get("supplier_type") or "IN")
+            lot_price = _optional(row, "lot_price", float)
+            lot_size = _optional(row, "lot_size", int)
+        except ValueError as e:
+            results[index] = {"index": index, "status": "error", "detail": str(e)}
+            continue
+        parsed.append((index, supplier_code_for(supplier_name), supplier_type, item_code_for(item_name, team_id), lot_price, lot_size))
+    return _upsert_supplier_items(db, team_id, parsed, results, updated_by)
+
+
+def upsert_supplier_items(db: Session, team_id: int, entries: List[dict], updated_by: str) -> dict:
+    """
+    仕入先別の商品価格をコードで指定してまとめて登録・更新する
+    entries は item_code, supplier_code, supplier_type, lot_price, lot_size を持つ辞書のリスト。コミットは呼び出し側で行う
+    """
+    parsed = [
+        (index, entry["supplier_code"], ActionType(entry["supplier_type"]), entry["item_code"], entry.get("lot_price"), entry.get("lot_size"))
+        for index, entry in enumerate(entries)
+    ]
+    return _upsert_supplier_items(db, team_id, parsed, [None] * len(entries), updated_by)
+
+
+def _upsert_supplier_items(db: Session, team_id: int, parsed: list, results: List[Optional[dict]], updated_by: str) -> dict:
+    """
+    parsed は (行番号, 仕入先コード, 仕入先区分, 商品コード, lot_price, lot_size) のリスト
+    既存の行と価格・入数が同じものは unchanged として書き込まない
+    """
+    # 仕入先・商品・既存の組み合わせをそれぞれ1回のクエリで確認
+    supplier_codes = {p[1] for p in parsed}
+    item_codes = {p[3] for p in parsed}
+    suppliers = {
+        (row.supplier_code, row.supplier_type): row.supplier_name
+        for row in db.execute(
+            select(Supplier.supplier_code, Supplier.supplier_type, Supplier.supplier_name)
+            .where(Supplier.team_id == team_id, Supplier.supplier_code.in_(supplier_codes))
+        )
+    } if supplier_codes else {}
+    items = dict(db.execute(
+        select(Item.item_code, Item.item_name).where(Item.team_id == team_id, Item.item_code.in_(item_codes))
+    ).all()) if item_codes else {}
+    existing = {
+        (row.item_code, row.supplier_code, row.supplier_type): (row.lot_price, row.lot_size)
+        for row in db.execute(
+            select(
+                SupplierItem.item_code, SupplierItem.supplier_code, SupplierItem.supplier_type,
+                SupplierItem.lot_price, SupplierItem.lot_size,
+            )
+            .where(SupplierItem.team_id == team_id, SupplierItem.item_code.in_(item_codes))
+        )
+    } if item_codes else {}
+
+    now = datetime.now()
+    seen = {}
+    merged = []
+    for index, supplier_code, supplier_type, item_code, lot_price, lot_size in parsed:
+        key = (item_code, supplier_code, supplier_type)
+        if (supplier_code, supplier_type) not in suppliers:
+            results[index] = {"index": index, "status": "error", "detail": "Supplier not found"}
+        elif item_code not in items:
+            results[index] = {"index": index, "status": "error", "detail": "Item not found"}
+        elif key in seen:
+            results[index] = {"index": index, "status": "error", "detail": "同じ組み合わせが重複しています", "duplicate_of": seen[key]}
+        else:
+            seen[key] = index
+            if key not in existing:
+                status = "inserted"
+            elif existing[key] == (lot_price, lot_size):
+                status = "unchanged"
+            else:
+                status = "updated"
+            results[index] = {
+                "index": index,
+                "status": status,
+                "item_code": str(item_code),
+                "supplier_code": str(supplier_code),
+            }
+            if status == "unchanged":
+                continue
+            merged.append({
+                "team_id": team_id,
+                "item_code": item_code,
+                "item_name": items[item_code],
+                "supplier_code": supplier_code,
+                "supplier_type": supplier_type.value,
+                "supplier_name": suppliers[(supplier_code, supplier_type)],
+                "lot_price": lot_price,
+                "lot_size": lot_size,
+                "updated_at": now,
+                "updated_by": updated_by,
+            })
+
+    # INSERT ... ON CONFLICT (item_code, supplier_code, supplier_type) DO UPDATE
+    _merge(
+        db, SupplierItem.__table__, merged,
+        ["item_code", "supplier_code", "supplier_type"],
+        ["lot_price", "lot_size", "updated_at", "updated_by"]
+    )
+    return _summary(results)
+
+
+def _summary(results: List[dict]) -> dict:
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {**counts, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="商品・価格表の一括取り込み")
+    parser.add_argument("kind", choices=["items", "supplier-items"])
+    parser.add_argument("path")
+    parser.add_argument("--team-id", type=int, required=True)
+    parser.add_argument("--updated-by", default="import")
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal
+
+    with open(args.path, "rb") as f:
+        rows = read_rows(f.read(), args.path)
+    importer = import_items if args.kind == "items" else import_supplier_items
+    db = SessionLocal()
+    try:
+        summary = importer(db, args.team_id, rows, args.updated_by)
+        db.commit()
+        if args.kind == "items" and summary.get("created"):
+            bump_team_version(args.team_id, "item", "inventory")
+    finally:
+        db.close()
+    for result in summary["results"]:
+        if result["status"] == "error":
+            print(f"row {result['index'] + 2}: {result['detail']}")
+    print({key: value for key, value in summary.items() if key != "results"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+DBとリクエストの計測
+
+SQLAlchemy のプール・カーソルのイベントにフックして、コネクション取得の待ち時間、
+クエリ数、クエリのレイテンシを記録する。リクエスト単位の集計は contextvars に保持し、
+/metrics で Prometheus のテキスト形式として出力する。
+"""
+from collections import Counter as StatementCounter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        lines = self._header()
+        # inc と同時に呼ばれても辞書の変更中に反復しないよう、ロックを取って写しを作る
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """値を直接設定するか、出力時に関数で値を取得するゲージ"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable[[], Dict[tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            values = dict(self._values)
+        # コールバックはDBを参照することがあるのでロックの外で呼ぶ
+        if self._callback is not None:
+            values.update(self._callback())
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            counts = self._values.setdefault(labels, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = self._header()
+        # バケットごとの数と合計が食い違わないよう、ロックを取って各ラベルの値も写す
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {counts[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {counts[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1]}")
+        return lines
+
+
+REGISTRY: Dict[str, _Metric] = {}
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- リクエスト単位の集計 ----
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+    checkout_wait: float = 0.0
+    started_at: float = field(default_factory=time.perf_counter)
+    # N+1検出用に同じSQLの実行回数を数える（デバッグ時のみ）
+    statements: Optional[StatementCounter] = None
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+DB_QUERIES = Counter("db_queries_total", "Number of SQL statements executed")
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement latency")
+DB_CHECKOUT_WAIT_SECONDS = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements per HTTP request", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+HTTP_REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Total SQL time per HTTP request", ("method", "route"))
+
+_instrumented_pools = []
+
+
+def _pool_status():
+    values = {}
+    for name, pool in _instrumented_pools:
+        values[(name, "size")] = pool.size()
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Connection pool status", ("pool", "state"), callback=_pool_status)
+
+
+def start_request(track_statements: bool = False) -> RequestStats:
+    stats = RequestStats(statements=StatementCounter() if track_statements else None)
+    current_request_stats.set(stats)
+    return stats
+
+
+def server_timing(stats: RequestStats, elapsed: float) -> str:
+    """Server-Timing ヘッダーの値を作る（単位はミリ秒）"""
+    return ", ".join([
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+        f'pool;dur={stats.checkout_wait * 1000:.1f};desc="connection checkout"',
+        f'app;dur={elapsed * 1000:.1f}',
+    ])
+
+
+def repeated_statements(stats: RequestStats, threshold: int) -> List[Tuple[str, int]]:
+    """1リクエスト内で threshold 回以上実行された同一のSQL（N+1の疑い）を返す"""
+    if not stats.statements:
+        return []
+    return [(statement, count) for statement, count in stats.statements.most_common() if count >= threshold]
+
+
+def finish_request(stats: RequestStats, method: str, route: str, status: int) -> float:
+    """リクエストの集計をメトリクスに反映し、経過時間（秒）を返す"""
+    elapsed = time.perf_counter() - stats.started_at
+    HTTP_REQUESTS.inc(1, method, route, str(status))
+    HTTP_REQUEST_SECONDS.observe(elapsed, method, route)
+    HTTP_REQUEST_QUERIES.observe(stats.queries, method, route)
+    HTTP_REQUEST_DB_SECONDS.observe(stats.db_time, method, route)
+    return elapsed
+
+
+# ---- SQLAlchemy へのフック ----
+
+def _record_checkout_wait(wait: float):
+    DB_CHECKOUT_WAIT_SECONDS.observe(wait)
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.checkout_wait += wait
+
+
+class InstrumentedQueuePool(QueuePool):
+    """コネクション取得までの待ち時間を計測する QueuePool"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_checkout_wait(time.perf_counter() - started)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """InstrumentedQueuePool の非同期エンジン版"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_checkout_wait(time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started_at"].pop()
+    elapsed = time.perf_counter() - started
+    DB_QUERIES.inc(1)
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None:
+            stats.statements[statement] += 1
+
+
+def _handle_error(context):
+    # 失敗したクエリは after_cursor_execute が呼ばれないため開始時刻を捨てる
+    started = context.connection.info.get("query_started_at") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine, name: str = "default"):
+    """同期エンジン（非同期エンジンの場合は sync_engine）にイベントを登録する"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    if isinstance(engine.pool, QueuePool):
+        _instrumented_pools.append((name, engine.pool))
@@ -0,0 +1,323 @@
+"""
+コミット後の後処理のジョブキュー
+
+書き込み系のAPIはコミットしたら job_queue.enqueue でジョブを積んで応答を返し、在庫変動の配信などの
+後処理はワーカーのスレッドが行う。ジョブは @job("名前") で登録した関数で、引数はJSONにできる値に限る。
+失敗したジョブは JOB_RETRY_BASE_SECONDS × 2^(試行回数 - 1) 秒後に再実行し、JOB_MAX_ATTEMPTS 回失敗したら諦める。
+key を指定したジョブは、同じ key のものが積んだ順に1件ずつ実行される（同じ商品の在庫の配信が前後しない）。
+
+JOB_BACKEND=postgres にすると background_job テーブルを待ち行列にし、複数のプロセスのワーカーが
+FOR UPDATE SKIP LOCKED で分担する。プロセスが落ちても未実行のジョブは残り、他のワーカーが引き継ぐ。
+在庫変動の配信もどのプロセスのワーカーが行うか分からないため、PUBSUB_BACKEND=postgres も必要になる。
+ワーカーだけを別に動かす場合は `python -m models.jobs work`、状況の確認は `python -m models.jobs status`。
+
+キューの長さ・待ち時間・実行時間・結果は /metrics に出力する。
+"""
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+import argparse
+import heapq
+import itertools
+import json
+import threading
+import time
+
+from sqlalchemy import exists, func, insert, or_, select
+from sqlalchemy.orm import Session, aliased
+
+from models.config import PUBSUB_BACKEND, JOB_BACKEND, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS, JOB_POLL_SECONDS
+from models.instrumentation import Counter, Gauge, Histogram
+from models.schemas import BackgroundJob
+
+_handlers: Dict[str, Callable] = {}
+
+
+def job(name: str):
+    """ジョブとして実行する関数を登録する"""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def retry_delay(attempts: int) -> float:
+    return JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+
+
+JOBS = Counter("jobs_total", "Background jobs by outcome", ("job", "status"))
+JOB_SECONDS = Histogram("job_duration_seconds", "Background job run time", ("job",))
+JOB_WAIT_SECONDS = Histogram("job_queue_wait_seconds", "Time from enqueue to the first run of a background job", ("job",))
+
+
+def _execute(name: str, payload: dict, attempts: int, waited: float) -> Optional[str]:
+    """ジョブを1回実行してメトリクスに記録する（失敗した場合はエラーの内容を返す）"""
+    if attempts == 1:
+        JOB_WAIT_SECONDS.observe(waited, name)
+    started = time.perf_counter()
+    try:
+        _handlers[name](**payload)
+    except Exception as e:
+        JOB_SECONDS.observe(time.perf_counter() - started, name)
+        JOBS.inc(1, name, "failed" if attempts >= JOB_MAX_ATTEMPTS else "retried")
+        print(f"job {name} failed (attempt {attempts}/{JOB_MAX_ATTEMPTS}): {e!r}")
+        return repr(e)
+    JOB_SECONDS.observe(time.perf_counter() - started, name)
+    JOBS.inc(1, name, "succeeded")
+    return None
+
+
+class _Job:
+    def __init__(self, name: str, payload: dict, key: Optional[str]):
+        self.name = name
+        self.payload = payload
+        self.key = key
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class _WorkerPool(ABC):
+    """ワーカーのスレッドを最初にジョブを積んだとき（またはアプリの起動時）に立ち上げる"""
+    backend = ""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def start(self) -> None:
+        with self._condition:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    @abstractmethod
+    def _work(self):
+        """ワーカーのスレッドで実行する（ジョブを取り出して実行し続ける）"""
+
+
+class InProcessJobQueue(_WorkerPool):
+    """
+    プロセス内のジョブキュー（プロセスが終了すると未実行のジョブは失われる）
+    key のあるジョブは key ごとの列に並べ、先頭の1件だけを実行待ちにする
+    """
+    backend = "memory"
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        super().__init__(workers)
+        # (実行する時刻, 順番, ジョブ)
+        self._ready = []
+        # key -> 実行待ち・実行中のジョブの列（先頭が _ready にあるか実行中）
+        self._keyed: Dict[str, deque] = {}
+        self._running = 0
+        self._sequence = itertools.count()
+
+    def enqueue(self, name: str, key: Optional[str] = None, **payload) -> None:
+        """コミット後に呼び、ジョブを積む"""
+        entry = _Job(name, payload, key)
+        self.start()
+        with self._condition:
+            if key is not None:
+                waiting = self._keyed.setdefault(key, deque())
+                waiting.append(entry)
+                if len(waiting) > 1:
+                    return
+            self._push(entry, time.monotonic())
+            self._condition.notify()
+
+    def depth(self) -> int:
+        with self._condition:
+            return len(self._ready) + sum(len(waiting) - 1 for waiting in self._keyed.values())
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """積まれたジョブがすべて終わるまで待つ（終了処理・テスト用）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._ready or self._running or self._keyed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _push(self, entry: _Job, run_at: float) -> None:
+        heapq.heappush(self._ready, (run_at, next(self._sequence), entry))
+
+    def _next(self) -> _Job:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._ready and self._ready[0][0] <= now:
+                    self._running += 1
+                    return heapq.heappop(self._ready)[2]
+                self._condition.wait(self._ready[0][0] - now if self._ready else None)
+
+    def _finish(self, entry: _Job, retry_at: Optional[float]) -> None:
+        with self._condition:
+            self._running -= 1
+            if retry_at is not None:
+                # 再実行を待つ間も同じ key の後続のジョブは待たせる
+                self._push(entry, retry_at)
+            elif entry.key is not None:
+                waiting = self._keyed[entry.key]
+                waiting.popleft()
+                if waiting:
+                    self._push(waiting[0], time.monotonic())
+                else:
+                    del self._keyed[entry.key]
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            entry = self._next()
+            entry.attempts += 1
+            error = _execute(entry.name, entry.payload, entry.attempts, time.monotonic() - entry.enqueued_at)
+            retry = error is not None and entry.attempts < JOB_MAX_ATTEMPTS
+            self._finish(entry, time.monotonic() + retry_delay(entry.attempts) if retry else None)
+
+
+class PostgresJobQueue(_WorkerPool):
+    """
+    background_job テーブルを待ち行列にするジョブキュー
+    実行中のジョブの行はロックしたままにし、他のワーカーは SKIP LOCKED で読み飛ばす
+    """
+    backend = "postgres"
+
+    def __init__(self, engine, workers: int = JOB_WORKERS):
+        super().__init__(workers)
+        self.engine = engine
+
+    def enqueue(self, name: str, key: Optional[str] = None, **payload) -> None:
+        """コミット後に呼び、ジョブを積む"""
+        now = datetime.now()
+        with self.engine.begin() as conn:
+            conn.execute(insert(BackgroundJob).values(
+                name=name,
+                key=key,
+                payload=json.dumps(payload, default=str),
+                attempts=0,
+                run_at=now,
+                created_at=now,
+            ))
+        self.start()
+        with self._condition:
+            self._condition.notify()
+
+    def depth(self) -> int:
+        with Session(self.engine) as db:
+            return db.scalar(select(func.count()).select_from(BackgroundJob).where(BackgroundJob.failed_at.is_(None)))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.depth():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _claim(self, now: datetime):
+        earlier = aliased(BackgroundJob)
+        return (
+            select(BackgroundJob)
+            .where(
+                BackgroundJob.failed_at.is_(None),
+                BackgroundJob.run_at <= now,
+                # 同じ key の前のジョブ（実行中・再実行待ちを含む）が残っている間は実行しない
+                or_(
+                    BackgroundJob.key.is_(None),
+                    ~exists().where(
+                        earlier.key == BackgroundJob.key,
+                        earlier.id < BackgroundJob.id,
+                        earlier.failed_at.is_(None),
+                    ),
+                ),
+            )
+            .order_by(BackgroundJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+
+    def run_one(self) -> bool:
+        """実行できるジョブを1件実行する（なければFalse）"""
+        with Session(self.engine) as db:
+            now = datetime.now()
+            entry = db.scalars(self._claim(now)).first()
+            if entry is None:
+                return False
+            entry.attempts += 1
+            waited = (now - entry.created_at).total_seconds()
+            error = _execute(entry.name, json.loads(entry.payload), entry.attempts, waited)
+            if error is None:
+                db.delete(entry)
+            elif entry.attempts >= JOB_MAX_ATTEMPTS:
+                entry.failed_at = datetime.now()
+                entry.last_error = error
+            else:
+                entry.run_at = datetime.now() + timedelta(seconds=retry_delay(entry.attempts))
+                entry.last_error = error
+            db.commit()
+            return True
+
+    def _work(self):
+        while True:
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                print(f"job worker error: {e!r}")
+            with self._condition:
+                self._condition.wait(JOB_POLL_SECONDS)
+
+
+def _create_queue():
+    if JOB_BACKEND == "postgres":
+        # 配信がプロセス内だと、別のプロセスのワーカーが配信した在庫変動がAPIの購読者に届かない
+        if PUBSUB_BACKEND != "postgres":
+            raise RuntimeError("JOB_BACKEND=postgres には PUBSUB_BACKEND=postgres が必要です")
+        from models.db import engine
+        return PostgresJobQueue(engine)
+    return InProcessJobQueue()
+
+
+job_queue = _create_queue()
+
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "Background jobs waiting to run", ("backend",),
+    callback=lambda: {(job_queue.backend,): job_queue.depth()},
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="後処理のジョブキュー（JOB_BACKEND=postgres）の管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("work", help="ワーカーだけを動かす")
+    subparsers.add_parser("status", help="ジョブの件数を表示")
+    args = parser.parse_args(argv)
+
+    if not isinstance(job_queue, PostgresJobQueue):
+        parser.error("JOB_BACKEND=postgres と PUBSUB_BACKEND=postgres を設定してください")
+    # ジョブを登録しているモジュール
+    import models.namesync  # noqa: F401
+    import models.pubsub  # noqa: F401
+    import models.stock  # noqa: F401
+
+    if args.command == "work":
+        job_queue.start()
+        print(f"Running {job_queue.workers} job workers")
+        while True:
+            time.sleep(60)
+    elif args.command == "status":
+        with Session(job_queue.engine) as db:
+            rows = db.execute(
+                select(BackgroundJob.name, BackgroundJob.failed_at.isnot(None), func.count())
+                .group_by(BackgroundJob.name, BackgroundJob.failed_at.isnot(None))
+            ).all()
+        for name, failed, count in rows:
+            print(f"{name}: {count} {'failed' if failed else 'pending'}")
+
+
+if __name__ == "__main__":
+    main()
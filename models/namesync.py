@@ -0,0 +1,315 @@
+"""
+商品名・仕入先名の写しの同期
+
+transactions / supplier_item は一覧や帳票で結合せずに済むよう item_name / supplier_name の写しを持つ。
+商品名・仕入先名を変更したAPIは同じDBトランザクションで name_sync_job に1行追加し、コミット後に
+queue_name_sync でジョブキュー（models.jobs）に name_sync ジョブを積むだけにする。
+
+ジョブは1回の実行で最大 NAME_SYNC_TICK_ROWS 行を、NAME_SYNC_CHUNK_SIZE 行ずつの UPDATE と
+コミットに分けて書き換え、残りがあれば続きを積み直して他のジョブに順番を譲る。書き換える値はその時点の
+商品・仕入先の名前で、写しが異なる行だけを対象にするため、途中で止まっても、同じジョブが重複して実行されても
+結果は変わらない。同じ商品・仕入先のジョブは key が同じなので1件ずつ実行される。
+反映し終えたジョブは、処理を始める前に追加されていた分だけを削除する（処理中の再変更は後のジョブで反映する）。
+アプリの起動時には name_sync_job に残っている分のジョブを積み直す。
+
+    python -m models.namesync run              # 待ち行列が空になるまでこのプロセスで処理する
+    python -m models.namesync check [--repair] # 写しと元の名前の食い違いを数える（--repair で再同期する）
+"""
+from datetime import datetime
+from typing import List, Optional
+import argparse
+import uuid
+
+from sqlalchemy import and_, delete, func, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from models.config import NAME_SYNC_CHUNK_SIZE, NAME_SYNC_TICK_ROWS
+from models.jobs import job, job_queue
+from models.schemas import ActionType, Item, NameSyncJob, Supplier, SupplierItem, Transactions
+
+ITEM = "item"
+SUPPLIER = "supplier"
+
+
+def enqueue_rename(
+    db: Session, team_id: int, entity: str, code: uuid.UUID, supplier_type: Optional[ActionType] = None
+) -> None:
+    """名前の変更を待ち行列に追加する（コミットは呼び出し側で名前の変更と一緒に行う）"""
+    db.add(NameSyncJob(
+        team_id=team_id,
+        entity=entity,
+        code=code,
+        supplier_type=supplier_type if entity == SUPPLIER else None,
+        enqueued_at=datetime.now(),
+    ))
+
+
+def _job_filter(entity: str, code: uuid.UUID, supplier_type: Optional[ActionType]):
+    """同じ商品・仕入先に対するジョブの条件"""
+    conditions = [NameSyncJob.entity == entity, NameSyncJob.code == code]
+    if supplier_type is None:
+        conditions.append(NameSyncJob.supplier_type.is_(None))
+    else:
+        conditions.append(NameSyncJob.supplier_type == supplier_type)
+    return and_(*conditions)
+
+
+def _current_name(db: Session, job) -> Optional[str]:
+    if job.entity == ITEM:
+        query = select(Item.item_name).where(Item.team_id == job.team_id, Item.item_code == job.code)
+    else:
+        query = select(Supplier.supplier_name).where(
+            Supplier.team_id == job.team_id,
+            Supplier.supplier_code == job.code,
+            Supplier.supplier_type == job.supplier_type,
+        )
+    return db.scalar(query)
+
+
+def _targets(job) -> list:
+    """ジョブで書き換える (テーブル, 写しの列, 対象行の条件) の一覧"""
+    code = job.code
+    if job.entity == ITEM:
+        return [
+            (model, model.item_name, [model.team_id == job.team_id, model.item_code == code])
+            for model in (Transactions, SupplierItem)
+        ]
+    return [
+        (
+            model,
+            model.supplier_name,
+            [model.team_id == job.team_id, model.supplier_code == code, model.supplier_type == job.supplier_type],
+        )
+        for model in (Transactions, SupplierItem)
+    ]
+
+
+def _sync_chunk(db: Session, model, column, conditions: list, name: str, limit: int) -> int:
+    """写しが name と異なる行を最大 limit 行書き換え、書き換えた行数を返す"""
+    keys = list(model.__table__.primary_key.columns)
+    stale = select(*keys).where(*conditions, column.is_distinct_from(name)).limit(limit)
+    result = db.execute(
+        update(model)
+        .where(tuple_(*keys).in_(stale))
+        # updated_at は取引日時・価格の更新日時なので、写しの書き換えでは進めない
+        .values({column.key: name, "updated_at": model.updated_at})
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def _invalidate_caches(team_id: int) -> None:
+    """価格表の仕入先名を書き換えたときに、それを含むプロセス内のキャッシュを捨てる"""
+    from models.planning import invalidate_planning
+    from models.scan import invalidate_scan
+
+    invalidate_scan(team_id)
+    invalidate_planning(team_id)
+
+
+def _process(db: Session, job, budget: int) -> tuple:
+    """1件のジョブを最大 budget 行まで処理し、(書き換えた行数, 完了したか) を返す"""
+    target = _job_filter(job.entity, job.code, job.supplier_type)
+    # 名前を読む前に登録済みのジョブまでを、この処理で反映したものとして削除する
+    last_id = db.scalar(select(func.max(NameSyncJob.id)).where(target))
+    name = _current_name(db, job)
+    rows = 0
+    done = True
+    if name is not None:
+        for model, column, conditions in _targets(job):
+            while True:
+                limit = min(NAME_SYNC_CHUNK_SIZE, budget - rows)
+                if limit <= 0:
+                    done = False
+                    break
+                count = _sync_chunk(db, model, column, conditions, name, limit)
+                db.commit()
+                rows += count
+                if count and model is SupplierItem:
+                    _invalidate_caches(job.team_id)
+                if count < limit:
+                    break
+            if not done:
+                break
+    if done:
+        # 商品・仕入先が削除済みの場合は写しを持つ行も消えているため、ジョブを捨てるだけでよい
+        db.execute(delete(NameSyncJob).where(target, NameSyncJob.id <= last_id))
+        db.commit()
+    return rows, done
+
+
+def tick(db: Session, max_rows: int = NAME_SYNC_TICK_ROWS) -> dict:
+    """
+    古いジョブから順に、合計 max_rows 行まで写しを書き換える
+    pending は未処理のジョブが残っているか
+    """
+    jobs = rows = 0
+    while rows < max_rows:
+        job = db.execute(
+            select(NameSyncJob.team_id, NameSyncJob.entity, NameSyncJob.code, NameSyncJob.supplier_type)
+            .order_by(NameSyncJob.id)
+            .limit(1)
+        ).first()
+        if job is None:
+            return {"jobs": jobs, "rows": rows, "pending": False}
+        count, done = _process(db, job, max_rows - rows)
+        rows += count
+        if not done:
+            break
+        jobs += 1
+    pending = db.scalar(select(NameSyncJob.id).limit(1)) is not None
+    return {"jobs": jobs, "rows": rows, "pending": pending}
+
+
+@job("name_sync")
+def _name_sync_job(entity: str, code: str, supplier_type: Optional[str] = None):
+    from models.db import SessionLocal
+
+    code = uuid.UUID(code)
+    supplier_type = ActionType(supplier_type) if supplier_type else None
+    db = SessionLocal()
+    try:
+        target = db.execute(
+            select(NameSyncJob.team_id, NameSyncJob.entity, NameSyncJob.code, NameSyncJob.supplier_type)
+            .where(_job_filter(entity, code, supplier_type))
+            .limit(1)
+        ).first()
+        # 先に実行された同じ商品・仕入先のジョブ（または `run`）で反映済み
+        if target is None:
+            return
+        _, done = _process(db, target, NAME_SYNC_TICK_ROWS)
+    finally:
+        db.close()
+    if not done:
+        queue_name_sync(entity, code, supplier_type)
+
+
+def queue_name_sync(entity: str, code: uuid.UUID, supplier_type: Optional[ActionType] = None) -> None:
+    """コミット後に呼び、写しの書き換えをジョブキューに積む（同じ商品・仕入先のジョブは積んだ順に1件ずつ実行する）"""
+    job_queue.enqueue(
+        "name_sync",
+        key=f"name_sync:{entity}:{code}",
+        entity=entity,
+        code=str(code),
+        supplier_type=supplier_type.value if entity == SUPPLIER and supplier_type else None,
+    )
+
+
+def resume_pending() -> int:
+    """name_sync_job に残っている商品・仕入先ごとにジョブを積み、積んだ件数を返す（アプリの起動時に呼ぶ）"""
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        targets = db.execute(
+            select(NameSyncJob.entity, NameSyncJob.code, NameSyncJob.supplier_type).distinct()
+        ).all()
+    finally:
+        db.close()
+    for entity, code, supplier_type in targets:
+        queue_name_sync(entity, code, supplier_type)
+    return len(targets)
+
+
+def check(db: Session, team_id: Optional[int] = None) -> List[dict]:
+    """
+    写しが元の名前と異なる行を、商品・仕入先ごとに数える
+    stale は別の名前が入っている行、missing は写しが空の行
+    """
+    checks = [
+        (ITEM, model, model.item_name, Item.item_name, Item,
+         [Item.item_code == model.item_code, Item.team_id == model.team_id], [model.item_code])
+        for model in (Transactions, SupplierItem)
+    ] + [
+        (SUPPLIER, model, model.supplier_name, Supplier.supplier_name, Supplier,
+         [Supplier.supplier_code == model.supplier_code, Supplier.supplier_type == model.supplier_type,
+          Supplier.team_id == model.team_id],
+         [model.supplier_code, model.supplier_type])
+        for model in (Transactions, SupplierItem)
+    ]
+    found = []
+    for entity, model, copy, source, source_model, on, keys in checks:
+        query = (
+            select(
+                model.team_id,
+                *keys,
+                func.count().filter(copy.isnot(None)).label("stale"),
+                func.count().filter(copy.is_(None)).label("missing"),
+            )
+            .join(source_model, and_(*on))
+            .where(copy.is_distinct_from(source))
+            .group_by(model.team_id, *keys)
+        )
+        if team_id is not None:
+            query = query.where(model.team_id == team_id)
+        for row in db.execute(query):
+            found.append({
+                "team_id": row[0],
+                "table": model.__tablename__,
+                "column": copy.key,
+                "entity": entity,
+                "code": uuid.UUID(str(row[1])),
+                "supplier_type": row[2] if entity == SUPPLIER else None,
+                "stale": row.stale,
+                "missing": row.missing,
+            })
+    return found
+
+
+def repair(db: Session, mismatches: List[dict]) -> int:
+    """食い違いのある商品・仕入先の再同期を登録し、登録した件数を返す（登録済みのものは除く）"""
+    targets = {(m["team_id"], m["entity"], m["code"], m["supplier_type"]) for m in mismatches}
+    count = 0
+    for team_id, entity, code, supplier_type in targets:
+        if db.scalar(select(NameSyncJob.id).where(_job_filter(entity, code, supplier_type)).limit(1)) is None:
+            enqueue_rename(db, team_id, entity, code, supplier_type)
+            count += 1
+    return count
+
+
+def _run(db: Session) -> None:
+    """待ち行列が空になるまでこのプロセスで写しを書き換える"""
+    jobs = rows = 0
+    while True:
+        stats = tick(db)
+        jobs += stats["jobs"]
+        rows += stats["rows"]
+        if not stats["pending"]:
+            break
+    print(f"Synced {rows} rows for {jobs} renames")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="商品名・仕入先名の写しの同期")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run", help="待ち行列が空になるまで写しを書き換える")
+    check_parser = subparsers.add_parser("check", help="写しと元の名前の食い違いを数える")
+    check_parser.add_argument("--team-id", type=int, default=None)
+    check_parser.add_argument("--repair", action="store_true", help="食い違いのある商品・仕入先を再同期する")
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "run":
+            _run(db)
+        elif args.command == "check":
+            mismatches = check(db, team_id=args.team_id)
+            for m in mismatches:
+                print(
+                    f"team={m['team_id']} {m['table']}.{m['column']} {m['entity']}={m['code']}"
+                    f" stale={m['stale']} missing={m['missing']}"
+                )
+            print(f"Found {len(mismatches)} out-of-sync targets")
+            if args.repair and mismatches:
+                count = repair(db, mismatches)
+                db.commit()
+                print(f"Queued {count} renames")
+                _run(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+発注点と発注ロットの計算
+
+日次の出庫数（stock_rollup の day 集計）をチームの全商品まとめて 日付 × 商品 の表にし、
+pandas の rolling で直近 window_days 日の1日あたりの出庫数とばらつきを求める。
+そこからリードタイム中の需要と安全在庫で発注点を決め、入庫の仕入先ごとに
+経済的発注量（EOQ）を仕入先の入数（lot_size）の倍数に切り上げた発注ロットを出す。
+
+    安全在庫   = z(サービス率) × 日次出庫数の標準偏差 × √リードタイム
+    発注点     = 1日あたりの出庫数 × リードタイム + 安全在庫
+    EOQ        = √(2 × 年間出庫数 × 1回の発注費用 / (単価 × 年間の保管費率))
+
+計算結果は取引・商品の変更で進むチームの版数と一緒にキャッシュし、版数が変わるまで再計算しない。
+"""
+from datetime import datetime, timedelta
+from statistics import NormalDist
+from typing import List, Optional
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models.cache import TTLCache
+from models.config import (
+    PLANNING_ORDER_COST, PLANNING_HOLDING_RATE, PLANNING_CACHE_TTL, PLANNING_CACHE_SIZE,
+)
+from models.schemas import ActionType, Item, ItemStock, StockRollup, SupplierItem
+from models.versions import team_version
+
+
+def _demand_matrix(db: Session, team_id: int, window_days: int, today: datetime) -> pd.DataFrame:
+    """日付 × 商品コード の出庫数の表（直近 2 × window_days 日分、出庫のない日は0）"""
+    since = today - timedelta(days=2 * window_days - 1)
+    rows = db.execute(
+        select(StockRollup.bucket_start, StockRollup.item_code, StockRollup.quantity_out)
+        .where(
+            StockRollup.team_id == team_id,
+            StockRollup.resolution == "day",
+            StockRollup.bucket_start >= since,
+            StockRollup.bucket_start <= today,
+        )
+    ).all()
+    days = pd.date_range(since, today, freq="D")
+    if not rows:
+        return pd.DataFrame(index=days)
+    frame = pd.DataFrame(rows, columns=["bucket_start", "item_code", "quantity_out"])
+    return (
+        frame.pivot_table(index="bucket_start", columns="item_code", values="quantity_out", aggfunc="sum")
+        .reindex(days, fill_value=0)
+        .fillna(0)
+    )
+
+
+def consumption_rates(db: Session, team_id: int, window_days: int, today: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    商品ごとの1日あたりの出庫数（daily_demand）、その標準偏差（demand_std）、
+    1つ前の期間の1日あたりの出庫数（previous_daily_demand）を item_code を索引にして返す
+    """
+    today = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    matrix = _demand_matrix(db, team_id, window_days, today)
+    rolling = matrix.rolling(window_days, min_periods=1)
+    means = rolling.mean()
+    return pd.DataFrame({
+        "daily_demand": means.iloc[-1],
+        "demand_std": rolling.std(ddof=0).iloc[-1],
+        "previous_daily_demand": means.iloc[-1 - window_days] if len(means) > window_days else np.nan,
+    }).fillna({"daily_demand": 0.0, "demand_std": 0.0})
+
+
+def plan_reorders(
+    db: Session,
+    team_id: int,
+    window_days: int,
+    lead_time_days: float,
+    service_level: float,
+    today: Optional[datetime] = None,
+) -> List[dict]:
+    """チームの全商品の発注点と、仕入先ごとの発注ロットを計算する"""
+    items = pd.DataFrame(
+        db.execute(
+            select(
+                Item.item_code,
+                Item.item_name,
+                func.coalesce(ItemStock.current_stock, Item.item_quantity, 0).label("current_stock"),
+            )
+            .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+            .where(Item.team_id == team_id)
+        ).all(),
+        columns=["item_code", "item_name", "current_stock"],
+    )
+    if items.empty:
+        return []
+    rates = consumption_rates(db, team_id, window_days, today)
+    items = items.join(rates, on="item_code")
+    items[["daily_demand", "demand_std"]] = items[["daily_demand", "demand_std"]].fillna(0.0)
+
+    z = NormalDist().inv_cdf(service_level)
+    items["safety_stock"] = np.ceil(z * items["demand_std"] * np.sqrt(lead_time_days))
+    items["reorder_point"] = np.ceil(items["daily_demand"] * lead_time_days + items["safety_stock"])
+    items["needs_reorder"] = (items["daily_demand"] > 0) & (items["current_stock"] <= items["reorder_point"])
+    items["days_of_cover"] = items["current_stock"] / items["daily_demand"].replace(0, np.nan)
+
+    suppliers = pd.DataFrame(
+        db.execute(
+            select(
+                SupplierItem.item_code,
+                SupplierItem.supplier_code,
+                SupplierItem.supplier_name,
+                SupplierItem.lot_price,
+                SupplierItem.lot_size,
+            )
+            .where(
+                SupplierItem.team_id == team_id,
+                SupplierItem.supplier_type == ActionType.IN,
+                SupplierItem.lot_price.isnot(None),
+                SupplierItem.lot_size > 0,
+            )
+        ).all(),
+        columns=["item_code", "supplier_code", "supplier_name", "lot_price", "lot_size"],
+    )
+    suppliers = suppliers.merge(
+        items[["item_code", "daily_demand", "current_stock", "reorder_point", "needs_reorder"]], on="item_code"
+    )
+    if not suppliers.empty:
+        unit_price = suppliers["lot_price"] / suppliers["lot_size"]
+        holding_cost = (unit_price * PLANNING_HOLDING_RATE).replace(0, np.nan)
+        eoq = np.sqrt(2 * suppliers["daily_demand"] * 365 * PLANNING_ORDER_COST / holding_cost).fillna(0)
+        # 発注点を割り込んでいる場合は、少なくとも発注点まで戻る量を発注する
+        shortfall = (suppliers["reorder_point"] - suppliers["current_stock"]).clip(lower=0)
+        target = np.maximum(eoq, shortfall.where(suppliers["needs_reorder"], 0))
+        suppliers["unit_price"] = unit_price
+        suppliers["economic_order_quantity"] = eoq.round(1)
+        suppliers["lots"] = np.maximum(np.ceil(target / suppliers["lot_size"]), 1).astype(int)
+        suppliers["order_quantity"] = suppliers["lots"] * suppliers["lot_size"]
+        suppliers["order_cost"] = suppliers["lots"] * suppliers["lot_price"]
+        suppliers = suppliers.sort_values(["item_code", "unit_price", "order_cost"])
+    # グループごとに DataFrame を切り出すと商品数に比例して遅くなるため、まとめて辞書にしてから振り分ける
+    options = {}
+    for option in suppliers.to_dict(orient="records"):
+        options.setdefault(option.pop("item_code"), []).append({
+            name: option[name] for name in (
+                "supplier_code", "supplier_name", "lot_price", "lot_size", "unit_price",
+                "economic_order_quantity", "lots", "order_quantity", "order_cost",
+            )
+        })
+
+    items = items.sort_values(["needs_reorder", "days_of_cover"], ascending=[False, True], na_position="last")
+    plans = []
+    for row in items.itertuples(index=False):
+        previous = row.previous_daily_demand
+        plans.append({
+            "item_code": row.item_code,
+            "item_name": row.item_name,
+            "current_stock": int(row.current_stock),
+            "daily_demand": round(float(row.daily_demand), 3),
+            "demand_std": round(float(row.demand_std), 3),
+            "previous_daily_demand": None if pd.isna(previous) else round(float(previous), 3),
+            "safety_stock": int(row.safety_stock),
+            "reorder_point": int(row.reorder_point),
+            "days_of_cover": None if pd.isna(row.days_of_cover) else round(float(row.days_of_cover), 1),
+            "needs_reorder": bool(row.needs_reorder),
+            "suppliers": options.get(row.item_code, []),
+        })
+    return plans
+
+
+# (team_id, window_days, lead_time_days, service_level) -> (版数, 計算結果)
+_plans = TTLCache(maxsize=PLANNING_CACHE_SIZE, ttl=PLANNING_CACHE_TTL)
+_plan_lock = threading.Lock()
+
+
+def get_reorder_plan(db: Session, team_id: int, window_days: int, lead_time_days: float, service_level: float) -> List[dict]:
+    """取引・商品の変更がなければ前回の計算結果を返す"""
+    key = (team_id, window_days, lead_time_days, service_level)
+    version = (team_version(team_id, "inventory"), team_version(team_id, "item"))
+    cached = _plans.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _plan_lock:
+        cached = _plans.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        plans = plan_reorders(db, team_id, window_days, lead_time_days, service_level)
+        _plans.set(key, (version, plans))
+        return plans
+
+
+def invalidate_planning(team_id: Optional[int] = None) -> None:
+    """価格表の変更時に呼ぶ（チームを省略した場合は全チームが対象）"""
+    _plans.pop_where(lambda key, _: team_id is None or key[0] == team_id)
@@ -0,0 +1,211 @@
+"""
+在庫変動のプロセス内 pub/sub
+
+書き込み系のAPIがコミット後に publish し、/inventory/stream（SSE / WebSocket）が subscribe する。
+同期ハンドラはスレッドプールから publish するため、購読側の asyncio.Queue へは
+call_soon_threadsafe で受け渡す。
+
+複数プロセスで動かす場合は PUBSUB_BACKEND=postgres にすると、PostgreSQL の
+LISTEN/NOTIFY を経由して他のプロセスの購読者にも届く。受信用の接続が切れた場合は待ち時間を
+倍にしながら再接続し、その間に取りこぼしたメッセージの分は add_reset_listener で登録した関数で
+プロセス内のキャッシュを捨てて補う。
+"""
+from typing import Callable, Dict, List, Set
+import asyncio
+import json
+import select
+import threading
+import time
+
+from sqlalchemy import text
+
+from models.config import PUBSUB_BACKEND, PUBSUB_RETRY_BASE_SECONDS, PUBSUB_RETRY_MAX_SECONDS
+from models.jobs import job, job_queue
+
+NOTIFY_CHANNEL = "inventoria_events"
+
+
+class Subscription:
+    """1つの購読。async for で受信したメッセージを順に取り出す"""
+
+    def __init__(self, broker: "InProcessBroker", channel: str, maxsize: int = 1000):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def _put(self, message: dict):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 受信が追いつかない購読者のメッセージは捨てる（クライアントは再取得で追従する）
+            pass
+
+    def deliver(self, message: dict):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.get()
+
+
+class InProcessBroker:
+    """同じプロセス内の購読者にだけ配信するブローカー"""
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._listeners: List[Callable[[str, dict], None]] = []
+        self._reset_listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        # 他のプロセスのメッセージを漏れなく受信できているか（プロセス内のみの場合は常に True）
+        self.connected = True
+
+    def add_listener(self, listener: Callable[[str, dict], None]):
+        """全チャンネルのメッセージを受け取る関数を登録する（プロセス内のキャッシュの更新などに使う）"""
+        self._listeners.append(listener)
+
+    def add_reset_listener(self, listener: Callable[[], None]):
+        """メッセージを取りこぼした可能性があるとき（受信用の接続の切断・再接続）に呼ぶ関数を登録する"""
+        self._reset_listeners.append(listener)
+
+    def _reset(self):
+        for listener in self._reset_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"pubsub reset listener error: {e}")
+
+    def listen(self) -> None:
+        """他のプロセスのメッセージの受信を始める（プロセス内のみの場合は何もしない）"""
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def _dispatch(self, channel: str, message: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for listener in self._listeners:
+            try:
+                listener(channel, message)
+            except Exception as e:
+                print(f"pubsub listener error: {e}")
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def publish(self, channel: str, message: dict):
+        self._dispatch(channel, message)
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    PostgreSQL の LISTEN/NOTIFY で他のプロセスとメッセージを共有するブローカー
+    自プロセスの publish も NOTIFY 経由で受け取るため、ローカル配信は行わない
+    """
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self._listener = None
+        self.connected = False
+
+    def listen(self) -> None:
+        self._ensure_listener()
+
+    def subscribe(self, channel: str) -> Subscription:
+        self._ensure_listener()
+        return super().subscribe(channel)
+
+    def publish(self, channel: str, message: dict):
+        payload = json.dumps({"channel": channel, "message": message}, default=str)
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": payload})
+            conn.commit()
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name="pubsub-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        delay = PUBSUB_RETRY_BASE_SECONDS
+        while True:
+            try:
+                self._listen_once()
+            except Exception as e:
+                if self.connected:
+                    # 一度つながった後の切断なら待ち時間を最初からやり直す
+                    delay = PUBSUB_RETRY_BASE_SECONDS
+                print(f"pubsub listener disconnected: {e} (retry in {delay:g}s)")
+            self.connected = False
+            self._reset()
+            time.sleep(delay)
+            delay = min(delay * 2, PUBSUB_RETRY_MAX_SECONDS)
+
+    def _listen_once(self):
+        raw = self.engine.raw_connection()
+        try:
+            conn = raw.dbapi_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            # LISTEN する前（切断中）に送られたメッセージは届かないので、キャッシュを捨て直してから受信済みとする
+            self._reset()
+            self.connected = True
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    self._dispatch(event["channel"], event["message"])
+        finally:
+            raw.close()
+
+
+def _create_broker():
+    if PUBSUB_BACKEND == "postgres":
+        from models.db import engine
+        return PostgresBroker(engine)
+    return InProcessBroker()
+
+
+broker = _create_broker()
+
+
+def inventory_channel(team_id: int) -> str:
+    return f"inventory:{team_id}"
+
+
+@job("publish")
+def _publish_job(channel: str, message: dict):
+    broker.publish(channel, message)
+
+
+def queue_publish(channel: str, message: dict) -> None:
+    """コミット後に呼び、配信をジョブキューに積む（同じチャンネルへの配信は積んだ順に届く）"""
+    job_queue.enqueue("publish", key=channel, channel=channel, message=message)
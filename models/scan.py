@@ -0,0 +1,123 @@
+"""
+QRコードのスキャン用キャッシュ
+
+スキャン時に必要な商品・現在の在庫・優先仕入先を (team_id, item_code) ごとにメモリ上に保持する。
+在庫の変動は書き込んだリクエストがコミット後に update_scan で、他のプロセスの分は pub/sub の
+メッセージ（/inventory/stream と同じもの）を受けてその場で書き換えるため、取引を登録してもキャッシュを
+捨てずに済む。PUBSUB_BACKEND=postgres の場合は他のワーカーでの書き込みも反映される。
+"""
+from datetime import datetime
+from typing import Optional
+import threading
+import uuid
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models.cache import TTLCache
+from models.config import SCAN_CACHE_TTL, SCAN_CACHE_SIZE
+from models.pubsub import broker
+from models.schemas import ActionType, Item, ItemStock, SupplierItem
+
+# (team_id, item_code) -> スキャン結果の辞書
+scan_cache = TTLCache(maxsize=SCAN_CACHE_SIZE, ttl=SCAN_CACHE_TTL)
+# (team_id, item_code) -> 変更通知を受けた回数
+# 読み込み中に変更があった場合、古い値でキャッシュを上書きしないために使う
+_generations = TTLCache(maxsize=SCAN_CACHE_SIZE, ttl=SCAN_CACHE_TTL)
+_generation_lock = threading.Lock()
+
+
+def _bump_generation(key) -> None:
+    with _generation_lock:
+        _generations.set(key, _generations.get(key, 0) + 1)
+
+
+def _preferred_supplier(db: Session, team_id: int, item_code: uuid.UUID) -> Optional[dict]:
+    """入庫の仕入先のうち、1個あたりの仕入価格が最も安いもの"""
+    row = db.execute(
+        select(
+            SupplierItem.supplier_code,
+            SupplierItem.supplier_type,
+            SupplierItem.supplier_name,
+            SupplierItem.lot_price,
+            SupplierItem.lot_size,
+        )
+        .where(
+            SupplierItem.team_id == team_id,
+            SupplierItem.item_code == item_code,
+            SupplierItem.supplier_type == ActionType.IN,
+        )
+        .order_by(SupplierItem.unit_cost.asc().nulls_last(), SupplierItem.updated_at.desc())
+        .limit(1)
+    ).first()
+    return dict(row._mapping) if row else None
+
+
+def load_scan_entry(db: Session, team_id: int, item_code: uuid.UUID) -> Optional[dict]:
+    """キャッシュになければDBから読み込んでキャッシュする（商品がなければNone）"""
+    key = (team_id, item_code)
+    entry = scan_cache.get(key)
+    if entry is not None:
+        return entry
+    generation = _generations.get(key, 0)
+    row = db.execute(
+        select(
+            Item.item_code,
+            Item.item_name,
+            Item.item_price,
+            func.coalesce(ItemStock.current_stock, Item.item_quantity, 0).label("current_stock"),
+            func.coalesce(ItemStock.last_moved_at, Item.updated_at).label("updated_at"),
+        )
+        .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+        .where(Item.item_code == item_code, Item.team_id == team_id)
+    ).first()
+    if row is None:
+        return None
+    entry = dict(row._mapping, preferred_supplier=_preferred_supplier(db, team_id, item_code))
+    if _generations.get(key, 0) == generation:
+        scan_cache.set(key, entry)
+    return entry
+
+
+def invalidate_scan(team_id: Optional[int] = None, item_code: Optional[uuid.UUID] = None) -> None:
+    """仕入先・価格表の変更時に呼ぶ（省略した条件は全件が対象）"""
+    if team_id is not None and item_code is not None:
+        _bump_generation((team_id, item_code))
+        scan_cache.pop((team_id, item_code))
+        return
+    scan_cache.pop_where(
+        lambda key, _: (team_id is None or key[0] == team_id) and (item_code is None or key[1] == item_code)
+    )
+
+
+def update_scan(team_id: int, message: dict) -> None:
+    """
+    在庫変動のメッセージ（/inventory/stream と同じ形式）でキャッシュを書き換える
+    書き込み系のAPIはコミット後にこれを直接呼び、直後のスキャンでも変動後の在庫を返す
+    """
+    key = (team_id, uuid.UUID(message["item_code"]))
+    _bump_generation(key)
+    if message["type"] != "stock" or message.get("delta") is None:
+        # 商品の削除・名称や価格の変更は読み直す
+        scan_cache.pop(key)
+        return
+    entry = scan_cache.get(key)
+    if entry is None:
+        return
+    updated_at = message.get("updated_at")
+    scan_cache.set(key, dict(
+        entry,
+        current_stock=message["current_stock"],
+        updated_at=datetime.fromisoformat(updated_at) if updated_at else entry["updated_at"],
+    ))
+
+
+def _on_inventory_message(channel: str, message: dict) -> None:
+    if not channel.startswith("inventory:"):
+        return
+    update_scan(int(channel.split(":", 1)[1]), message)
+
+
+broker.add_listener(_on_inventory_message)
+# 他のプロセスの在庫変動を取りこぼした可能性があるときは全件読み直す
+broker.add_reset_listener(scan_cache.clear)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey, ForeignKeyConstraint, UniqueConstraint, PrimaryKeyConstraint
+from sqlalchemy import Column, Computed, Integer, String, Text, Float, DateTime, Enum, ForeignKey, ForeignKeyConstraint, UniqueConstraint, PrimaryKeyConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from sqlalchemy.sql import func
@@ -110,15 +110,144 @@ class Item(Base):
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     updated_by = Column(String, nullable=False)
+    # 楽観的ロック用の版数（商品の編集ごとに1ずつ増える。取引による在庫の増減では変わらない）
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     transactions = relationship("Transactions", back_populates="item")
     supplier_items = relationship("SupplierItem", back_populates="item")
     team = relationship("Team", back_populates="items")
+    stock = relationship("ItemStock", back_populates="item", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+
+    __mapper_args__ = {"version_id_col": version}
+
+class ItemStock(Base):
+    """
+    商品ごとの在庫スナップショット
+    取引の登録・更新・削除と同じDBトランザクション内で更新する
+    """
+    __tablename__ = 'item_stock'
+    __table_args__ = (
+        Index('ix_item_stock_team_moved', 'team_id', 'last_moved_at'),
+    )
+
+    item_code = Column(UUID(as_uuid=True), ForeignKey('item.item_code', ondelete="CASCADE"), primary_key=True)
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
+    current_stock = Column(Integer, nullable=False, default=0)
+    last_moved_at = Column(DateTime, nullable=True)
+    last_transaction_id = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    item = relationship("Item", back_populates="stock")
+
+class StockRollup(Base):
+    """
+    商品ごとの入出庫数を時間帯（hour / day）単位で集計したテーブル
+    取引の登録・更新・削除と同じDBトランザクション内で増減させる
+    """
+    __tablename__ = 'stock_rollup'
+    __table_args__ = (
+        PrimaryKeyConstraint('item_code', 'resolution', 'bucket_start'),
+        Index('ix_stock_rollup_team_bucket', 'team_id', 'resolution', 'bucket_start'),
+    )
+
+    item_code = Column(UUID(as_uuid=True), ForeignKey('item.item_code', ondelete="CASCADE"), nullable=False)
+    resolution = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
+    quantity_in = Column(Integer, nullable=False, default=0)
+    quantity_out = Column(Integer, nullable=False, default=0)
+    net = Column(Integer, nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+
+class StockCheckpoint(Base):
+    """
+    ある時点の商品ごとの在庫数
+    過去の在庫は直前のチェックポイントにそれ以降の取引を足して求める
+    reason は created（商品登録）/ reset（棚卸しなどで在庫数を直接設定）/ periodic（定期作成）
+    """
+    __tablename__ = 'stock_checkpoint'
+    __table_args__ = (
+        Index('ix_stock_checkpoint_item_taken', 'item_code', 'taken_at'),
+        Index('ix_stock_checkpoint_team_taken', 'team_id', 'taken_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    item_code = Column(UUID(as_uuid=True), ForeignKey('item.item_code', ondelete="CASCADE"), nullable=False)
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
+    taken_at = Column(DateTime, nullable=False)
+    stock = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False, default="periodic")
+
+class IdempotencyRecord(Base):
+    """
+    Idempotency-Key ヘッダー付きのリクエストに返したレスポンス
+    同じキーで再送されたときは書き込みを繰り返さずにこのレスポンスを返す
+    scope はエンドポイント（"POST /item/" など。取引は transactions.idempotency_key で重複を防ぐ）、fingerprint はリクエストボディのハッシュ
+    """
+    __tablename__ = 'idempotency_record'
+    __table_args__ = (
+        PrimaryKeyConstraint('team_id', 'scope', 'key'),
+        Index('ix_idempotency_record_expires_at', 'expires_at'),
+    )
+
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
+    scope = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class NameSyncJob(Base):
+    """
+    商品名・仕入先名の変更を取引と価格表の写し（item_name / supplier_name）に反映する待ち行列
+    名前の変更と同じDBトランザクションで追加し、models.namesync の name_sync ジョブが少しずつ反映してから削除する
+    entity は item / supplier（supplier の場合は supplier_type も指定する）
+    """
+    __tablename__ = 'name_sync_job'
+    __table_args__ = (
+        Index('ix_name_sync_job_target', 'entity', 'code', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
+    entity = Column(String, nullable=False)
+    code = Column(UUID(as_uuid=True), nullable=False)
+    supplier_type = Column(Enum(ActionType, native_enum=False), nullable=True)
+    enqueued_at = Column(DateTime, nullable=False)
+
+class BackgroundJob(Base):
+    """
+    JOB_BACKEND=postgres の場合のジョブの待ち行列（models.jobs）
+    成功したジョブは削除し、最大試行回数まで失敗したものは failed_at を入れて残す
+    key が同じジョブは id の順に1件ずつ実行する
+    """
+    __tablename__ = 'background_job'
+    __table_args__ = (
+        Index('ix_background_job_run_at', 'run_at'),
+        Index('ix_background_job_key_id', 'key', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    key = Column(String, nullable=True)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    failed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
 
 class Transactions(Base):
     __tablename__ = 'transactions'
     __table_args__ = (
         ForeignKeyConstraint(['item_code'], ['item.item_code'], ondelete="CASCADE"),
         ForeignKeyConstraint(['supplier_code', 'supplier_type'], ['supplier.supplier_code', 'supplier.supplier_type'], ondelete="CASCADE"),
+        # 履歴APIのキーセットページング用 (updated_at, id) の降順で走査する
+        Index('ix_transactions_team_updated_id', 'team_id', 'updated_at', 'id'),
+        Index('ix_transactions_item_updated_id', 'item_code', 'updated_at', 'id'),
+        Index('ix_transactions_supplier_updated_id', 'supplier_code', 'updated_at', 'id'),
+        # スキャナーの再送で同じ取引が二重登録されないようにする
+        UniqueConstraint('team_id', 'idempotency_key', name='uq_transactions_team_idempotency_key'),
     )
 
     id = Column(Integer, primary_key=True, index=True)
@@ -133,6 +262,7 @@ class Transactions(Base):
     price = Column(Float, nullable=True)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     updated_by = Column(String, nullable=False)
+    idempotency_key = Column(String, nullable=True)
     item = relationship("Item", foreign_keys=[item_code], back_populates="transactions")
     supplier = relationship(
         "Supplier",
@@ -146,6 +276,8 @@ class SupplierItem(Base):
     __table_args__ = (
         ForeignKeyConstraint(['item_code'], ['item.item_code'], ondelete="CASCADE"),
         ForeignKeyConstraint(['supplier_code', 'supplier_type'], ['supplier.supplier_code', 'supplier.supplier_type'], ondelete="CASCADE"),
+        # 商品ごとに1個あたりの仕入価格が安い仕入先を引くための索引
+        Index('ix_supplier_item_team_item_unit_cost', 'team_id', 'item_code', 'supplier_type', 'unit_cost'),
     )
 
     team_id = Column(Integer, ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
@@ -156,6 +288,8 @@ class SupplierItem(Base):
     supplier_name = Column(String, nullable=True)
     lot_price = Column(Float, nullable=True)
     lot_size = Column(Integer, nullable=True)
+    # 1個あたりの仕入価格（DBが lot_price / lot_size から計算して保存する生成列）
+    unit_cost = Column(Float, Computed("lot_price / NULLIF(lot_size, 0)", persisted=True))
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     updated_by = Column(String, nullable=False)
     supplier = relationship(
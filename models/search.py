@@ -0,0 +1,116 @@
+"""
+商品名のあいまい検索（スキャナーの商品検索用）
+
+チームごとに商品名の 2-gram の転置インデックスをメモリ上に作り、部分一致・前方一致・
+表記ゆれを含めて上位の候補を返す。商品名は NFKC で全角・半角をそろえ、
+カタカナはひらがなに寄せてから索引に載せる。
+
+インデックスはチームの "item" 版数と一緒に保持し、商品の登録・更新・削除で版数が
+進んだら次の検索時に作り直す。版数はプロセス内のカウンターなので、複数ワーカーの
+場合に備えて一定時間（ITEM_SEARCH_CACHE_TTL）で必ず作り直す。
+"""
+from collections import Counter, defaultdict
+from typing import Dict, List, Set, Tuple
+import heapq
+import threading
+import unicodedata
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.cache import TTLCache
+from models.config import ITEM_SEARCH_CACHE_TTL, ITEM_SEARCH_CACHE_SIZE
+from models.schemas import Item
+from models.versions import team_version
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def normalize(text: str) -> str:
+    """全角・半角、大文字・小文字、カタカナ・ひらがなの違いをそろえ、空白を取り除く"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = text.translate(_KATAKANA_TO_HIRAGANA)
+    return "".join(text.split())
+
+
+def _grams(text: str) -> Set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class ItemSearchIndex:
+    """1チーム分の商品名の 2-gram 転置インデックス"""
+
+    def __init__(self, items: List[Tuple[uuid.UUID, str]]):
+        self.codes = [code for code, _ in items]
+        self.names = [name for _, name in items]
+        self.normalized = [normalize(name) for name in self.names]
+        self.gram_counts = []
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.by_char: Dict[str, List[int]] = defaultdict(list)
+        for i, text in enumerate(self.normalized):
+            grams = _grams(text)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(i)
+            for char in set(text):
+                self.by_char[char].append(i)
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """
+        一致の強さ（完全一致 > 前方一致 > 部分一致）と 2-gram の重なり（Dice係数）で順位を付ける
+        1文字の検索語はその文字を含む商品名を対象にする
+        """
+        q = normalize(query)
+        if not q:
+            return []
+        if len(q) == 1:
+            candidates = Counter({i: 1 for i in self.by_char.get(q, ())})
+        else:
+            candidates = Counter()
+            for gram in _grams(q):
+                candidates.update(self.postings.get(gram, ()))
+        query_grams = len(_grams(q))
+
+        scored = []
+        for i, overlap in candidates.items():
+            text = self.normalized[i]
+            if text == q:
+                boost = 3.0
+            elif text.startswith(q):
+                boost = 2.0
+            elif q in text:
+                boost = 1.0
+            else:
+                boost = 0.0
+            similarity = 2 * overlap / (query_grams + self.gram_counts[i])
+            # 同点なら短い商品名を優先する
+            scored.append((boost + similarity, -len(text), i))
+        return [
+            {"item_code": self.codes[i], "item_name": self.names[i], "score": round(score, 4)}
+            for score, _, i in heapq.nlargest(limit, scored)
+        ]
+
+
+# team_id -> ("item" の版数, インデックス)
+_indexes = TTLCache(maxsize=ITEM_SEARCH_CACHE_SIZE, ttl=ITEM_SEARCH_CACHE_TTL)
+_build_lock = threading.Lock()
+
+
+def get_search_index(db: Session, team_id: int) -> ItemSearchIndex:
+    """チームの検索インデックスを返す（商品が変更されていれば作り直す）"""
+    version = team_version(team_id, "item")
+    cached = _indexes.get(team_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _build_lock:
+        # 待っている間に他のスレッドが作り直していればそれを使う
+        cached = _indexes.get(team_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        items = db.execute(select(Item.item_code, Item.item_name).where(Item.team_id == team_id)).all()
+        index = ItemSearchIndex([(row.item_code, row.item_name) for row in items])
+        _indexes.set(team_id, (version, index))
+        return index
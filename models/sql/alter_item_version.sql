@@ -0,0 +1 @@
+ALTER TABLE item ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
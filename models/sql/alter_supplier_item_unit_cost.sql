@@ -0,0 +1,3 @@
+-- 1個あたりの仕入価格を生成列として保存し、商品ごとに安い仕入先を索引で引けるようにする（PostgreSQL 12以上）
+ALTER TABLE supplier_item ADD COLUMN unit_cost DOUBLE PRECISION GENERATED ALWAYS AS (lot_price / NULLIF(lot_size, 0)) STORED;
+CREATE INDEX ix_supplier_item_team_item_unit_cost ON supplier_item (team_id, item_code, supplier_type, unit_cost);
@@ -0,0 +1,2 @@
+ALTER TABLE transactions ADD COLUMN idempotency_key TEXT;
+ALTER TABLE transactions ADD CONSTRAINT uq_transactions_team_idempotency_key UNIQUE (team_id, idempotency_key);
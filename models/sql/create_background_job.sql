@@ -0,0 +1,15 @@
+-- JOB_BACKEND=postgres の場合のジョブの待ち行列
+-- アプリとは別にワーカーを動かす場合は `python -m models.jobs work` を実行する
+CREATE TABLE background_job (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    key VARCHAR,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    failed_at TIMESTAMP,
+    last_error TEXT
+);
+CREATE INDEX ix_background_job_run_at ON background_job (run_at);
+CREATE INDEX ix_background_job_key_id ON background_job (key, id);
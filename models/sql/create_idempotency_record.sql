@@ -0,0 +1,13 @@
+-- 期限切れの行は `python -m models.idempotency purge` で定期的に削除する
+CREATE TABLE idempotency_record (
+    team_id INTEGER NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    scope VARCHAR NOT NULL,
+    key VARCHAR NOT NULL,
+    fingerprint VARCHAR NOT NULL,
+    status_code INTEGER NOT NULL,
+    response_body TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (team_id, scope, key)
+);
+CREATE INDEX ix_idempotency_record_expires_at ON idempotency_record (expires_at);
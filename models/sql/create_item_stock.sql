@@ -0,0 +1,11 @@
+-- 作成後に `python -m models.stock rebuild` を実行して台帳から初期化する
+CREATE TABLE item_stock (
+    item_code UUID PRIMARY KEY REFERENCES item(item_code) ON DELETE CASCADE,
+    team_id INTEGER NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    current_stock INTEGER NOT NULL DEFAULT 0,
+    last_moved_at TIMESTAMP,
+    last_transaction_id INTEGER,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX ix_item_stock_team_moved ON item_stock (team_id, last_moved_at);
+CREATE INDEX IF NOT EXISTS ix_item_team_id ON item (team_id);
@@ -0,0 +1,11 @@
+-- 商品名・仕入先名の変更を transactions / supplier_item の写しに反映する待ち行列
+-- 反映は `python -m models.namesync run` またはジョブキューの name_sync ジョブが行う
+CREATE TABLE name_sync_job (
+    id SERIAL PRIMARY KEY,
+    team_id INTEGER NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    entity VARCHAR NOT NULL,
+    code UUID NOT NULL,
+    supplier_type VARCHAR(3),
+    enqueued_at TIMESTAMP NOT NULL
+);
+CREATE INDEX ix_name_sync_job_target ON name_sync_job (entity, code, id);
@@ -0,0 +1,11 @@
+-- 作成後に `python -m models.checkpoint create` を実行して現在の在庫を最初のチェックポイントにする
+CREATE TABLE stock_checkpoint (
+    id SERIAL PRIMARY KEY,
+    item_code UUID NOT NULL REFERENCES item(item_code) ON DELETE CASCADE,
+    team_id INTEGER NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    taken_at TIMESTAMP NOT NULL,
+    stock INTEGER NOT NULL,
+    reason VARCHAR NOT NULL DEFAULT 'periodic'
+);
+CREATE INDEX ix_stock_checkpoint_item_taken ON stock_checkpoint (item_code, taken_at);
+CREATE INDEX ix_stock_checkpoint_team_taken ON stock_checkpoint (team_id, taken_at);
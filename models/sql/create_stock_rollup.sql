@@ -0,0 +1,13 @@
+-- 作成後に `python -m models.history rebuild` を実行して台帳から初期化する
+CREATE TABLE stock_rollup (
+    item_code UUID NOT NULL REFERENCES item(item_code) ON DELETE CASCADE,
+    resolution VARCHAR NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    team_id INTEGER NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    quantity_in INTEGER NOT NULL DEFAULT 0,
+    quantity_out INTEGER NOT NULL DEFAULT 0,
+    net INTEGER NOT NULL DEFAULT 0,
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (item_code, resolution, bucket_start)
+);
+CREATE INDEX ix_stock_rollup_team_bucket ON stock_rollup (team_id, resolution, bucket_start);
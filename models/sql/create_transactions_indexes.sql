@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS ix_transactions_team_updated_id ON transactions (team_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS ix_transactions_item_updated_id ON transactions (item_code, updated_at, id);
+CREATE INDEX IF NOT EXISTS ix_transactions_supplier_updated_id ON transactions (supplier_code, updated_at, id);
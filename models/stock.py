@@ -0,0 +1,328 @@
+"""
+在庫スナップショット (item_stock) の更新と再構築
+
+取引を登録・更新・削除したときは同じセッション内で apply_stock_delta を呼び、
+コミットと同時にスナップショットも確定させる。
+台帳から作り直す場合は `python -m models.stock rebuild [--team-id N]` を実行する。
+"""
+from datetime import datetime
+from typing import Optional, List, Dict
+import argparse
+import uuid
+
+from sqlalchemy import and_, func, case, select, update, delete, insert, values, column, bindparam, Integer, DateTime
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Session
+
+from models.config import PUBSUB_BACKEND
+from models.schemas import Item, ItemStock, Transactions
+from models.pubsub import broker, inventory_channel
+from models.jobs import job, job_queue
+from models.scan import update_scan
+from models.versions import bump_team_version
+
+
+def _ledger_stock_select(team_id: Optional[int] = None, item_code: Optional[uuid.UUID] = None):
+    """
+    台帳から在庫を集計するSELECT
+    商品の最終更新以降の取引数量を item_quantity に足し込む（従来の /inventory の計算と同じ）
+    """
+    quantity_case = func.sum(
+        case(
+            (Transactions.updated_at >= Item.updated_at, Transactions.quantity),
+            else_=0
+        )
+    )
+    last_moved_at = func.max(
+        case(
+            (Transactions.updated_at >= Item.updated_at, Transactions.updated_at),
+            else_=Item.updated_at
+        )
+    )
+    query = (
+        select(
+            Item.item_code,
+            Item.team_id,
+            (func.coalesce(Item.item_quantity, 0) + func.coalesce(quantity_case, 0)).label("current_stock"),
+            func.coalesce(last_moved_at, Item.updated_at).label("last_moved_at"),
+            func.max(Transactions.id).label("last_transaction_id"),
+        )
+        .outerjoin(Transactions, and_(Item.item_code == Transactions.item_code, Transactions.team_id == Item.team_id))
+        .group_by(Item.item_code, Item.team_id, Item.item_quantity, Item.updated_at)
+    )
+    if team_id is not None:
+        query = query.where(Item.team_id == team_id)
+    if item_code is not None:
+        query = query.where(Item.item_code == item_code)
+    return query
+
+
+def rebuild_item_stock(db: Session, team_id: Optional[int] = None, item_code: Optional[uuid.UUID] = None) -> int:
+    """
+    台帳からスナップショットを作り直す（コミットは呼び出し側で行う）
+    team_id / item_code を指定した場合はその範囲だけを再計算する
+    """
+    stmt = delete(ItemStock)
+    if team_id is not None:
+        stmt = stmt.where(ItemStock.team_id == team_id)
+    if item_code is not None:
+        stmt = stmt.where(ItemStock.item_code == item_code)
+    db.execute(stmt)
+
+    source = _ledger_stock_select(team_id, item_code)
+    result = db.execute(
+        insert(ItemStock).from_select(
+            ["item_code", "team_id", "current_stock", "last_moved_at", "last_transaction_id"],
+            source
+        )
+    )
+    return result.rowcount
+
+
+def apply_stock_delta(
+    db: Session,
+    team_id: int,
+    item_code: Optional[uuid.UUID],
+    delta: int,
+    moved_at: Optional[datetime] = None,
+    transaction_id: Optional[int] = None,
+) -> None:
+    """
+    取引による在庫の増減をスナップショットに反映する
+    行が未作成の商品（移行前の商品など）は台帳から再計算する
+    """
+    if item_code is None:
+        return
+    assignments = {
+        "current_stock": ItemStock.current_stock + delta,
+        "last_moved_at": moved_at or datetime.now(),
+    }
+    if transaction_id is not None:
+        assignments["last_transaction_id"] = transaction_id
+    result = db.execute(
+        update(ItemStock)
+        .where(ItemStock.team_id == team_id, ItemStock.item_code == item_code)
+        .values(**assignments)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.flush()
+        rebuild_item_stock(db, team_id=team_id, item_code=item_code)
+
+
+_DELTA_KEYS = ("item_code", "delta", "moved_at", "transaction_id")
+
+
+def _bulk_update(db: Session, table, team_id: int, changes: List[dict], assignments) -> int:
+    """
+    チームの商品ごとの増減 changes を1文で table に反映する
+    PostgreSQL では UPDATE ... FROM (VALUES ...) を、それ以外では executemany を使う
+    assignments は (delta, moved_at, transaction_id) の列式から SET 句の辞書を作る関数
+    """
+    if not changes:
+        return 0
+    if db.bind.dialect.name == "postgresql":
+        source = values(
+            column("item_code", UUID(as_uuid=True)),
+            column("delta", Integer),
+            column("moved_at", DateTime),
+            column("transaction_id", Integer),
+            name="v",
+        ).data([tuple(change[key] for key in _DELTA_KEYS) for change in changes])
+        stmt = (
+            update(table)
+            .where(table.c.team_id == team_id, table.c.item_code == source.c.item_code)
+            .values(**assignments(source.c.delta, source.c.moved_at, source.c.transaction_id))
+        )
+        return db.execute(stmt.execution_options(synchronize_session=False)).rowcount
+    stmt = (
+        update(table)
+        .where(table.c.team_id == team_id, table.c.item_code == bindparam("b_item_code"))
+        .values(**assignments(bindparam("b_delta"), bindparam("b_moved_at"), bindparam("b_transaction_id")))
+    )
+    params = [{f"b_{key}": change[key] for key in _DELTA_KEYS} for change in changes]
+    return db.connection().execute(stmt, params).rowcount
+
+
+def apply_stock_deltas(db: Session, team_id: int, changes: List[dict]) -> None:
+    """
+    複数商品の在庫増減をまとめてスナップショットに反映する
+    changes は item_code, delta, moved_at, transaction_id を持つ辞書のリスト（商品ごとに集約済み）
+    """
+    table = ItemStock.__table__
+    updated = _bulk_update(
+        db, table, team_id, changes,
+        lambda delta, moved_at, transaction_id: {
+            "current_stock": table.c.current_stock + delta,
+            "last_moved_at": moved_at,
+            "last_transaction_id": transaction_id,
+        }
+    )
+    if updated < len(changes):
+        codes = [change["item_code"] for change in changes]
+        existing = set(db.scalars(
+            select(ItemStock.item_code).where(ItemStock.team_id == team_id, ItemStock.item_code.in_(codes))
+        ))
+        for code in codes:
+            if code not in existing:
+                rebuild_item_stock(db, team_id=team_id, item_code=code)
+
+
+def apply_item_quantity_delta(
+    db: Session,
+    team_id: int,
+    item_code: Optional[uuid.UUID],
+    delta: int,
+    updated_by: Optional[str] = None,
+) -> bool:
+    """
+    商品の item_quantity を UPDATE item SET item_quantity = item_quantity + :delta で増減する
+    読み込んでから書き戻さないため、同じ商品への取引が同時に来ても更新が失われない
+    チームの商品がなければ False を返す
+    """
+    if item_code is None:
+        return False
+    assignments = {
+        "item_quantity": func.coalesce(Item.item_quantity, 0) + delta,
+        "updated_at": datetime.now(),
+    }
+    if updated_by is not None:
+        assignments["updated_by"] = updated_by
+    result = db.execute(
+        update(Item)
+        .where(Item.team_id == team_id, Item.item_code == item_code)
+        .values(**assignments)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def apply_item_quantity_deltas(db: Session, team_id: int, changes: List[dict]) -> int:
+    """
+    複数商品の item_quantity をまとめて増減する（changes の形式は apply_stock_deltas と同じ）
+    """
+    table = Item.__table__
+    return _bulk_update(
+        db, table, team_id, changes,
+        lambda delta, moved_at, transaction_id: {
+            "item_quantity": func.coalesce(table.c.item_quantity, 0) + delta,
+            "updated_at": datetime.now(),
+        }
+    )
+
+
+def reset_item_stock(db: Session, item: Item) -> None:
+    """
+    商品の在庫数を直接設定したとき（新規登録・棚卸し）にスナップショットを合わせる
+    """
+    db.flush()
+    result = db.execute(
+        update(ItemStock)
+        .where(ItemStock.team_id == item.team_id, ItemStock.item_code == item.item_code)
+        .values(
+            current_stock=item.item_quantity or 0,
+            last_moved_at=item.updated_at or datetime.now(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.add(ItemStock(
+            item_code=item.item_code,
+            team_id=item.team_id,
+            current_stock=item.item_quantity or 0,
+            last_moved_at=item.updated_at or datetime.now(),
+        ))
+
+
+def _stock_messages(db: Session, team_id: int, deltas: Dict[uuid.UUID, Optional[int]]) -> List[dict]:
+    """変動した商品の現在の在庫を読み、/inventory/stream に流すメッセージを作る"""
+    rows = db.execute(
+        select(Item.item_code, Item.item_name, ItemStock.current_stock, ItemStock.last_moved_at)
+        .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+        .where(Item.team_id == team_id, Item.item_code.in_(list(deltas)))
+    ).all()
+    return [
+        {
+            "type": "stock",
+            "item_code": str(row.item_code),
+            "item_name": row.item_name,
+            "delta": deltas.get(row.item_code),
+            "current_stock": row.current_stock,
+            "updated_at": row.last_moved_at.isoformat() if row.last_moved_at else None,
+        }
+        for row in rows
+    ]
+
+
+def publish_stock_changes(db: Session, team_id: int, deltas: Dict[uuid.UUID, Optional[int]]) -> None:
+    """
+    コミット後に呼び出し、変動した商品の現在の在庫を /inventory/stream の購読者に配信する
+    deltas は item_code -> 増減数（棚卸しや名称変更など増減がない場合はNone）
+    """
+    if not deltas:
+        return
+    channel = inventory_channel(team_id)
+    for message in _stock_messages(db, team_id, deltas):
+        broker.publish(channel, message)
+
+
+@job("publish_stock_changes")
+def _publish_stock_changes_job(team_id: int, deltas: list):
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        publish_stock_changes(db, team_id, {uuid.UUID(code): delta for code, delta in deltas})
+    finally:
+        db.close()
+
+
+def queue_stock_changes(db: Session, team_id: int, deltas: Dict[uuid.UUID, Optional[int]]) -> None:
+    """
+    コミット後に呼び、このプロセスのスキャン用キャッシュをその場で書き換えてから、
+    他のプロセス・購読者への配信（publish_stock_changes）をジョブキューで実行する
+    配信する在庫は実行時に読み直すため、同じチームの配信を積んだ順に1件ずつ実行して古い値で上書きしないようにする
+    """
+    if not deltas:
+        return
+    # 応答を返した直後のスキャンが変動前の在庫を返さないよう、配信を待たずに反映する
+    for message in _stock_messages(db, team_id, deltas):
+        update_scan(team_id, message)
+    job_queue.enqueue(
+        "publish_stock_changes",
+        key=inventory_channel(team_id),
+        team_id=team_id,
+        deltas=[[str(code), delta] for code, delta in deltas.items()],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在庫スナップショットの管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="台帳から在庫スナップショットを再構築")
+    rebuild.add_argument("--team-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from models.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            count = rebuild_item_stock(db, team_id=args.team_id)
+            if args.team_id is not None:
+                team_ids = [args.team_id]
+            else:
+                team_ids = db.scalars(select(ItemStock.team_id).distinct()).all()
+            db.commit()
+            # 在庫一覧（as_of 指定を含む）・在庫推移・商品一覧のETagはどれも inventory の版数から作る
+            for team_id in team_ids:
+                bump_team_version(team_id, "inventory")
+            print(f"Rebuilt stock snapshot for {count} items in {len(team_ids)} teams")
+            if PUBSUB_BACKEND != "postgres":
+                print("PUBSUB_BACKEND is not postgres: restart running API processes to invalidate their ETags")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+チームごとのデータ版数
+
+一覧系APIのETagに使う。書き込み系のAPIやCLIがコミット後に bump_team_version を呼び、
+一覧APIは版数からETagを作って、変わっていなければDBに触れずに 304 を返す。
+版数はプロセス内のカウンターなので、起動ごとに変わる BOOT_ID もETagに含める。
+PUBSUB_BACKEND=postgres の場合は版数を進めたことを pub/sub で他のプロセスにも伝え、別のプロセス
+（他のAPIのワーカー・ジョブのワーカー・CLI）での書き込みの後に古いETagで 304 を返さないようにする。
+受信用の接続が切れている間は他のプロセスの版数の変更がわからないため 304 を返さず、切断・再接続の
+たびに全チームの版数を進めて、それまでに発行したETagを無効にする。
+"""
+from typing import Dict, Iterable, Optional, Tuple
+import threading
+import uuid
+
+from models.config import PUBSUB_BACKEND
+from models.pubsub import broker
+
+BOOT_ID = uuid.uuid4().hex[:8]
+VERSIONS_CHANNEL = "versions"
+
+_versions: Dict[Tuple[int, str], int] = {}
+# 全チームの版数をまとめて進めた回数（scope ごと）
+_all_teams: Dict[str, int] = {}
+# pub/sub の受信が途切れた回数（全チーム・全 scope の版数に足す）
+_resets = 0
+_lock = threading.Lock()
+
+
+def _bump(team_id: Optional[int], scopes: Iterable[str]) -> None:
+    with _lock:
+        for scope in scopes:
+            if team_id is None:
+                _all_teams[scope] = _all_teams.get(scope, 0) + 1
+            else:
+                _versions[(team_id, scope)] = _versions.get((team_id, scope), 0) + 1
+
+
+def bump_team_version(team_id: Optional[int], *scopes: str) -> None:
+    """チームの指定したデータ（inventory / item / supplier など）の版数を進める（team_id が None なら全チーム）"""
+    _bump(team_id, scopes)
+    if PUBSUB_BACKEND != "postgres":
+        return
+    try:
+        broker.publish(VERSIONS_CHANNEL, {"boot_id": BOOT_ID, "team_id": team_id, "scopes": list(scopes)})
+    except Exception as e:
+        # 書き込みはコミット済みなので失敗にはしない（他のプロセスは次の書き込みまで古い版数のまま）
+        print(f"version broadcast failed: {e}")
+
+
+def team_version(team_id: int, scope: str) -> int:
+    return _versions.get((team_id, scope), 0) + _all_teams.get(scope, 0) + _resets
+
+
+def versions_current() -> bool:
+    """他のプロセスでの版数の変更を受信できているか（False の間は版数が古い可能性がある）"""
+    return broker.connected
+
+
+def _on_versions_message(channel: str, message: dict) -> None:
+    # 自プロセスの分は bump_team_version で進めてある
+    if channel != VERSIONS_CHANNEL or message.get("boot_id") == BOOT_ID:
+        return
+    _bump(message["team_id"], message["scopes"])
+
+
+def _on_reset() -> None:
+    global _resets
+    with _lock:
+        _resets += 1
+
+
+broker.add_listener(_on_versions_message)
+broker.add_reset_listener(_on_reset)
@@ -3,6 +3,9 @@ from .item import router as item_router
 from .supplier import supplier_router, supplier_item_router
 from .transaction import router as transaction_router
 from .auth import router as auth_router
+from .metrics import router as metrics_router
+from .scan import router as scan_router
+from .planning import router as planning_router
 
 __all__ = [
     "inventory_router",
@@ -10,5 +13,8 @@ __all__ = [
     "supplier_router",
     "supplier_item_router",
     "transaction_router",
-    "auth_router"
+    "auth_router",
+    "metrics_router",
+    "scan_router",
+    "planning_router"
 ]
\ No newline at end of file
@@ -7,10 +7,20 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import jwt
 import os
-from models.db import get_db
+from models.db import get_db, get_async_db
 from models.schemas import User
+from models.cache import TTLCache
+from models.config import PRINCIPAL_CACHE_SIZE, PASSWORD_HASH_WORKERS, PUBSUB_BACKEND
+from models.pubsub import broker
 from dotenv import load_dotenv
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import asyncio
+import hashlib
+import time
 
 load_dotenv()
 
@@ -18,12 +28,21 @@ router = APIRouter()
 oauth = OAuth()
 security = HTTPBearer()
 pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+# パスワードのハッシュ計算専用のスレッドプール（argon2/bcryptは計算中にGILを解放する）
+# イベントループと通常のリクエスト用スレッドプールを塞がないように同時実行数を制限する
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 
 # JWT設定
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# トークンのハッシュ -> ユーザー（有効期限はトークンのexpに合わせる）
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# ユーザーID -> トークンを失効させた時刻（これより前に発行されたトークンを拒否する。発行済みトークンが切れるまで保持）
+revoked_users = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+USERS_CHANNEL = "users"
+
 # Google OAuth設定
 CONF_URL = 'https://accounts.google.com/.well-known/openid-configuration'
 oauth.register(
@@ -43,9 +62,34 @@ def verify_password(plain_password, hashed_password):
         # ハッシュが認識できない場合やエラーが発生した場合はFalseを返す
         return False
 
+def verify_and_update_password(plain_password, hashed_password):
+    """
+    パスワードを検証し、ハッシュ方式やパラメータが古い場合は新しいハッシュも返す
+    戻り値は (検証結果, 新しいハッシュまたはNone)
+    """
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except Exception:
+        return False, None
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def run_in_password_pool(func, *args):
+    """CPU負荷の高いハッシュ計算をパスワード専用のスレッドプールで実行する"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, func, *args)
+
+async def _get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+async def _add_user(db: AsyncSession, user: User) -> User:
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -56,24 +100,96 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+def create_user_token(user: User) -> str:
+    """
+    ユーザーID・名前をクレームに含めたアクセストークンを作成する
+    クレームがあれば get_current_user はDBを参照せずにユーザーを復元できる
+    （所属チームは変更がすぐ反映されるよう、トークンには含めず router.team で確認する）
+    """
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return create_access_token(
+        # iat は失効させた時刻と比べるため秒未満まで持たせる
+        data={"sub": user.email, "uid": user.id, "name": user.name, "iat": time.time()},
+        expires_delta=access_token_expires
+    )
+
+def _drop_user(user_id: int, revoked_at: Optional[float]):
+    from router.team import invalidate_membership
+
+    if revoked_at is not None:
+        revoked_users.set(user_id, max(revoked_at, revoked_users.get(user_id, 0)))
+    principal_cache.pop_where(lambda key, user: user.id == user_id)
+    invalidate_membership(user_id)
+
+def invalidate_user(user_id: int, revoke_tokens: bool = False):
+    """
+    ユーザーの所属・認証情報が変わったときに呼び、キャッシュ済みの認証結果と所属情報を捨てる
+    削除・無効化・パスワード変更の場合は revoke_tokens=True にして、それまでに発行したトークンを拒否する
+    PUBSUB_BACKEND=postgres の場合は他のプロセスのキャッシュも捨てる
+    """
+    revoked_at = time.time() if revoke_tokens else None
+    _drop_user(user_id, revoked_at)
+    if PUBSUB_BACKEND != "postgres":
+        return
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except jwt.PyJWTError as e:
-        print(f"JWT decode error: {e}")
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user = db.query(User).filter(User.email == email).first()
+        broker.publish(USERS_CHANNEL, {"user_id": user_id, "revoked_at": revoked_at})
+    except Exception as e:
+        print(f"user invalidation broadcast failed: {e}")
+
+def _on_users_message(channel: str, message: dict):
+    # 自プロセスの分も届くが、同じ内容を捨て直すだけなので区別しない
+    if channel == USERS_CHANNEL:
+        _drop_user(message["user_id"], message.get("revoked_at"))
+
+def _on_users_reset():
+    # 他のプロセスでの所属・認証情報の変更を取りこぼした可能性があるので、キャッシュを全件捨てる
+    from router.team import membership_cache
+
+    principal_cache.clear()
+    membership_cache.clear()
+
+broker.add_listener(_on_users_message)
+broker.add_reset_listener(_on_users_reset)
+
+def resolve_user(token: str, db: Session) -> User:
+    """
+    JWTからユーザーを取得する
+    ヘッダーを付けられない EventSource / WebSocket からはクエリパラメータのトークンで呼び出す
+    """
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    user = principal_cache.get(token_hash)
     if user is None:
-        print(f"User not found for email: {email}")
-        raise HTTPException(status_code=401, detail="User not found")
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise HTTPException(status_code=401, detail="Invalid token")
+        except jwt.PyJWTError as e:
+            print(f"JWT decode error: {e}")
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        if payload.get("uid") is not None:
+            user = User(id=payload["uid"], name=payload.get("name"), email=email)
+        else:
+            # uidを含まない旧形式のトークンはDBから取得する
+            db_user = db.query(User).filter(User.email == email).first()
+            if db_user is None:
+                print(f"User not found for email: {email}")
+                raise HTTPException(status_code=401, detail="User not found")
+            # セッションに紐づかないコピーをキャッシュする
+            user = User(id=db_user.id, name=db_user.name, email=db_user.email)
+        revoked_at = revoked_users.get(user.id)
+        if revoked_at is not None and payload.get("iat", 0) < revoked_at:
+            raise HTTPException(status_code=401, detail="Token revoked")
+        ttl = payload["exp"] - time.time() if "exp" in payload else None
+        principal_cache.set(token_hash, user, ttl=ttl)
     return user
 
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+    return resolve_user(credentials.credentials, db)
+
 @router.post("/api/auth/register")
-async def register(request: Request, db: Session = Depends(get_db)):
+async def register(request: Request, db: AsyncSession = Depends(get_async_db)):
     body = await request.json()
     name = body.get("name")
     email = body.get("email")
@@ -83,26 +199,21 @@ async def register(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Missing required fields")
     
     # 既存ユーザーチェック
-    existing_user = db.query(User).filter(User.email == email).first()
+    existing_user = await _get_user_by_email(db, email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # 新規ユーザー作成
-    hashed_password = get_password_hash(password)
+    hashed_password = await run_in_password_pool(get_password_hash, password)
     user = User(
         name=name,
         email=email,
         password_hash=hashed_password
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    user = await _add_user(db, user)
     
     # アクセストークン作成
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user)
     
     return {
         "token": access_token,
@@ -115,7 +226,7 @@ async def register(request: Request, db: Session = Depends(get_db)):
     }
 
 @router.post("/api/auth/login")
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_async_db)):
     body = await request.json()
     email = body.get("email")
     password = body.get("password")
@@ -124,15 +235,19 @@ async def login(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Missing email or password")
     
     # ユーザー認証
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.password_hash):
+    user = await _get_user_by_email(db, email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    verified, new_hash = await run_in_password_pool(verify_and_update_password, password, user.password_hash)
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    if new_hash:
+        # 古い方式（bcryptなど）のハッシュはログイン時に現在の方式へ移行する
+        user.password_hash = new_hash
+        await db.commit()
     
     # アクセストークン作成
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user)
     
     return {
         "token": access_token,
@@ -173,26 +288,21 @@ async def google_login(request: Request):
     return await oauth.google.authorize_redirect(request, redirect_uri)
 
 @router.get("/auth/callback")
-async def auth_callback(request: Request, db: Session = Depends(get_db)):
+async def auth_callback(request: Request, db: AsyncSession = Depends(get_async_db)):
     token = await oauth.google.authorize_access_token(request)
     user_info = await oauth.google.parse_id_token(request, token)
 
     # DBに存在しなければ登録
-    user = db.query(User).filter(User.email == user_info['email']).first()
+    user = await _get_user_by_email(db, user_info['email'])
     if not user:
         user = User(
             name=user_info['name'],
             email=user_info['email'],
             password_hash='sso'  # パスワードは使わない
         )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+        user = await _add_user(db, user)
 
     # JWTトークン作成
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user)
     
     return RedirectResponse(url=f"/dashboard?token={access_token}")
@@ -0,0 +1,26 @@
+from typing import Optional
+from fastapi import Request, Response
+from models.versions import BOOT_ID, team_version, versions_current
+
+
+def listing_etag(team_id: int, scope: str, *parts: str) -> str:
+    """チームの版数から一覧APIの弱いETagを作る（結果が版数以外にも依存する場合はその値を parts に渡す）"""
+    tag = "-".join([scope, str(team_id), BOOT_ID, str(team_version(team_id, scope)), *parts])
+    return f'W/"{tag}"'
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    If-None-Match がETagと一致すれば 304 のレスポンスを返す
+    一致しなければ通常のレスポンスにETagを付けて None を返す
+    他のプロセスの版数の変更を受信できていない間は、一致しても 304 にしない
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and versions_current():
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        # 弱い比較なので W/ の有無は区別しない
+        if "*" in candidates or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in candidates]:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,17 @@
+from datetime import datetime
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from models.export import FORMATS, Columns, parquet_available, stream_export
+
+
+def export_response(statement, columns: Columns, format: str, name: str) -> StreamingResponse:
+    """SELECTの結果をダウンロード用のストリーミングレスポンスとして返す"""
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet形式で出力するには pyarrow をインストールしてください")
+    media_type, extension = FORMATS[format]
+    filename = f"{name}-{datetime.now():%Y%m%d%H%M%S}.{extension}"
+    return StreamingResponse(
+        stream_export(statement, columns, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,89 @@
+from typing import Optional
+import json
+
+from fastapi import Header, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.idempotency import StoredResponse, fingerprint, find_response, save_response, cache_response, schedule_purge
+
+
+def idempotency_key(key: Optional[str] = Header(None, alias="Idempotency-Key")) -> Optional[str]:
+    """Idempotency-Key ヘッダー（省略可）"""
+    if key is not None and not 1 <= len(key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key は1〜255文字で指定してください")
+    return key
+
+
+def response_from_orm(model, obj):
+    """
+    ORMのオブジェクトをレスポンスモデルに詰める（保存するレスポンスを response_model と同じ形にする）
+    pydantic v1 / v2 のどちらでも動くよう、属性を読んでからモデルを作る
+    """
+    fields = getattr(model, "model_fields", None) or model.__fields__
+    return model(**{name: getattr(obj, name) for name in fields})
+
+
+class IdempotentRequest:
+    """
+    1リクエスト分の Idempotency-Key の扱い
+    replay() で再送かどうかを確認し、書き込みの最後に db.commit() の代わりに commit() を呼ぶ
+    キーがない場合はどちらも通常どおりの動作になる
+    """
+
+    def __init__(self, db: Session, team_id: int, scope: str, key: Optional[str], payload):
+        self.db = db
+        self.team_id = team_id
+        self.scope = scope
+        self.key = key
+        self.fingerprint = fingerprint(jsonable_encoder(payload)) if key else None
+
+    def _replay(self, stored: StoredResponse) -> Response:
+        if stored.fingerprint != self.fingerprint:
+            raise HTTPException(status_code=422, detail="同じ Idempotency-Key で異なる内容のリクエストが送信されました")
+        return Response(
+            content=stored.body,
+            status_code=stored.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    def replay(self) -> Optional[Response]:
+        """同じキーのリクエストを処理済みなら、そのときのレスポンスを返す"""
+        if not self.key:
+            return None
+        stored = find_response(self.db, self.team_id, self.scope, self.key)
+        return self._replay(stored) if stored else None
+
+    def commit(self, body, status_code: int = 200) -> Optional[Response]:
+        """
+        body をレスポンスとして書き込みと同じDBトランザクションで保存してコミットする
+        同じキーの同時リクエストに先を越された場合はロールバックし、先に確定したレスポンスを返す
+        """
+        if not self.key:
+            self.db.commit()
+            return None
+        stored = StoredResponse(
+            self.fingerprint,
+            status_code,
+            json.dumps(jsonable_encoder(body), ensure_ascii=False, separators=(",", ":")),
+        )
+        error = None
+        try:
+            saved = save_response(self.db, self.team_id, self.scope, self.key, stored)
+            if saved:
+                self.db.commit()
+        except IntegrityError as e:
+            saved, error = False, e
+        if not saved:
+            self.db.rollback()
+            winner = find_response(self.db, self.team_id, self.scope, self.key)
+            if winner is not None:
+                return self._replay(winner)
+            if error is not None:
+                raise error
+            raise HTTPException(status_code=409, detail="同じ Idempotency-Key のリクエストを処理中です。再送してください")
+        cache_response(self.team_id, self.scope, self.key, stored)
+        schedule_purge()
+        return None
@@ -1,14 +1,25 @@
-from models.db import get_db
-from models.schemas import Item, Transactions
+from models.db import get_db, SessionLocal
+from models.schemas import Item, ItemStock, StockRollup
+from models.history import bucket_start
+from models.checkpoint import stock_as_of_select
+from models.pubsub import broker, inventory_channel
+from models.config import STREAM_HEARTBEAT_SECONDS, HISTORY_MAX_POINTS
 from sqlalchemy.orm import Session
-from fastapi import Depends, Request, HTTPException
-from sqlalchemy import func, desc, case, or_, and_
+from fastapi import Depends, Request, Response, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, desc, select
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Optional, Literal
+from datetime import datetime, timedelta
 from fastapi import APIRouter
-from router.auth import get_current_user
-from models.schemas import User
+from router.auth import resolve_user
+from router.team import get_current_team_id, resolve_team_id
+from router.etag import listing_etag, not_modified
+from router.export import export_response
+import anyio
+import asyncio
+import json
 import uuid
 
 
@@ -18,124 +29,347 @@ class InventoryBase(BaseModel):
     current_stock: int
 
 class InventoryRead(InventoryBase):
+    item_quantity: Optional[int] = None
     updated_at: datetime
 
     class Config:
         orm_mode = True
 
+class HistoryPoint(BaseModel):
+    bucket_start: datetime
+    quantity_in: int
+    quantity_out: int
+    net: int
+    transactions: int
+    # 区間の終わり時点の在庫数（現在の在庫から以降の増減を差し引いて求める）
+    stock: Optional[int] = None
+
 
 router = APIRouter(prefix="/inventory")
 
+Resolution = Literal["hour", "day", "week", "month"]
+
+# 期間を指定しなかった場合に返す範囲
+_DEFAULT_SPAN = {
+    "hour": timedelta(days=7),
+    "day": timedelta(days=365),
+    "week": timedelta(days=365),
+    "month": timedelta(days=365 * 3),
+}
+_UNIT = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=28),
+}
+
+
+def _inventory_query(db: Session):
+    """
+    在庫スナップショットを商品に結合したクエリ
+    スナップショット未作成の商品は item_quantity をそのまま在庫とみなす
+    """
+    current_stock = func.coalesce(ItemStock.current_stock, Item.item_quantity, 0)
+    last_updated_at = func.coalesce(ItemStock.last_moved_at, Item.updated_at).label("updated_at")
+    return (
+        db.query(
+            Item.item_code,
+            Item.item_name,
+            current_stock.label("current_stock"),
+            current_stock.label("item_quantity"),
+            last_updated_at
+        )
+        .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+        .order_by(desc(last_updated_at))
+    )
+
 @router.get("/", response_model=List[InventoryRead])
 def get_inventory(
     request: Request,
+    response: Response,
+    as_of: Optional[datetime] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
     """
     Get all inventory items, ordered by the most recent update time
     (either from the item itself or its latest transaction).
+    The stock is read from the item_stock snapshot, so the cost does not
+    depend on the size of the transaction history.
+    With as_of, returns the stock at that time, starting from the nearest
+    preceding stock checkpoint and applying only the later transactions.
+    Returns 304 without querying when the team's inventory is unchanged
+    (the ETag includes as_of, so each point in time is cached separately).
     """
+    parts = [as_of.isoformat()] if as_of is not None else []
+    cached = not_modified(request, response, listing_etag(team_id, "inventory", *parts))
+    if cached:
+        return cached
 
-    quantity_case = func.sum(
-        case(
-            (Transactions.updated_at >= Item.updated_at, Transactions.quantity),
-            else_=0
-        )
-    )
+    if as_of is not None:
+        query = stock_as_of_select(as_of, team_id).order_by(desc("updated_at"))
+        return db.execute(query).all()
 
-    last_updated_at = func.max(
-        case(
-            (Transactions.updated_at >= Item.updated_at, Transactions.updated_at),
-            else_=Item.updated_at
-        )
-    ).label("updated_at")
-
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
+    query = _inventory_query(db).filter(Item.team_id == team_id)
+
+    inventory = query.all()
+    return inventory
+
+def _authorize_stream(token: Optional[str], team_id: Optional[str]) -> int:
+    """ストリーム接続時の認証（EventSource / WebSocket はヘッダーを付けられないためクエリでも受け付ける）"""
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    db = SessionLocal()
+    try:
+        user = resolve_user(token, db)
+        return resolve_team_id(db, user, team_id)
+    finally:
+        db.close()
+
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return None
+
+EXPORT_COLUMNS = [
+    ("item_code", "str"),
+    ("item_name", "str"),
+    ("current_stock", "int"),
+    ("updated_at", "datetime"),
+]
+
+@router.get("/export")
+def export_inventory(
+    format: Literal["csv", "ndjson", "parquet"] = "csv",
+    as_of: Optional[datetime] = None,
+    team_id: int = Depends(get_current_team_id)
+):
+    """チームの在庫一覧（as_of を指定した場合はその時点の在庫）をCSV / NDJSON / Parquetでダウンロードする"""
+    if as_of is not None:
+        source = stock_as_of_select(as_of, team_id).subquery()
+        query = select(*[source.c[name] for name, _ in EXPORT_COLUMNS]).order_by(source.c.item_name)
     else:
+        query = (
+            select(
+                Item.item_code,
+                Item.item_name,
+                func.coalesce(ItemStock.current_stock, Item.item_quantity, 0),
+                func.coalesce(ItemStock.last_moved_at, Item.updated_at),
+            )
+            .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+            .where(Item.team_id == team_id)
+            .order_by(Item.item_name)
+        )
+    return export_response(query, EXPORT_COLUMNS, format, f"inventory-{team_id}")
+
+@router.get("/stream")
+async def stream_inventory(
+    request: Request,
+    token: Optional[str] = None,
+    team_id: Optional[str] = None
+):
+    """
+    在庫の変動を Server-Sent Events で配信する
+    接続時に一度だけ認証し、以降は取引・商品の更新ごとに変動した商品の在庫を送る
+    """
+    token = token or _bearer_token(request.headers.get("Authorization"))
+    team_id = await run_in_threadpool(_authorize_stream, token, team_id or request.headers.get("X-Team-ID"))
+    subscription = broker.subscribe(inventory_channel(team_id))
+
+    async def events():
         try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscription.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: {message['type']}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/stream/ws")
+async def stream_inventory_ws(
+    websocket: WebSocket,
+    token: Optional[str] = None,
+    team_id: Optional[str] = None
+):
+    """在庫の変動を WebSocket で配信する（メッセージの形式は /inventory/stream と同じ）"""
+    try:
+        team_id = await run_in_threadpool(_authorize_stream, token, team_id)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    await websocket.accept()
+    subscription = broker.subscribe(inventory_channel(team_id))
+
+    async def send():
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                message = {"type": "heartbeat"}
+            await websocket.send_json(message)
+
+    try:
+        async with anyio.create_task_group() as task_group:
+            async def receive():
+                # クライアントからのメッセージは使わないが、切断を検知するために読み続ける
+                try:
+                    while True:
+                        await websocket.receive_text()
+                except WebSocketDisconnect:
+                    pass
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(send)
+            task_group.start_soon(receive)
+    finally:
+        subscription.close()
+
+def _history_window(resolution: str, since: Optional[datetime], until: Optional[datetime]) -> tuple:
+    """省略された期間を補って (since, until) を返す（既定は現在までの直近の期間）"""
+    until = until or datetime.now()
+    since = since or until - _DEFAULT_SPAN[resolution]
+    if since > until:
+        raise HTTPException(status_code=400, detail="since は until より前の日時を指定してください")
+    if (until - since) / _UNIT[resolution] > HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail="期間が長すぎます。粒度を粗くするか期間を短くしてください")
+    return since, until
+
+def _history_etag(team_id: int, resolution: str, since: datetime, until: datetime) -> str:
+    """
+    在庫推移のETag（在庫の版数に期間を加える）
+    既定の期間は時刻とともに進むため、結果が変わる集計区間の境目を越えたらETagも変える
+    """
+    stored = "hour" if resolution == "hour" else "day"
+    window = f"{bucket_start(since, stored):%Y%m%d%H}-{bucket_start(until, stored):%Y%m%d%H}"
+    return listing_etag(team_id, "inventory", window)
+
+def _history(
+    db: Session,
+    team_id: int,
+    resolution: str,
+    since: datetime,
+    until: datetime,
+    item_code: Optional[uuid.UUID] = None
+) -> List[dict]:
+    """
+    since から until までの在庫推移を stock_rollup から返す（取引のない区間は含まない）
+    week / month は日次の集計をまとめて求める
+    """
+    stored = "hour" if resolution == "hour" else "day"
+
+    # 現在の在庫と、until より後の増減の合計（区間ごとの在庫数を逆算するため）
+    current_query = (
+        db.query(func.sum(func.coalesce(ItemStock.current_stock, Item.item_quantity, 0)), func.count(Item.item_code))
+        .outerjoin(ItemStock, Item.item_code == ItemStock.item_code)
+        .filter(Item.team_id == team_id)
+    )
+    later_query = db.query(func.coalesce(func.sum(StockRollup.net), 0)).filter(
+        StockRollup.team_id == team_id,
+        StockRollup.resolution == stored,
+        StockRollup.bucket_start > until
+    )
     query = (
         db.query(
-            Item.item_code,
-            Item.item_name,
-            (Item.item_quantity + func.coalesce(quantity_case, 0)).label("item_quantity"),
-            last_updated_at
+            StockRollup.bucket_start,
+            func.sum(StockRollup.quantity_in).label("quantity_in"),
+            func.sum(StockRollup.quantity_out).label("quantity_out"),
+            func.sum(StockRollup.net).label("net"),
+            func.sum(StockRollup.transaction_count).label("transactions"),
         )
-        .outerjoin(Transactions, Item.item_code == Transactions.item_code)
-        .filter(Item.team_id == team_id)
-        .group_by(Item.item_code, Item.item_name, Item.item_quantity, Item.updated_at)
-        .order_by(desc(last_updated_at))
+        .filter(
+            StockRollup.team_id == team_id,
+            StockRollup.resolution == stored,
+            StockRollup.bucket_start >= bucket_start(since, stored),
+            StockRollup.bucket_start <= until
+        )
+        .group_by(StockRollup.bucket_start)
+        .order_by(StockRollup.bucket_start)
     )
+    if item_code is not None:
+        current_query = current_query.filter(Item.item_code == item_code)
+        later_query = later_query.filter(StockRollup.item_code == item_code)
+        query = query.filter(StockRollup.item_code == item_code)
 
-    inventory = query.all()
-    return inventory
+    current_stock, item_count = current_query.one()
+    if item_code is not None and not item_count:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    points = {}
+    for row in query.all():
+        start = row.bucket_start
+        if resolution == "week":
+            start = start - timedelta(days=start.weekday())
+        elif resolution == "month":
+            start = start.replace(day=1)
+        point = points.setdefault(start, {"bucket_start": start, "quantity_in": 0, "quantity_out": 0, "net": 0, "transactions": 0})
+        for key in ("quantity_in", "quantity_out", "net", "transactions"):
+            point[key] += row._mapping[key] or 0
+
+    stock = (current_stock or 0) - later_query.scalar()
+    for point in reversed(list(points.values())):
+        point["stock"] = stock
+        stock -= point["net"]
+    return list(points.values())
+
+@router.get("/history", response_model=List[HistoryPoint])
+def get_team_history(
+    request: Request,
+    response: Response,
+    resolution: Resolution = "day",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """チーム全体の在庫推移（入庫数・出庫数・在庫数）を時間帯ごとに返す"""
+    since, until = _history_window(resolution, since, until)
+    cached = not_modified(request, response, _history_etag(team_id, resolution, since, until))
+    if cached:
+        return cached
+    return _history(db, team_id, resolution, since, until)
+
+@router.get("/{item_code}/history", response_model=List[HistoryPoint])
+def get_item_history(
+    item_code: uuid.UUID,
+    request: Request,
+    response: Response,
+    resolution: Resolution = "day",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """商品の在庫推移を時間帯ごとに返す（台帳ではなく stock_rollup を読む）"""
+    since, until = _history_window(resolution, since, until)
+    cached = not_modified(request, response, _history_etag(team_id, resolution, since, until))
+    if cached:
+        return cached
+    return _history(db, team_id, resolution, since, until, item_code)
 
 @router.get("/{item_code}", response_model=InventoryRead)
 def get_inventory_by_item_code(
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    team_id: int = Depends(get_current_team_id),
     item_code: Optional[uuid.UUID] = None
 ):
     # item_codeがNoneの場合は全件取得
     if item_code is None:
-        return get_inventory(request, db, current_user)
+        return _inventory_query(db).filter(Item.team_id == team_id).all()
     """
-    Get a single inventory item by its code, calculating the current stock
-    and the most recent update time.
+    Get a single inventory item by its code, reading the current stock
+    and the most recent update time from the item_stock snapshot.
     """
-    quantity_case = func.sum(
-        case(
-            (Transactions.updated_at >= Item.updated_at, Transactions.quantity),
-            else_=0
-        )
-    )
 
-    last_updated_at = func.max(
-        case(
-            (Transactions.updated_at >= Item.updated_at, Transactions.updated_at),
-            else_=Item.updated_at
-        )
-    ).label("updated_at")
-
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
-    query = (
-        db.query(
-            Item.item_code,
-            Item.item_name,
-            (Item.item_quantity + func.coalesce(quantity_case, 0)).label("item_quantity"),
-            last_updated_at
-        )
-        .outerjoin(Transactions, Item.item_code == Transactions.item_code)
-        .filter(Item.item_code == item_code, Item.team_id == team_id)
-        .group_by(Item.item_code, Item.item_name, Item.item_quantity, Item.updated_at)
-        .order_by(desc(last_updated_at))
-    )
+    query = _inventory_query(db).filter(Item.item_code == item_code, Item.team_id == team_id)
     inventory = query.first()
     return inventory
\ No newline at end of file
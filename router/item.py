@@ -1,14 +1,25 @@
-from models.schemas import Item
+from models.schemas import Item, User
 from models.db import get_db
 from sqlalchemy.orm import Session
-from fastapi import Depends, Request, HTTPException
+from fastapi import Depends, Request, Response, HTTPException, UploadFile, File, Query
 from pydantic import BaseModel
 from typing import List, Optional
 from fastapi import APIRouter
 from router.auth import get_current_user
-from models.schemas import User
+from router.team import get_current_team_id
+from models.stock import reset_item_stock, queue_stock_changes
+from models.checkpoint import record_checkpoint
+from models.importer import item_code_for, read_rows, import_items
+from models.search import get_search_index
+from models.pubsub import inventory_channel, queue_publish
+from models.versions import bump_team_version, team_version
+from models.namesync import ITEM, enqueue_rename, queue_name_sync
+from router.etag import listing_etag, not_modified
+from router.idempotency import IdempotentRequest, idempotency_key, response_from_orm
 import uuid
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 class ItemBase(BaseModel):
     item_name: Optional[str] = None
@@ -23,88 +34,77 @@ class ItemCreate(BaseModel):
     item_quantity: Optional[int] = None
     updated_by: Optional[str] = None
 
+class ItemUpdate(ItemBase):
+    # 読み込んだときの版数。指定した場合、その後に他の人が編集していれば409を返す
+    version: Optional[int] = None
+
 class ItemRead(ItemBase):
     item_code: uuid.UUID
     updated_at: Optional[datetime] = None
+    version: Optional[int] = None
 
     class Config:
         orm_mode = True
 
+class ItemSearchResult(BaseModel):
+    item_code: uuid.UUID
+    item_name: str
+    score: float
+
 router = APIRouter(prefix="/item")
 
 @router.get("/", response_model=List[ItemRead])
 def get_item(
     request: Request,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
+    # 前回から変更がなければDBに問い合わせずに304を返す
+    # 取引の登録でも item_quantity・updated_at が変わるため、在庫の版数もETagに含める
+    cached = not_modified(request, response, listing_etag(team_id, "item", str(team_version(team_id, "inventory"))))
+    if cached:
+        return cached
     items = db.query(Item).filter(Item.team_id == team_id).all()
     return items
 
+@router.get("/search", response_model=List[ItemSearchResult])
+def search_item(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """
+    商品名のあいまい検索（全角・半角、カタカナ・ひらがなの違いを無視）
+    チームごとのメモリ上のインデックスを引くため、商品が変更されていなければDBに問い合わせない
+    """
+    return get_search_index(db, team_id).search(q, limit)
+
 @router.get("/{item_code}", response_model=ItemRead)
 def get_item_by_item_code(
     item_code: uuid.UUID,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
     item = db.query(Item).filter(Item.item_code == item_code, Item.team_id == team_id).first()
     return item
 
 @router.post("/", response_model=ItemRead)
 def create_item(
     item: ItemCreate,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id),
+    key: Optional[str] = Depends(idempotency_key)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
+    # 再送されたリクエストには最初のレスポンスを返す（同じ商品名の400にしない）
+    idempotent = IdempotentRequest(db, team_id, "POST /item/", key, item.dict())
+    replayed = idempotent.replay()
+    if replayed:
+        return replayed
+
     # uuid5で同じ商品名から同じitem_codeを生成
-    item_code = uuid.uuid5(uuid.NAMESPACE_URL, f"item-{item.item_name}-{team_id}")
+    item_code = item_code_for(item.item_name, team_id)
     
     # 同じitem_codeが既に存在するかチェック
     existing_item = db.query(Item).filter(
@@ -125,70 +125,94 @@ def create_item(
         updated_at=datetime.now()
     )
     db.add(new_item)
-    db.commit()
-    db.refresh(new_item)
-    return new_item
+    reset_item_stock(db, new_item)
+    record_checkpoint(db, new_item, "created")
+    db.flush()
+    # コミットすると属性が読み直しになるため、レスポンスはコミット前に作っておく
+    body = response_from_orm(ItemRead, new_item)
+    replayed = idempotent.commit(body)
+    if replayed:
+        return replayed
+    bump_team_version(team_id, "item", "inventory")
+    queue_stock_changes(db, team_id, {item_code: None})
+    return body
+
+@router.post("/import")
+def import_item(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    CSV / XLSX（列: item_name, item_price, item_quantity）から商品をまとめて登録する
+    登録済みの商品名の行は exists、不正な行は error として行ごとの結果を返す
+    """
+    try:
+        rows = read_rows(file.file.read(), file.filename or "")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    summary = import_items(db, team_id, rows, current_user.name or current_user.email)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="同じ商品が同時に登録されました。再送してください")
+    created = [uuid.UUID(r["item_code"]) for r in summary["results"] if r["status"] == "created"]
+    if created:
+        bump_team_version(team_id, "item", "inventory")
+        queue_stock_changes(db, team_id, dict.fromkeys(created))
+    return summary
 
 @router.put("/{item_code}", response_model=ItemRead)
 def update_item(
     item_code: uuid.UUID,
-    item: ItemBase,
-    request: Request,
+    item: ItemUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
     db_item = db.query(Item).filter(
         Item.item_code == item_code,
         Item.team_id == team_id
     ).first()
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
-    
+
     update_data = item.dict(exclude_unset=True)
+    version = update_data.pop("version", None)
+    if version is not None and version != db_item.version:
+        raise HTTPException(status_code=409, detail="他のユーザーが商品を更新しました。再読み込みしてください")
+    renamed = "item_name" in update_data and update_data["item_name"] != db_item.item_name
     for key, value in update_data.items():
         setattr(db_item, key, value)
     setattr(db_item, "updated_at", datetime.now())
-    db.commit()
-    db.refresh(db_item)
-    return db_item
+    if renamed:
+        # 取引・価格表の商品名の写しはコミット後にジョブで書き換える
+        enqueue_rename(db, team_id, ITEM, item_code)
+    if "item_quantity" in update_data:
+        # 棚卸しなどで在庫数を直接設定した場合はスナップショットも合わせる
+        reset_item_stock(db, db_item)
+        record_checkpoint(db, db_item, "reset")
+    try:
+        # UPDATE ... WHERE version = 読み込んだ版数 で、読み込んでからの他の編集を検出する
+        db.flush()
+        body = response_from_orm(ItemRead, db_item)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="他のユーザーが商品を更新しました。再読み込みしてください")
+    bump_team_version(team_id, "item", "inventory")
+    queue_stock_changes(db, team_id, {item_code: None})
+    if renamed:
+        queue_name_sync(ITEM, item_code)
+    return body
 
 @router.delete("/{item_code}")
 def delete_item(
     item_code: uuid.UUID,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
     db_item = db.query(Item).filter(
         Item.item_code == item_code,
         Item.team_id == team_id
@@ -198,4 +222,6 @@ def delete_item(
     
     db.delete(db_item)
     db.commit()
+    bump_team_version(team_id, "item", "inventory")
+    queue_publish(inventory_channel(team_id), {"type": "deleted", "item_code": str(item_code)})
     return {"status": "success", "message": "Item deleted successfully"}
\ No newline at end of file
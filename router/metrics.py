@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from models.instrumentation import render_metrics
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus のテキスト形式でメトリクスを返す"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
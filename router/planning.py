@@ -0,0 +1,56 @@
+from models.db import get_db
+from models.config import PLANNING_WINDOW_DAYS, PLANNING_LEAD_TIME_DAYS, PLANNING_SERVICE_LEVEL
+from models.planning import get_reorder_plan
+from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel
+from typing import List, Optional
+from router.team import get_current_team_id
+import uuid
+
+
+class SupplierLot(BaseModel):
+    supplier_code: uuid.UUID
+    supplier_name: Optional[str] = None
+    lot_price: float
+    lot_size: int
+    unit_price: float
+    economic_order_quantity: float
+    lots: int
+    order_quantity: int
+    order_cost: float
+
+class ReorderPlan(BaseModel):
+    item_code: uuid.UUID
+    item_name: str
+    current_stock: int
+    daily_demand: float
+    demand_std: float
+    previous_daily_demand: Optional[float] = None
+    safety_stock: int
+    reorder_point: int
+    days_of_cover: Optional[float] = None
+    needs_reorder: bool
+    # 1個あたりの仕入価格が安い順（先頭が推奨の仕入先）
+    suppliers: List[SupplierLot] = []
+
+
+router = APIRouter(prefix="/planning")
+
+@router.get("/reorder", response_model=List[ReorderPlan])
+def get_reorder(
+    window_days: int = Query(PLANNING_WINDOW_DAYS, ge=7, le=365),
+    lead_time_days: float = Query(PLANNING_LEAD_TIME_DAYS, gt=0, le=365),
+    service_level: float = Query(PLANNING_SERVICE_LEVEL, ge=0.5, lt=1),
+    only_reorder: bool = False,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """
+    チームの全商品の発注点と、仕入先ごとの発注ロットを返す（発注点を割り込んだ商品が先頭）
+    only_reorder=true の場合は発注が必要な商品だけを返す
+    """
+    plans = get_reorder_plan(db, team_id, window_days, lead_time_days, service_level)
+    if only_reorder:
+        plans = [plan for plan in plans if plan["needs_reorder"]]
+    return plans
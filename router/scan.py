@@ -0,0 +1,48 @@
+from models.db import get_db
+from models.schemas import ActionType
+from models.scan import load_scan_entry
+from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+from router.team import get_current_team_id
+import uuid
+
+
+class PreferredSupplier(BaseModel):
+    supplier_code: uuid.UUID
+    supplier_type: ActionType
+    supplier_name: Optional[str] = None
+    lot_price: Optional[float] = None
+    lot_size: Optional[int] = None
+
+class ScanRead(BaseModel):
+    item_code: uuid.UUID
+    item_name: str
+    item_price: Optional[float] = None
+    current_stock: int
+    updated_at: Optional[datetime] = None
+    preferred_supplier: Optional[PreferredSupplier] = None
+
+
+router = APIRouter(prefix="/scan")
+
+@router.get("/{code}", response_model=ScanRead)
+def scan(
+    code: str,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """
+    QRコード（item_code）から商品・現在の在庫・優先仕入先をまとめて返す
+    メモリ上のキャッシュから返し、在庫の変動はキャッシュに書き込み済みのためDBに問い合わせない
+    """
+    try:
+        item_code = uuid.UUID(code.strip())
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Item not found")
+    entry = load_scan_entry(db, team_id, item_code)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return entry
@@ -1,14 +1,24 @@
-from models.schemas import ActionType, Supplier, SupplierItem
+from models.schemas import ActionType, Item, Supplier, SupplierItem, User
 from models.db import get_db
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional
 from sqlalchemy.orm import Session
-from fastapi import Depends, Request, HTTPException
+from fastapi import Depends, Request, Response, HTTPException, UploadFile, File
 from typing import List
 from fastapi import APIRouter
 from router.auth import get_current_user
-from models.schemas import User
+from router.team import get_current_team_id
+from router.etag import listing_etag, not_modified
+from router.idempotency import IdempotentRequest, idempotency_key
+from models.versions import bump_team_version
+from models.importer import supplier_code_for, read_rows, import_supplier_items, upsert_supplier_items
+from models.config import IMPORT_MAX_ROWS
+from models.scan import invalidate_scan
+from models.planning import invalidate_planning
+from models.namesync import SUPPLIER, enqueue_rename, queue_name_sync
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 import uuid
 
 class SupplierBase(BaseModel):
@@ -46,6 +56,31 @@ class SupplierItemCreate(SupplierItemBase):
     updated_by: str
     updated_at: datetime
 
+class SupplierItemUpsert(SupplierItemBase):
+    item_code: uuid.UUID
+    supplier_code: uuid.UUID
+    supplier_type: ActionType = ActionType.IN
+
+class BestSupplierQuery(BaseModel):
+    item_codes: List[uuid.UUID]
+    # 商品ごとに返す仕入先の数（1 = 最安のみ）
+    top: int = 1
+    supplier_type: ActionType = ActionType.IN
+
+class SupplierCost(BaseModel):
+    supplier_code: uuid.UUID
+    supplier_type: ActionType
+    supplier_name: Optional[str] = None
+    lot_price: float
+    lot_size: int
+    unit_cost: float
+    rank: int
+
+class ItemBestSuppliers(BaseModel):
+    item_code: uuid.UUID
+    # 1個あたりの仕入価格が安い順
+    suppliers: List[SupplierCost]
+
 class SupplierItemRead(SupplierItemBase):
     item_code: uuid.UUID
     supplier_code: uuid.UUID
@@ -61,82 +96,60 @@ supplier_item_router = APIRouter(prefix="/supplier_item")
 @supplier_router.get("/", response_model=List[SupplierRead])
 def get_supplier(
     request: Request,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
+    # 前回から変更がなければDBに問い合わせずに304を返す
+    cached = not_modified(request, response, listing_etag(team_id, "supplier"))
+    if cached:
+        return cached
     suppliers = db.query(Supplier).filter(Supplier.team_id == team_id).all()
     return suppliers
 
 @supplier_router.get("/{supplier_code}", response_model=SupplierRead)
-def get_supplier_by_supplier_code(supplier_code: uuid.UUID, db: Session = Depends(get_db)):
-    supplier = db.query(Supplier).filter(Supplier.supplier_code == supplier_code).first()
+def get_supplier_by_supplier_code(
+    supplier_code: uuid.UUID,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    supplier = db.query(Supplier).filter(Supplier.team_id == team_id, Supplier.supplier_code == supplier_code).first()
+    if not supplier:
+        raise HTTPException(status_code=404, detail="Supplier not found")
     return supplier
 
 @supplier_router.post("/")
 def create_supplier(
     supplier: SupplierCreate,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id),
+    key: Optional[str] = Depends(idempotency_key)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        raise HTTPException(status_code=400, detail="チームIDが必要です")
-    
-    try:
-        team_id = int(team_id)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
+    idempotent = IdempotentRequest(db, team_id, "POST /supplier/", key, supplier.dict())
+    replayed = idempotent.replay()
+    if replayed:
+        return replayed
     new_supplier = Supplier(
         **supplier.dict(),
         team_id=team_id,
-        supplier_code=uuid.uuid5(uuid.NAMESPACE_URL, "supplier-"+supplier.supplier_name),
+        supplier_code=supplier_code_for(supplier.supplier_name),
         updated_at=datetime.now()
     )
     db.add(new_supplier)
-    db.commit()
+    db.flush()
+    replayed = idempotent.commit(new_supplier)
+    if replayed:
+        return replayed
+    bump_team_version(team_id, "supplier")
     db.refresh(new_supplier)
     return new_supplier
 
 @supplier_router.put("/", response_model=SupplierRead)
 def update_supplier(
     supplier: SupplierUpdate,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
     db_supplier = db.query(Supplier).filter(
         Supplier.supplier_code == supplier.supplier_code,
         Supplier.team_id == team_id
@@ -146,36 +159,29 @@ def update_supplier(
         raise HTTPException(status_code=404, detail="Supplier not found")
     
     update_data = supplier.dict(exclude_unset=True)
+    renamed = "supplier_name" in update_data and update_data["supplier_name"] != db_supplier.supplier_name
     for key, value in update_data.items():
         setattr(db_supplier, key, value)
     
     setattr(db_supplier, "updated_at", datetime.now())
+    if renamed:
+        # 取引・価格表の仕入先名の写しはコミット後にジョブで書き換える
+        enqueue_rename(db, team_id, SUPPLIER, db_supplier.supplier_code, db_supplier.supplier_type)
     db.commit()
+    bump_team_version(team_id, "supplier")
+    invalidate_scan(team_id)
+    invalidate_planning(team_id)
+    if renamed:
+        queue_name_sync(SUPPLIER, db_supplier.supplier_code, db_supplier.supplier_type)
     db.refresh(db_supplier)
     return db_supplier
 
 @supplier_router.delete("/{supplier_code}")
 def delete_supplier(
     supplier_code: uuid.UUID,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
     db_supplier = db.query(Supplier).filter(
         Supplier.supplier_code == supplier_code,
         Supplier.team_id == team_id
@@ -186,39 +192,206 @@ def delete_supplier(
     
     db.delete(db_supplier)
     db.commit()
+    bump_team_version(team_id, "supplier")
+    invalidate_scan(team_id)
+    invalidate_planning(team_id)
     return {"status": "success", "message": "Supplier deleted successfully"}
 
 
 @supplier_item_router.get("/", response_model=List[SupplierItemRead])
-def get_supplier_item(db: Session = Depends(get_db)):
-    supplier_items = db.query(SupplierItem).all()
+def get_supplier_item(db: Session = Depends(get_db), team_id: int = Depends(get_current_team_id)):
+    supplier_items = db.query(SupplierItem).filter(SupplierItem.team_id == team_id).all()
     return supplier_items
 
 @supplier_item_router.get("/supplier/{supplier_code}", response_model=List[SupplierItemRead])
-def get_supplier_item_by_supplier_code(supplier_code: uuid.UUID, db: Session = Depends(get_db)):
-    supplier_item = db.query(SupplierItem).filter(SupplierItem.supplier_code == supplier_code).all()
+def get_supplier_item_by_supplier_code(
+    supplier_code: uuid.UUID,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    supplier_item = db.query(SupplierItem).filter(
+        SupplierItem.team_id == team_id,
+        SupplierItem.supplier_code == supplier_code
+    ).all()
     return supplier_item
 
 @supplier_item_router.get("/item/{item_code}", response_model=List[SupplierItemRead])
-def get_supplier_item_by_item_code(item_code: uuid.UUID, db: Session = Depends(get_db)):
-    supplier_item = db.query(SupplierItem).filter(SupplierItem.item_code == item_code).all()
+def get_supplier_item_by_item_code(
+    item_code: uuid.UUID,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    supplier_item = db.query(SupplierItem).filter(
+        SupplierItem.team_id == team_id,
+        SupplierItem.item_code == item_code
+    ).all()
     return supplier_item
 
 @supplier_item_router.post("/")
-def create_supplier_item(supplier_item: SupplierItemCreate, db: Session = Depends(get_db)):
-    db.add(supplier_item)
-    db.commit()
-    db.refresh(supplier_item)
+def create_supplier_item(
+    supplier_item: SupplierItemCreate,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    # 他のチームの商品・仕入先は存在しないものとして扱う
+    item = db.query(Item).filter(Item.team_id == team_id, Item.item_code == supplier_item.item_code).first()
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    supplier = db.query(Supplier).filter(
+        Supplier.team_id == team_id,
+        Supplier.supplier_code == supplier_item.supplier_code,
+        Supplier.supplier_type == supplier_item.supplier_type
+    ).first()
+    if not supplier:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    db.add(SupplierItem(
+        **supplier_item.dict(),
+        team_id=team_id,
+        item_name=item.item_name,
+        supplier_name=supplier.supplier_name,
+    ))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="この仕入先と商品の組み合わせは登録済みです")
+    invalidate_scan(team_id, supplier_item.item_code)
+    invalidate_planning(team_id)
     return {"status": "success", "message": "Supplier item created successfully"}
 
+@supplier_item_router.post("/import")
+def import_supplier_item(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    CSV / XLSX の価格表（列: supplier_name, supplier_type, item_name, lot_price, lot_size）を取り込む
+    既にある仕入先と商品の組み合わせは価格を更新し、行ごとの結果を返す
+    """
+    try:
+        rows = read_rows(file.file.read(), file.filename or "")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    summary = import_supplier_items(db, team_id, rows, current_user.name or current_user.email)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="取り込み中に同じ組み合わせが登録されました。再送してください")
+    invalidate_scan(team_id)
+    invalidate_planning(team_id)
+    return summary
+
+@supplier_item_router.post("/best", response_model=List[ItemBestSuppliers])
+def get_best_suppliers(
+    query: BestSupplierQuery,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """
+    指定した商品それぞれについて、1個あたりの仕入価格（unit_cost）が安い仕入先を上位 top 件返す
+    発注書の作成用に、数百件の商品でも1回のクエリで求める（価格が未登録の仕入先は含めない）
+    """
+    if not 1 <= query.top <= 10:
+        raise HTTPException(status_code=400, detail="top は1〜10で指定してください")
+    if len(query.item_codes) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"一度に指定できる商品は{IMPORT_MAX_ROWS}件までです")
+    item_codes = list(dict.fromkeys(query.item_codes))
+    if not item_codes:
+        return []
+
+    ranked = (
+        select(
+            SupplierItem.item_code,
+            SupplierItem.supplier_code,
+            SupplierItem.supplier_type,
+            SupplierItem.supplier_name,
+            SupplierItem.lot_price,
+            SupplierItem.lot_size,
+            SupplierItem.unit_cost,
+            func.row_number().over(
+                partition_by=SupplierItem.item_code,
+                order_by=(SupplierItem.unit_cost.asc(), SupplierItem.updated_at.desc()),
+            ).label("rank"),
+        )
+        .where(
+            SupplierItem.team_id == team_id,
+            SupplierItem.item_code.in_(item_codes),
+            SupplierItem.supplier_type == query.supplier_type,
+            SupplierItem.unit_cost.isnot(None),
+        )
+        .subquery()
+    )
+    rows = db.execute(select(ranked).where(ranked.c.rank <= query.top).order_by(ranked.c.rank)).all()
+
+    suppliers = {code: [] for code in item_codes}
+    for row in rows:
+        suppliers[row.item_code].append(row._mapping)
+    return [{"item_code": code, "suppliers": costs} for code, costs in suppliers.items()]
+
+@supplier_item_router.put("/batch")
+def upsert_supplier_item_batch(
+    supplier_items: List[SupplierItemUpsert],
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    仕入先の価格表をまとめて登録・更新する（INSERT ... ON CONFLICT DO UPDATE）
+    既存の行と価格・入数が同じものは書き込まず、inserted / updated / unchanged / error の件数と行ごとの結果を返す
+    """
+    if len(supplier_items) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"一度に登録できるのは{IMPORT_MAX_ROWS}件までです")
+    summary = upsert_supplier_items(
+        db, team_id, [supplier_item.dict() for supplier_item in supplier_items], current_user.name or current_user.email
+    )
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="登録中に同じ組み合わせが登録されました。再送してください")
+    if summary.get("inserted") or summary.get("updated"):
+        invalidate_scan(team_id)
+        invalidate_planning(team_id)
+    return summary
+
 @supplier_item_router.put("/")
-def update_supplier_item(supplier_item: SupplierItemRead, db: Session = Depends(get_db)):
-    db.query(SupplierItem).filter(SupplierItem.item_code == supplier_item.item_code, SupplierItem.supplier_code == supplier_item.supplier_code).update(supplier_item.dict())
+def update_supplier_item(
+    supplier_item: SupplierItemRead,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    updated = db.query(SupplierItem).filter(
+        SupplierItem.team_id == team_id,
+        SupplierItem.item_code == supplier_item.item_code,
+        SupplierItem.supplier_code == supplier_item.supplier_code
+    ).update(supplier_item.dict())
+    if not updated:
+        raise HTTPException(status_code=404, detail="Supplier item not found")
     db.commit()
+    invalidate_scan(team_id, supplier_item.item_code)
+    invalidate_planning(team_id)
     return {"status": "success", "message": "Supplier item updated successfully"}
 
 @supplier_item_router.delete("/item/{item_code}/supplier/{supplier_code}/{supplier_type}")
-def delete_supplier_item(item_code: uuid.UUID, supplier_code: uuid.UUID, supplier_type: ActionType, db: Session = Depends(get_db)):
-    db.query(SupplierItem).filter(SupplierItem.item_code == item_code, SupplierItem.supplier_code == supplier_code, SupplierItem.supplier_type == supplier_type).delete()
+def delete_supplier_item(
+    item_code: uuid.UUID,
+    supplier_code: uuid.UUID,
+    supplier_type: ActionType,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    deleted = db.query(SupplierItem).filter(
+        SupplierItem.team_id == team_id,
+        SupplierItem.item_code == item_code,
+        SupplierItem.supplier_code == supplier_code,
+        SupplierItem.supplier_type == supplier_type
+    ).delete()
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Supplier item not found")
     db.commit()
+    invalidate_scan(team_id, item_code)
+    invalidate_planning(team_id)
     return {"status": "success", "message": "Supplier item deleted successfully"}
\ No newline at end of file
@@ -1,11 +1,16 @@
 # team.py
 from fastapi import APIRouter, Request, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from models.db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.db import get_db, get_async_db
 from models.schemas import User, Team, TeamMember, RoleEnum
-from router.auth import get_current_user, create_access_token
+from router.auth import get_current_user, create_access_token, invalidate_user
+from models.cache import TTLCache
+from models.config import TEAM_MEMBERSHIP_CACHE_TTL, TEAM_MEMBERSHIP_CACHE_SIZE
 from datetime import datetime, timedelta
+from typing import Optional
 import uuid
 import os
 from dotenv import load_dotenv
@@ -15,10 +20,87 @@ load_dotenv()
 router = APIRouter()
 security = HTTPBearer()
 
+# (user_id, team_id) -> RoleEnum / (user_id, None) -> 既定のteam_id
+membership_cache = TTLCache(maxsize=TEAM_MEMBERSHIP_CACHE_SIZE, ttl=TEAM_MEMBERSHIP_CACHE_TTL)
+
+
+def invalidate_membership(user_id: int, team_id: Optional[int] = None):
+    """招待・削除・参加などで所属が変わったユーザーのキャッシュを破棄する"""
+    membership_cache.pop((user_id, None))
+    if team_id is None:
+        membership_cache.pop_where(lambda key, value: key[0] == user_id)
+    else:
+        membership_cache.pop((user_id, team_id))
+
+
+def get_membership_role(db: Session, user_id: int, team_id: int) -> Optional[RoleEnum]:
+    """ユーザーのチーム内での役割を返す（所属していなければNone）"""
+    role = membership_cache.get((user_id, team_id))
+    if role is not None:
+        return role
+    membership = db.query(TeamMember).filter(
+        TeamMember.user_id == user_id,
+        TeamMember.team_id == team_id
+    ).first()
+    if not membership:
+        return None
+    membership_cache.set((user_id, team_id), membership.role)
+    return membership.role
+
+
+async def get_membership_role_async(db: AsyncSession, user_id: int, team_id: int) -> Optional[RoleEnum]:
+    """get_membership_role の非同期セッション版"""
+    role = membership_cache.get((user_id, team_id))
+    if role is not None:
+        return role
+    result = await db.execute(
+        select(TeamMember.role).where(
+            TeamMember.user_id == user_id,
+            TeamMember.team_id == team_id
+        )
+    )
+    role = result.scalar()
+    if role is not None:
+        membership_cache.set((user_id, team_id), role)
+    return role
+
+
+def get_current_team_id(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> int:
+    """
+    X-Team-IDヘッダーから操作対象のチームを決め、ユーザーが所属しているか確認する
+    ヘッダーがない場合はユーザーの最初のチームを使用する
+    """
+    return resolve_team_id(db, current_user, request.headers.get('X-Team-ID'))
+
+def resolve_team_id(db: Session, current_user: User, team_id: Optional[str]) -> int:
+    """get_current_team_id の本体（ヘッダー以外からチームIDを受け取る場合に使う）"""
+    if not team_id:
+        team_id = membership_cache.get((current_user.id, None))
+        if team_id is not None:
+            return team_id
+        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
+        if not user_team:
+            raise HTTPException(status_code=400, detail="チームに所属していません")
+        membership_cache.set((current_user.id, None), user_team.team_id)
+        membership_cache.set((current_user.id, user_team.team_id), user_team.role)
+        return user_team.team_id
+
+    try:
+        team_id = int(team_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無効なチームIDです")
+    if get_membership_role(db, current_user.id, team_id) is None:
+        raise HTTPException(status_code=403, detail="このチームにアクセスする権限がありません")
+    return team_id
+
 @router.post("/api/teams/create")
 async def create_team(
     request: Request, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """新しいチームを作成"""
@@ -35,8 +117,8 @@ async def create_team(
         description=description
     )
     db.add(team)
-    db.commit()
-    db.refresh(team)
+    await db.commit()
+    await db.refresh(team)
     
     # 作成者をチームのオーナーとして追加
     team_member = TeamMember(
@@ -45,7 +127,8 @@ async def create_team(
         role=RoleEnum.owner
     )
     db.add(team_member)
-    db.commit()
+    await db.commit()
+    invalidate_user(current_user.id)
     
     return {
         "team": {
@@ -59,13 +142,14 @@ async def create_team(
 
 @router.get("/api/teams/my")
 async def get_my_teams(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """ユーザーが所属するチーム一覧を取得"""
-    teams = db.query(Team).join(TeamMember).filter(
-        TeamMember.user_id == current_user.id
-    ).all()
+    result = await db.execute(
+        select(Team).join(TeamMember).where(TeamMember.user_id == current_user.id)
+    )
+    teams = result.scalars().all()
     
     return {
         "teams": [
@@ -82,23 +166,19 @@ async def get_my_teams(
 @router.get("/api/teams/{team_id}/members")
 async def get_team_members(
     team_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """チームメンバー一覧を取得"""
     # ユーザーがチームに所属しているかチェック
-    membership = db.query(TeamMember).filter(
-        TeamMember.user_id == current_user.id,
-        TeamMember.team_id == team_id
-    ).first()
-    
-    if not membership:
+    if await get_membership_role_async(db, current_user.id, team_id) is None:
         raise HTTPException(status_code=403, detail="このチームにアクセスする権限がありません")
     
     # チームメンバーを取得
-    members = db.query(TeamMember, User).join(User).filter(
-        TeamMember.team_id == team_id
-    ).all()
+    result = await db.execute(
+        select(TeamMember, User).join(User).where(TeamMember.team_id == team_id)
+    )
+    members = result.all()
     
     return {
         "members": [
@@ -117,7 +197,7 @@ async def get_team_members(
 async def invite_member(
     team_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """チームメンバーを招待"""
@@ -129,24 +209,24 @@ async def invite_member(
         raise HTTPException(status_code=400, detail="メールアドレスは必須です")
     
     # ユーザーがチームのオーナーまたは管理者かチェック
-    membership = db.query(TeamMember).filter(
-        TeamMember.user_id == current_user.id,
-        TeamMember.team_id == team_id
-    ).first()
-    
-    if not membership or membership.role not in [RoleEnum.owner, RoleEnum.admin]:
+    current_role = await get_membership_role_async(db, current_user.id, team_id)
+    if current_role not in [RoleEnum.owner, RoleEnum.admin]:
         raise HTTPException(status_code=403, detail="メンバーを招待する権限がありません")
     
     # 招待するユーザーが存在するかチェック
-    invited_user = db.query(User).filter(User.email == email).first()
+    result = await db.execute(select(User).where(User.email == email))
+    invited_user = result.scalars().first()
     if not invited_user:
         raise HTTPException(status_code=404, detail="指定されたメールアドレスのユーザーが見つかりません")
     
     # 既にチームメンバーかチェック
-    existing_member = db.query(TeamMember).filter(
-        TeamMember.user_id == invited_user.id,
-        TeamMember.team_id == team_id
-    ).first()
+    result = await db.execute(
+        select(TeamMember).where(
+            TeamMember.user_id == invited_user.id,
+            TeamMember.team_id == team_id
+        )
+    )
+    existing_member = result.scalars().first()
     
     if existing_member:
         raise HTTPException(status_code=400, detail="このユーザーは既にチームメンバーです")
@@ -163,7 +243,8 @@ async def invite_member(
         role=role_enum
     )
     db.add(team_member)
-    db.commit()
+    await db.commit()
+    invalidate_user(invited_user.id)
     
     return {
         "message": f"{invited_user.name}をチームに招待しました",
@@ -179,24 +260,23 @@ async def invite_member(
 async def remove_member(
     team_id: int,
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """チームメンバーを削除"""
     # ユーザーがチームのオーナーまたは管理者かチェック
-    membership = db.query(TeamMember).filter(
-        TeamMember.user_id == current_user.id,
-        TeamMember.team_id == team_id
-    ).first()
-    
-    if not membership or membership.role not in [RoleEnum.owner, RoleEnum.admin]:
+    current_role = await get_membership_role_async(db, current_user.id, team_id)
+    if current_role not in [RoleEnum.owner, RoleEnum.admin]:
         raise HTTPException(status_code=403, detail="メンバーを削除する権限がありません")
     
     # 削除対象のメンバーシップを取得
-    target_membership = db.query(TeamMember).filter(
-        TeamMember.user_id == user_id,
-        TeamMember.team_id == team_id
-    ).first()
+    result = await db.execute(
+        select(TeamMember).where(
+            TeamMember.user_id == user_id,
+            TeamMember.team_id == team_id
+        )
+    )
+    target_membership = result.scalars().first()
     
     if not target_membership:
         raise HTTPException(status_code=404, detail="指定されたメンバーが見つかりません")
@@ -206,8 +286,9 @@ async def remove_member(
         raise HTTPException(status_code=400, detail="オーナーは削除できません")
     
     # メンバーシップを削除
-    db.delete(target_membership)
-    db.commit()
+    await db.delete(target_membership)
+    await db.commit()
+    invalidate_user(user_id)
     
     return {"message": "メンバーを削除しました"}
 
@@ -215,7 +296,7 @@ async def remove_member(
 async def join_team(
     team_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """チームに参加（招待コードまたは直接参加）"""
@@ -223,15 +304,18 @@ async def join_team(
     invite_code = body.get("invite_code")
     
     # チームが存在するかチェック
-    team = db.query(Team).filter(Team.id == team_id).first()
+    team = await db.get(Team, team_id)
     if not team:
         raise HTTPException(status_code=404, detail="チームが見つかりません")
     
     # 既にメンバーかチェック
-    existing_member = db.query(TeamMember).filter(
-        TeamMember.user_id == current_user.id,
-        TeamMember.team_id == team_id
-    ).first()
+    result = await db.execute(
+        select(TeamMember).where(
+            TeamMember.user_id == current_user.id,
+            TeamMember.team_id == team_id
+        )
+    )
+    existing_member = result.scalars().first()
     
     if existing_member:
         raise HTTPException(status_code=400, detail="既にチームメンバーです")
@@ -250,7 +334,8 @@ async def join_team(
         role=RoleEnum.member
     )
     db.add(team_member)
-    db.commit()
+    await db.commit()
+    invalidate_user(current_user.id)
     
     return {
         "message": f"{team.name}に参加しました",
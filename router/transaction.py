@@ -1,16 +1,31 @@
-from models.schemas import Transactions, Item
+from models.schemas import ActionType, Transactions, Item
 from models.db import get_db
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional
 from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException, Request
-from typing import List
+from fastapi import Depends, HTTPException, Request, Response, Query
+from typing import List, Literal
 from fastapi import APIRouter
 from fastapi.responses import RedirectResponse
 from starlette import status
-from router.auth import get_current_user
-from models.schemas import User
+from router.team import get_current_team_id
+from router.export import export_response
+from router.idempotency import idempotency_key, response_from_orm
+from models.stock import (
+    apply_stock_delta, apply_stock_deltas, apply_item_quantity_delta, apply_item_quantity_deltas, queue_stock_changes
+)
+from models.history import apply_rollup_movements
+from models.checkpoint import adjust_checkpoints
+from models.versions import bump_team_version
+from models.config import DEBUG, TRANSACTION_PAGE_SIZE, TRANSACTION_PAGE_SIZE_MAX, TRANSACTION_BULK_MAX
+from pydantic import ValidationError
+from sqlalchemy import tuple_, select, insert
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+import base64
+import json
 import uuid
 
 class TransactionBase(BaseModel):
@@ -25,6 +40,9 @@ class TransactionBase(BaseModel):
 class TransactionCreate(TransactionBase):
     action: str
 
+class TransactionBulkCreate(TransactionCreate):
+    idempotency_key: Optional[str] = None
+
 class TransactionUpdate(TransactionBase):
     id: int
 
@@ -41,113 +59,367 @@ class TransactionRead(TransactionBase):
 
 router = APIRouter(prefix="/transaction")
 
+def _quantity_changes(old_item_code, old_quantity, new_item_code, new_quantity):
+    """取引の更新前後の数量から、商品ごとの在庫の増減を求める"""
+    if old_item_code == new_item_code:
+        delta = (new_quantity or 0) - (old_quantity or 0)
+        return [(new_item_code, delta)] if delta and new_item_code else []
+    changes = []
+    if old_item_code and old_quantity:
+        changes.append((old_item_code, -old_quantity))
+    if new_item_code and new_quantity:
+        changes.append((new_item_code, new_quantity))
+    return changes
+
+def _encode_cursor(transaction: Transactions) -> str:
+    raw = f"{transaction.updated_at.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        updated_at, id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), int(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無効なカーソルです")
+
+def _paginate(query, response: Response, cursor: Optional[str], limit: Optional[int], date: Optional[datetime], until: Optional[datetime]):
+    """
+    (updated_at, id) の降順によるキーセットページング
+    次ページがある場合は X-Next-Cursor ヘッダーにカーソルを返す
+    """
+    limit = min(limit or TRANSACTION_PAGE_SIZE, TRANSACTION_PAGE_SIZE_MAX)
+    if date:
+        query = query.filter(Transactions.updated_at >= date)
+    if until:
+        query = query.filter(Transactions.updated_at < until)
+    if cursor:
+        query = query.filter(tuple_(Transactions.updated_at, Transactions.id) < tuple_(*_decode_cursor(cursor)))
+    rows = query.order_by(Transactions.updated_at.desc(), Transactions.id.desc()).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
+    return rows
+
 @router.get("/", response_model=List[TransactionRead])
-def get_transaction(db: Session = Depends(get_db)):
-    transactions = db.query(Transactions).order_by(Transactions.updated_at.desc()).all()
-    return transactions
+def get_transaction(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    date: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    query = db.query(Transactions).filter(Transactions.team_id == team_id)
+    return _paginate(query, response, cursor, limit, date, until)
 
-@router.get("/id/{id}", response_model=TransactionRead)
-def get_transaction_by_id(id: int, db: Session = Depends(get_db)):
-    transaction = db.query(Transactions).filter(Transactions.id == id).first()
-    return transaction
+EXPORT_COLUMNS = [
+    ("id", "int"),
+    ("updated_at", "datetime"),
+    ("item_code", "str"),
+    ("item_name", "str"),
+    ("supplier_code", "str"),
+    ("supplier_type", "str"),
+    ("supplier_name", "str"),
+    ("action", "str"),
+    ("quantity", "int"),
+    ("price", "float"),
+    ("updated_by", "str"),
+]
 
-@router.get("/item/{item_code}", response_model=List[TransactionRead])
-def get_transaction_by_item_code(item_code: uuid.UUID, date: Optional[datetime] = None, db: Session = Depends(get_db)):
+@router.get("/export")
+def export_transactions(
+    format: Literal["csv", "ndjson", "parquet"] = "csv",
+    date: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    team_id: int = Depends(get_current_team_id)
+):
+    """
+    チームの取引履歴をCSV / NDJSON / Parquetでダウンロードする
+    一定件数ずつ読み出して書き出すため、件数が多くてもメモリに全件を載せない
+    """
+    query = (
+        select(*[getattr(Transactions, name) for name, _ in EXPORT_COLUMNS])
+        .where(Transactions.team_id == team_id)
+        .order_by(Transactions.updated_at, Transactions.id)
+    )
     if date:
-        transaction = db.query(Transactions).filter(Transactions.item_code == item_code, Transactions.updated_at >= date).order_by(Transactions.updated_at.desc()).all()
-    else:
-        transaction = db.query(Transactions).filter(Transactions.item_code == item_code).order_by(Transactions.updated_at.desc()).all()
+        query = query.where(Transactions.updated_at >= date)
+    if until:
+        query = query.where(Transactions.updated_at < until)
+    return export_response(query, EXPORT_COLUMNS, format, f"transactions-{team_id}")
+
+@router.get("/id/{id}", response_model=TransactionRead)
+def get_transaction_by_id(id: int, db: Session = Depends(get_db), team_id: int = Depends(get_current_team_id)):
+    transaction = db.query(Transactions).filter(Transactions.id == id, Transactions.team_id == team_id).first()
     if not transaction:
-        return {"status": "error", "message": "Transaction not found"}
+        raise HTTPException(status_code=404, detail="Transaction not found")
     return transaction
 
+@router.get("/item/{item_code}", response_model=List[TransactionRead])
+def get_transaction_by_item_code(
+    item_code: uuid.UUID,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    date: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    query = db.query(Transactions).filter(Transactions.team_id == team_id, Transactions.item_code == item_code)
+    return _paginate(query, response, cursor, limit, date, until)
+
 @router.get("/supplier/{supplier_code}", response_model=List[TransactionRead])
-def get_transaction_by_supplier_code(supplier_code: uuid.UUID, date: Optional[datetime] = None, db: Session = Depends(get_db)):
-    if date:
-        transaction = db.query(Transactions).filter(Transactions.supplier_code == supplier_code, Transactions.updated_at >= date).order_by(Transactions.updated_at.desc()).all()
-    else:
-        transaction = db.query(Transactions).filter(Transactions.supplier_code == supplier_code).order_by(Transactions.updated_at.desc()).all()
-    if not transaction:
-        return {"status": "error", "message": "Transaction not found"}
-    return transaction
+def get_transaction_by_supplier_code(
+    supplier_code: uuid.UUID,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    date: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    query = db.query(Transactions).filter(Transactions.team_id == team_id, Transactions.supplier_code == supplier_code)
+    return _paginate(query, response, cursor, limit, date, until)
 
 @router.get("/supplier/{supplier_code}/item/{item_code}", response_model=List[TransactionRead])
-def get_transaction_by_supplier_code_and_item_code(supplier_code: uuid.UUID, item_code: uuid.UUID, date: Optional[datetime] = None, db: Session = Depends(get_db)):
-    if date:
-        transaction = db.query(Transactions).filter(Transactions.supplier_code == supplier_code, Transactions.item_code == item_code, Transactions.updated_at >= date).order_by(Transactions.updated_at.desc()).all()
-    else:
-        transaction = db.query(Transactions).filter(Transactions.supplier_code == supplier_code, Transactions.item_code == item_code).order_by(Transactions.updated_at.desc()).all()
-    if not transaction:
-        return {"status": "error", "message": "Transaction not found"}
-    return transaction
+def get_transaction_by_supplier_code_and_item_code(
+    supplier_code: uuid.UUID,
+    item_code: uuid.UUID,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    date: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    query = db.query(Transactions).filter(
+        Transactions.team_id == team_id,
+        Transactions.supplier_code == supplier_code,
+        Transactions.item_code == item_code
+    )
+    return _paginate(query, response, cursor, limit, date, until)
+
+def _require_item(db: Session, team_id: int, item_code: Optional[uuid.UUID]) -> None:
+    """取引の商品がチームに登録されているか確認する（他のチームの商品は存在しないものとして扱う）"""
+    if item_code is None:
+        return
+    if db.scalar(select(Item.item_code).where(Item.team_id == team_id, Item.item_code == item_code)) is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+def _same_transaction(existing: Transactions, transaction: TransactionCreate) -> bool:
+    try:
+        action = ActionType(transaction.action)
+    except ValueError:
+        return False
+    return (
+        str(existing.item_code or "") == str(transaction.item_code or "")
+        and str(existing.supplier_code or "") == str(transaction.supplier_code or "")
+        and existing.action == action
+        and existing.quantity == transaction.quantity
+        and existing.price == transaction.price
+    )
+
+def _replay_transaction(db: Session, team_id: int, key: str, transaction: TransactionCreate) -> Optional[Response]:
+    """
+    Idempotency-Key と同じ冪等キーで登録済みの取引があれば、それをレスポンスとして返す
+    /bulk と同じ transactions.idempotency_key を見るため、どちらのAPIで再送しても二重に登録しない
+    """
+    existing = db.query(Transactions).filter(
+        Transactions.team_id == team_id,
+        Transactions.idempotency_key == key
+    ).first()
+    if existing is None:
+        return None
+    if not _same_transaction(existing, transaction):
+        raise HTTPException(status_code=422, detail="同じ Idempotency-Key で異なる内容のリクエストが送信されました")
+    body = response_from_orm(TransactionRead, existing)
+    return Response(
+        content=json.dumps(jsonable_encoder(body), ensure_ascii=False),
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
 
 @router.post("/", response_model=TransactionRead)
 def add_transaction(
     transaction: TransactionCreate,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id),
+    key: Optional[str] = Depends(idempotency_key)
 ):
-    print(f"Received transaction data: {transaction.dict()}")
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
-    
+    if DEBUG:
+        print(f"Received transaction data: {transaction.dict()}")
+    # 応答を受け取れずに再送された取引は二重に登録せず、登録済みの取引を返す
+    if key:
+        replayed = _replay_transaction(db, team_id, key, transaction)
+        if replayed:
+            return replayed
+    _require_item(db, team_id, transaction.item_code)
     # トランザクション記録
     new_transaction = Transactions(
         **transaction.dict(),
         team_id=team_id,
+        idempotency_key=key,
         updated_at=datetime.now()
     )
     db.add(new_transaction)
-    db.commit()
-    db.refresh(new_transaction)
-    
-    # 商品の在庫数を更新
-    item = db.query(Item).filter(Item.item_code == new_transaction.item_code).first()
-    if item:
-        item.item_quantity += new_transaction.quantity
-        item.updated_at = datetime.now()
-        item.updated_by = new_transaction.updated_by
-        db.commit()
-        db.refresh(item)
+    try:
+        db.flush()
+    except IntegrityError:
+        # 同じキーの同時リクエストに先を越された
+        db.rollback()
+        replayed = _replay_transaction(db, team_id, key, transaction) if key else None
+        if replayed:
+            return replayed
+        raise
     
-    return new_transaction
+    # 商品の在庫数を更新（取引と同じDBトランザクションで、読み込まずに加算する）
+    found = apply_item_quantity_delta(db, team_id, new_transaction.item_code, new_transaction.quantity, new_transaction.updated_by)
+    if found:
+        apply_stock_delta(
+            db,
+            team_id,
+            new_transaction.item_code,
+            new_transaction.quantity,
+            moved_at=new_transaction.updated_at,
+            transaction_id=new_transaction.id
+        )
+    apply_rollup_movements(db, team_id, [(new_transaction.item_code, new_transaction.updated_at, new_transaction.quantity, 1)])
+    # コミットすると属性が読み直しになるため、レスポンスはコミット前に作っておく
+    body = response_from_orm(TransactionRead, new_transaction)
+    db.commit()
+    bump_team_version(team_id, "inventory")
+    if found:
+        queue_stock_changes(db, team_id, {new_transaction.item_code: new_transaction.quantity})
+    return body
+
+async def _read_bulk_payloads(request: Request) -> list:
+    """JSON配列またはNDJSON（1行1件）のリクエストボディを読み込む"""
+    content_type = request.headers.get("content-type", "")
+    too_many = HTTPException(status_code=413, detail=f"一度に登録できる取引は{TRANSACTION_BULK_MAX}件までです")
+    try:
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            payloads = []
+            buffer = b""
+            async for chunk in request.stream():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                payloads.extend(json.loads(line) for line in lines if line.strip())
+                if len(payloads) > TRANSACTION_BULK_MAX:
+                    # 残りのバッファは途中までの行なので読まない
+                    raise too_many
+            if buffer.strip():
+                payloads.append(json.loads(buffer))
+        else:
+            payloads = await request.json()
+            if not isinstance(payloads, list):
+                raise HTTPException(status_code=400, detail="取引の配列を送信してください")
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"JSONとして読み込めません: {e}")
+    if len(payloads) > TRANSACTION_BULK_MAX:
+        raise too_many
+    return payloads
+
+def _ingest_transactions(db: Session, team_id: int, payloads: list) -> dict:
+    results = [None] * len(payloads)
+    rows = []
+    for index, payload in enumerate(payloads):
+        try:
+            rows.append((index, TransactionBulkCreate.parse_obj(payload)))
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "error", "detail": str(e)}
+
+    # 登録済みの冪等キーと商品コードをそれぞれ1回のクエリで確認
+    keys = {t.idempotency_key for _, t in rows if t.idempotency_key}
+    existing_keys = dict(
+        db.query(Transactions.idempotency_key, Transactions.id)
+        .filter(Transactions.team_id == team_id, Transactions.idempotency_key.in_(keys))
+        .all()
+    ) if keys else {}
+    codes = {t.item_code for _, t in rows if t.item_code}
+    known_items = set(
+        db.scalars(select(Item.item_code).where(Item.team_id == team_id, Item.item_code.in_(codes)))
+    ) if codes else set()
+
+    to_insert = []
+    first_index = {}
+    for index, t in rows:
+        key = t.idempotency_key
+        if key and key in existing_keys:
+            results[index] = {"index": index, "status": "duplicate", "id": existing_keys[key]}
+        elif key and key in first_index:
+            results[index] = {"index": index, "status": "duplicate", "duplicate_of": first_index[key]}
+        elif t.item_code and t.item_code not in known_items:
+            results[index] = {"index": index, "status": "error", "detail": "Item not found"}
+        else:
+            if key:
+                first_index[key] = index
+            to_insert.append((index, t))
+
+    if to_insert:
+        now = datetime.now()
+        ids = db.scalars(
+            insert(Transactions).returning(Transactions.id, sort_by_parameter_order=True),
+            [dict(t.dict(), team_id=team_id, updated_at=now) for _, t in to_insert]
+        ).all()
+
+        # 商品ごとに数量を集約して、在庫をまとめて更新
+        changes = {}
+        for (index, t), id in zip(to_insert, ids):
+            results[index] = {"index": index, "status": "created", "id": id}
+            if t.item_code:
+                change = changes.setdefault(t.item_code, {"item_code": t.item_code, "delta": 0, "moved_at": now, "transaction_id": id})
+                change["delta"] += t.quantity
+                change["transaction_id"] = max(change["transaction_id"], id)
+        # 同時に届いたバルク同士でロックの順番が食い違わないよう、商品コード順に更新する
+        ordered = sorted(changes.values(), key=lambda change: change["item_code"])
+        apply_item_quantity_deltas(db, team_id, ordered)
+        apply_stock_deltas(db, team_id, ordered)
+        apply_rollup_movements(db, team_id, [(t.item_code, now, t.quantity, 1) for _, t in to_insert])
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="同じ冪等キーの取引が同時に登録されました。再送してください")
+        bump_team_version(team_id, "inventory")
+        queue_stock_changes(db, team_id, {code: change["delta"] for code, change in changes.items()})
+
+        for result in results:
+            if result and "duplicate_of" in result:
+                result["id"] = results[result["duplicate_of"]].get("id")
+
+    return {
+        "created": sum(1 for r in results if r["status"] == "created"),
+        "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "results": results,
+    }
+
+@router.post("/bulk")
+async def add_transactions_bulk(
+    request: Request,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    """
+    オフライン中にスキャナーに溜まった取引をまとめて登録する
+    取引の挿入と商品ごとの在庫更新を1回のコミットで行い、行ごとの結果を返す
+    """
+    payloads = await _read_bulk_payloads(request)
+    return await run_in_threadpool(_ingest_transactions, db, team_id, payloads)
 
 @router.put("/")
 def update_transaction(
     transaction: TransactionUpdate,
-    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    team_id: int = Depends(get_current_team_id)
 ):
-    print(f"Updating transaction data: {transaction.dict()}")
-    
-    # チームIDをヘッダーから取得
-    team_id = request.headers.get('X-Team-ID')
-    if not team_id:
-        # チームIDが提供されていない場合は、ユーザーの最初のチームを使用
-        from models.schemas import TeamMember
-        user_team = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).first()
-        if not user_team:
-            raise HTTPException(status_code=400, detail="チームに所属していません")
-        team_id = user_team.team_id
-    else:
-        try:
-            team_id = int(team_id)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="無効なチームIDです")
+    if DEBUG:
+        print(f"Updating transaction data: {transaction.dict()}")
     
     db_transaction = db.query(Transactions).filter(
         Transactions.id == transaction.id,
@@ -155,36 +427,72 @@ def update_transaction(
     ).first()
     if not db_transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
+    if "item_code" in transaction.dict(exclude_unset=True):
+        _require_item(db, team_id, transaction.item_code)
+
+    # 上書きする前に元の取引内容を控えておく
+    old_item_code = db_transaction.item_code
+    old_quantity = db_transaction.quantity
+    old_updated_at = db_transaction.updated_at
 
     update_data = transaction.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_transaction, key, value)
     
     setattr(db_transaction, "updated_at", datetime.now())
-    db.commit() 
-    db.refresh(db_transaction)
+    db.flush()
     
-    # 商品の在庫数を更新
-    item = db.query(Item).filter(Item.item_code == db_transaction.item_code).first()
-    if item:
-        # 元の取引の数量を差し引いて、新しい取引の数量を加算
-        old_quantity = db_transaction.quantity
-        new_quantity = transaction.quantity
-        item.item_quantity = item.item_quantity - old_quantity + new_quantity
-        item.updated_at = datetime.now()
-        item.updated_by = db_transaction.updated_by
-        db.commit()
-        db.refresh(item)
+    # 商品の在庫数を更新（元の取引の数量を差し引いて、新しい取引の数量を加算）
+    moved = {}
+    for item_code, delta in _quantity_changes(old_item_code, old_quantity, db_transaction.item_code, db_transaction.quantity):
+        if apply_item_quantity_delta(db, team_id, item_code, delta, db_transaction.updated_by):
+            moved[item_code] = delta
+            apply_stock_delta(
+                db,
+                team_id,
+                item_code,
+                delta,
+                moved_at=db_transaction.updated_at,
+                transaction_id=db_transaction.id
+            )
+    movements = [
+        (old_item_code, old_updated_at, old_quantity, -1),
+        (db_transaction.item_code, db_transaction.updated_at, db_transaction.quantity, 1),
+    ]
+    apply_rollup_movements(db, team_id, movements)
+    adjust_checkpoints(db, team_id, movements)
+    db.commit()
+    bump_team_version(team_id, "inventory")
+    queue_stock_changes(db, team_id, moved)
+    db.refresh(db_transaction)
     
     return db_transaction
 
 @router.delete("/{transaction_id}")
-def delete_transaction(transaction_id: int, db: Session = Depends(get_db)):
-    db_transaction = db.query(Transactions).filter(Transactions.id == transaction_id).first()
+def delete_transaction(
+    transaction_id: int,
+    db: Session = Depends(get_db),
+    team_id: int = Depends(get_current_team_id)
+):
+    db_transaction = db.query(Transactions).filter(
+        Transactions.id == transaction_id,
+        Transactions.team_id == team_id
+    ).first()
     if not db_transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
+
+    # 取り消した取引の数量を在庫から戻す
+    found = apply_item_quantity_delta(db, team_id, db_transaction.item_code, -db_transaction.quantity)
+    if found:
+        apply_stock_delta(db, team_id, db_transaction.item_code, -db_transaction.quantity, moved_at=datetime.now())
+    movements = [(db_transaction.item_code, db_transaction.updated_at, db_transaction.quantity, -1)]
+    apply_rollup_movements(db, team_id, movements)
+    adjust_checkpoints(db, team_id, movements)
     db.delete(db_transaction)
     db.commit()
+    bump_team_version(team_id, "inventory")
+    if found:
+        queue_stock_changes(db, team_id, {db_transaction.item_code: -db_transaction.quantity})
     return RedirectResponse(
         url=f"/inventory/{db_transaction.item_code}", 
         status_code=status.HTTP_303_SEE_OTHER
@@ -0,0 +1,136 @@
+"""
+同じ商品への同時スキャンで在庫数が失われないかを確認する負荷試験
+
+起動中のAPIサーバーに対して、1つの商品へ入庫・出庫の取引を並列で大量に登録し、
+最後に item_quantity と /inventory の在庫が「初期在庫 + 登録に成功した取引の数量の合計」と
+一致するかを確認する。あわせて同じ版数を使った商品の同時編集が1件だけ成功し、
+残りが409になることを確認する。
+
+    uv run python scripts/concurrency_check.py --base-url http://localhost:8000 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+
+import httpx
+
+
+async def setup(client):
+    """検証用のユーザー・チーム・商品を作成し、認証ヘッダーと商品コードを返す"""
+    credentials = {"email": f"concurrency-{uuid.uuid4().hex[:8]}@example.com", "password": uuid.uuid4().hex}
+    response = await client.post("/api/auth/register", json={"name": "concurrency-check", **credentials})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = await client.post("/api/teams/create", json={"name": "concurrency-check"}, headers=headers)
+    response.raise_for_status()
+    headers["X-Team-ID"] = str(response.json()["team"]["id"])
+    response = await client.post(
+        "/item/",
+        json={"item_name": f"concurrency-{uuid.uuid4().hex[:8]}", "item_quantity": 0, "updated_by": "concurrency-check"},
+        headers=headers,
+    )
+    response.raise_for_status()
+    return headers, response.json()["item_code"]
+
+
+async def scan_worker(client, headers, item_code, quantities, applied, failures):
+    while quantities:
+        quantity = quantities.pop()
+        try:
+            response = await client.post(
+                "/transaction/",
+                json={
+                    "item_code": item_code,
+                    "action": "IN" if quantity > 0 else "OUT",
+                    "quantity": quantity,
+                    "updated_by": "concurrency-check",
+                },
+                headers=headers,
+            )
+        except httpx.TransportError:
+            # 応答が返らなかった取引は登録されたかどうか分からない
+            failures.append("transport_error")
+            continue
+        if response.status_code == 200:
+            applied.append(quantity)
+        else:
+            failures.append(response.status_code)
+
+
+async def edit_race(client, headers, item_code, editors):
+    """同じ版数で商品名を同時に編集し、ステータスコードごとの件数を返す"""
+    response = await client.get(f"/item/{item_code}", headers=headers)
+    response.raise_for_status()
+    version = response.json()["version"]
+    responses = await asyncio.gather(*[
+        client.put(f"/item/{item_code}", json={"item_price": float(i), "version": version}, headers=headers)
+        for i in range(editors)
+    ])
+    counts = {}
+    for response in responses:
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+    return counts
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        headers, item_code = await setup(client)
+
+        rng = random.Random(args.seed)
+        quantities = [rng.choice([1, 2, 3, -1, -2]) for _ in range(args.requests)]
+        applied, failures = [], []
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            scan_worker(client, headers, item_code, quantities, applied, failures)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+        edits = await edit_race(client, headers, item_code, args.editors)
+
+        item = (await client.get(f"/item/{item_code}", headers=headers)).json()
+        inventory = (await client.get(f"/inventory/{item_code}", headers=headers)).json()
+
+    expected = sum(applied)
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "scans_per_s": len(applied) / elapsed,
+        "applied": len(applied),
+        "failed": len(failures),
+        "expected_stock": expected,
+        "item_quantity": item["item_quantity"],
+        "inventory_stock": inventory["current_stock"],
+        "edit_statuses": edits,
+    }
+    print(json.dumps(report, indent=2))
+
+    if "transport_error" in failures:
+        print("応答が返らなかった取引があるため在庫数は検証できません。並列数を下げて再実行してください", file=sys.stderr)
+        sys.exit(2)
+
+    ok = (
+        item["item_quantity"] == expected
+        and inventory["current_stock"] == expected
+        and edits.get(200) == 1
+        and edits.get(409, 0) == args.editors - 1
+    )
+    if not ok:
+        print("NG: 在庫数または編集の競合検出が期待どおりではありません", file=sys.stderr)
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同時スキャン時の在庫数の整合性チェック")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--editors", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,92 @@
+"""
+ログイン集中時に他のエンドポイントのレイテンシが悪化しないかを確認する負荷試験
+
+起動中のAPIサーバーに対して、GET /api/auth/me を一定間隔で叩き続けながら
+並列でログインを繰り返し、平常時とログイン集中時のレイテンシ（p50/p95/p99）を比較する。
+
+    uv run python scripts/login_storm.py --base-url http://localhost:8000 --concurrency 32 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies) if latencies else None,
+    }
+
+
+async def probe(client, headers, duration, interval):
+    """認証だけで応答するエンドポイントのレイテンシを計測する"""
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/api/auth/me", headers=headers)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def login_worker(client, credentials, deadline, counter):
+    while time.perf_counter() < deadline:
+        response = await client.post("/api/auth/login", json=credentials)
+        response.raise_for_status()
+        counter.append(1)
+
+
+async def main(args):
+    credentials = {"email": f"storm-{uuid.uuid4().hex[:8]}@example.com", "password": uuid.uuid4().hex}
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        response = await client.post("/api/auth/register", json={"name": "login-storm", **credentials})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        baseline = await probe(client, headers, args.duration, args.interval)
+
+        logins = []
+        deadline = time.perf_counter() + args.duration
+        workers = [
+            asyncio.create_task(login_worker(client, credentials, deadline, logins))
+            for _ in range(args.concurrency)
+        ]
+        storm = await probe(client, headers, args.duration, args.interval)
+        await asyncio.gather(*workers)
+
+    report = {
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "logins_per_s": len(logins) / args.duration,
+        "baseline": summarize(baseline),
+        "during_login_storm": summarize(storm),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ログイン集中時のレイテンシ計測")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+トークンの認証結果のキャッシュと invalidate_user のテスト
+
+    python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+
+_db_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir.name, 'test.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from main import app  # noqa: E402
+from models.db import engine  # noqa: E402
+from models.schemas import Base  # noqa: E402
+from router.auth import invalidate_user, principal_cache  # noqa: E402
+from router.team import membership_cache  # noqa: E402
+
+
+class InvalidateUserTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(engine)
+        cls.client = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        engine.dispose()
+        _db_dir.cleanup()
+
+    def _register(self, email):
+        response = self.client.post("/api/auth/register", json={"name": email, "email": email, "password": "pw"})
+        self.assertEqual(response.status_code, 200, response.text)
+        body = response.json()
+        return body["user"]["id"], {"Authorization": f"Bearer {body['token']}"}
+
+    def _cached_users(self, user_id):
+        return [key for key, (user, _) in principal_cache._data.items() if user.id == user_id]
+
+    def test_revoke_rejects_issued_tokens(self):
+        user_id, headers = self._register("revoked@example.com")
+        self.assertEqual(self.client.get("/api/auth/me", headers=headers).status_code, 200)
+
+        invalidate_user(user_id, revoke_tokens=True)
+        self.assertEqual(self.client.get("/api/auth/me", headers=headers).status_code, 401)
+
+        # 失効させた後にログインし直したトークンは使える
+        response = self.client.post("/api/auth/login", json={"email": "revoked@example.com", "password": "pw"})
+        fresh = {"Authorization": f"Bearer {response.json()['token']}"}
+        self.assertEqual(self.client.get("/api/auth/me", headers=fresh).status_code, 200)
+
+    def test_member_removal_drops_cached_principal_and_membership(self):
+        _, owner = self._register("owner@example.com")
+        member_id, member = self._register("member@example.com")
+        team_id = self.client.post("/api/teams/create", json={"name": "t"}, headers=owner).json()["team"]["id"]
+        response = self.client.post(f"/api/teams/{team_id}/invite", json={"email": "member@example.com"}, headers=owner)
+        self.assertEqual(response.status_code, 200, response.text)
+
+        member_team = dict(member, **{"X-Team-ID": str(team_id)})
+        self.assertEqual(self.client.get("/item/", headers=member_team).status_code, 200)
+        self.assertIn((member_id, team_id), membership_cache)
+        self.assertTrue(self._cached_users(member_id))
+
+        response = self.client.delete(f"/api/teams/{team_id}/members/{member_id}", headers=owner)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertNotIn((member_id, team_id), membership_cache)
+        self.assertFalse(self._cached_users(member_id))
+        self.assertEqual(self.client.get("/item/", headers=member_team).status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()